@@ -0,0 +1,311 @@
+"""End-to-end benchmark for analysing reports (RestService.check_queue() and start_analysis()).
+
+Serves a corpus of article html files from a local web server and queues a report for each, timing the queue as a whole
+(reports per minute) and each stage of analysis (from the report_analysis_metrics table). Each combination of
+--sentence-limits and --max-tasks is run in a separate process so its peak memory (max RSS) is its own.
+
+Pass a directory of .html files with --corpus; otherwise articles are generated from the example uses in the bundled
+attack dictionary. Existing models (threadcomponents/models/model_dict.p) are used if present; otherwise models for
+--techniques techniques are built first. SQLite databases are built in a temporary directory; for PostgreSQL, pass
+--postgresql with the details of a database built with `main.py --build-db` (the password is read from PGPASSWORD) and
+benchmark reports are removed afterwards. Run from the repository root:
+
+    python -m benchmarks.bench_analysis --sentence-limits 100 500 --max-tasks 1 2 --output results.json
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from uuid import uuid4
+
+from threadcomponents.constants import UID, URL
+from threadcomponents.database.dao import Dao
+from threadcomponents.enums import ReportStatus
+from threadcomponents.service.attack_data_svc import AttackDataService
+from threadcomponents.service.data_svc import DataService
+from threadcomponents.service.ml_svc import MLService
+from threadcomponents.service.reg_svc import RegService
+from threadcomponents.service.rest_svc import ANALYSIS_COUNTS, ANALYSIS_STAGES, RestService
+from threadcomponents.service.token_svc import TokenService
+from threadcomponents.service.web_svc import WebService
+
+ATTACK_DICT = os.path.join("threadcomponents", "models", "attack_dict.json")
+FILLER = [
+    "The campaign was first observed by researchers earlier this year.",
+    "Analysts shared the indicators with affected organisations.",
+    "Several victims were located in the manufacturing and energy sectors.",
+    "The group has previously been linked to similar intrusions.",
+]
+# The most regex patterns to seed (one per attack without a model) when the database has none
+MAX_REGEX_PATTERNS = 200
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    """Serves the corpus without logging each request."""
+
+    def log_message(self, *args):
+        pass
+
+
+def serve_corpus(corpus_dir):
+    """Function to serve a directory on a free local port; returns the server's base URL."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), partial(QuietHandler, directory=corpus_dir))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}/"
+
+
+def generate_corpus(corpus_dir, reports, paragraphs, seed=0):
+    """Function to write articles made of the attack dictionary's example uses (so there are attacks to find)."""
+    with open(ATTACK_DICT, encoding="utf-8") as attack_dict_file:
+        example_uses = [use for entry in json.load(attack_dict_file).values() for use in entry.get("example_uses", [])]
+    rng = random.Random(seed)
+    for index in range(reports):
+        lines = [rng.choice(example_uses) if i % 3 else rng.choice(FILLER) for i in range(paragraphs)]
+        body = "".join(f"<p>{line}</p>" for line in lines)
+        html_doc = (
+            f"<html><head><title>Benchmark report {index}</title>"
+            '<meta property="article:published_time" content="2024-01-15"></head>'
+            f"<body><article><h1>Benchmark report {index}</h1>{body}</article></body></html>"
+        )
+        with open(os.path.join(corpus_dir, f"report-{index}.html"), "w", encoding="utf-8") as article_file:
+            article_file.write(html_doc)
+
+
+def git_commit():
+    """Function to return the current commit (or None) to identify which release was benchmarked."""
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def peak_memory_mb():
+    """Function to return the peak resident memory of this process in MB (None if unavailable)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def create_db(args, temp_dir):
+    """Function to return the db to benchmark with."""
+    if args.postgresql:
+        # Import here to avoid PostgreSQL requirements needed for non-PostgreSQL use
+        from threadcomponents.database.thread_postgresql import ThreadPostgreSQL
+
+        db_name, username, host, port = args.postgresql
+        return ThreadPostgreSQL(
+            db_connection_func=lambda: (db_name, username, os.environ.get("PGPASSWORD", ""), host, port)
+        )
+    from threadcomponents.database.thread_sqlite3 import ThreadSQLite
+
+    return ThreadSQLite(os.path.join(temp_dir, "benchmark.db"))
+
+
+def create_services(db, args):
+    """Function to create the services needed to analyse reports (as main.py does)."""
+    dao = Dao(engine=db)
+    web_svc = WebService()
+    data_svc = DataService(dao=dao, web_svc=web_svc)
+    token_svc = TokenService()
+    ml_svc = MLService(token_svc=token_svc)
+    attack_data_svc = AttackDataService()
+    if args.models:
+        ml_svc.dict_loc = args.models
+        # Only analyse with the techniques there are models for
+        model_dict = ml_svc.get_current_models() or dict()
+        attack_data_svc.list_of_techs = [tech for tech in attack_data_svc.list_of_techs if tech[0] in model_dict]
+    rest_svc = RestService(
+        web_svc=web_svc,
+        reg_svc=RegService(),
+        data_svc=data_svc,
+        token_svc=token_svc,
+        ml_svc=ml_svc,
+        attack_data_svc=attack_data_svc,
+        dao=dao,
+        max_tasks=args.max_tasks,
+        sentence_limit=args.sentence_limit,
+    )
+    return dao, data_svc, rest_svc
+
+
+async def prepare_db(dao, data_svc, attack_data_svc, is_postgresql):
+    """Function to build the (SQLite) database and load the attack data and regex patterns it needs."""
+    if not is_postgresql:
+        await data_svc.reload_database()
+        # Load the attacks from the attack dictionary (rather than fetching the latest ATT&CK data)
+        attack_data = {
+            uid: dict(tid=entry["id"], name=entry["name"]) for uid, entry in attack_data_svc.json_tech.items()
+        }
+        await data_svc.update_db_with_flattened_attack_data(attack_data=attack_data)
+    if not await dao.get("regex_patterns"):
+        attacks = await dao.get("attack_uids", equal=dict(inactive=dao.db_false_val))
+        sql_list = [
+            dao.insert_many_sql(
+                "regex_patterns",
+                ["uid", "attack_uid", "regex_pattern"],
+                [(str(uuid4()), attack["uid"], re.escape(attack["name"])) for attack in attacks[:MAX_REGEX_PATTERNS]],
+            )
+        ]
+        await dao.run_sql_list(sql_list=sql_list)
+
+
+async def run_benchmark(args):
+    """Function to analyse every article in the corpus through the queue; returns the results."""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db = create_db(args, temp_dir)
+        dao, data_svc, rest_svc = create_services(db, args)
+        await prepare_db(dao, data_svc, rest_svc.attack_data_svc, bool(args.postgresql))
+        await rest_svc.token_svc.init()
+        # Load the models before timing so the first report isn't slower than the rest
+        await rest_svc.ml_svc.build_pickle_file(rest_svc.attack_data_svc.list_of_techs, dict())
+
+        base_url = serve_corpus(args.corpus)
+        reports = []
+        for filename in sorted(os.listdir(args.corpus)):
+            if not filename.endswith(".html"):
+                continue
+            # Queue each report as RestService.insert_report() does
+            report = dict(title=filename, url=base_url + filename, current_status=ReportStatus.QUEUE.value)
+            report[UID] = await dao.insert_generate_uid("reports", report)
+            rest_svc.get_queue_for_user().append(report[URL])
+            await rest_svc.queue.put(report)
+            reports.append(report)
+
+        start = time.perf_counter()
+        await rest_svc.check_queue()
+        # check_queue() returns once the last report is taken off the queue: wait for it to finish
+        await asyncio.gather(*rest_svc.current_tasks, return_exceptions=True)
+        elapsed = time.perf_counter() - start
+
+        metrics = []
+        for report in reports:
+            metrics += await data_svc.get_analysis_metrics(report_id=report[UID])
+        errored = await dao.get("reports", equal=dict(error=dao.db_true_val))
+        if args.postgresql:
+            for report in reports:
+                await dao.delete("reports", dict(uid=report[UID]))
+                await dao.delete("report_analysis_metrics", dict(report_uid=report[UID]))
+
+    analysed = len(metrics) or 1
+    return dict(
+        db="postgresql" if args.postgresql else "sqlite",
+        sentence_limit=args.sentence_limit,
+        max_tasks=args.max_tasks,
+        techniques=len(rest_svc.attack_data_svc.list_of_techs),
+        reports=len(reports),
+        errored=len(errored),
+        seconds=elapsed,
+        reports_per_minute=(len(reports) * 60 / elapsed) if elapsed else None,
+        peak_memory_mb=peak_memory_mb(),
+        # The mean time of each stage (and the mean counts) per analysed report
+        stage_seconds={stage: sum(m[f"{stage}_time"] for m in metrics) / analysed for stage in ANALYSIS_STAGES},
+        counts={count: sum(m[count] or 0 for m in metrics) / analysed for count in ANALYSIS_COUNTS},
+    )
+
+
+def build_models(techniques, models_path):
+    """Function to build models for the first few techniques (building every model takes a long time)."""
+    token_svc = TokenService()
+    asyncio.run(token_svc.init())
+    ml_svc = MLService(token_svc=token_svc)
+    ml_svc.dict_loc = models_path
+    attack_data_svc = AttackDataService()
+    list_of_techs = attack_data_svc.list_of_techs[:techniques]
+    asyncio.run(ml_svc.build_pickle_file(list_of_techs, attack_data_svc.json_tech, force=True))
+
+
+def run_in_subprocess(args, sentence_limit, max_tasks):
+    """Function to run one benchmark configuration in a new process; returns its results."""
+    command = [sys.executable, "-m", "benchmarks.bench_analysis", "--single", "--corpus", args.corpus]
+    command += ["--sentence-limit", str(sentence_limit), "--max-tasks", str(max_tasks)]
+    if args.models:
+        command += ["--models", args.models]
+    if args.postgresql:
+        command += ["--postgresql", *args.postgresql]
+    output = subprocess.run(command, capture_output=True, text=True)
+    # The results are printed (as JSON) on the last line of the output
+    lines = output.stdout.splitlines()
+    if output.returncode or not lines:
+        problem = f"exit code {output.returncode}" if output.returncode else "no results output"
+        raise RuntimeError(
+            f"Benchmark failed for sentence-limit={sentence_limit} max-tasks={max_tasks} ({problem}):\n{output.stderr}"
+        )
+    return json.loads(lines[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark analysing reports end-to-end.")
+    parser.add_argument("--corpus", help="A directory of .html articles to analyse.")
+    parser.add_argument("--reports", type=int, default=10, help="The number of articles to generate (if no corpus).")
+    parser.add_argument("--paragraphs", type=int, default=60, help="The paragraphs per generated article.")
+    parser.add_argument("--sentence-limits", type=int, nargs="+", default=[100, 500])
+    parser.add_argument("--max-tasks", type=int, nargs="+", default=[1, 2])
+    parser.add_argument("--techniques", type=int, default=20, help="Models to build if there is no models file.")
+    parser.add_argument("--models", help="A models file to use (default: the app's models file if it exists).")
+    parser.add_argument("--postgresql", nargs=4, metavar=("DBNAME", "USER", "HOST", "PORT"))
+    parser.add_argument("--output", help="A file to write the results to as JSON.")
+    parser.add_argument("--single", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--sentence-limit", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        # One configuration (run by the main process): print its results as the last line
+        logging.basicConfig(level=logging.CRITICAL)
+        args.max_tasks = args.max_tasks[0]
+        print(json.dumps(asyncio.run(run_benchmark(args))))
+        return
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        if not args.corpus:
+            args.corpus = os.path.join(temp_dir, "corpus")
+            os.makedirs(args.corpus)
+            generate_corpus(args.corpus, args.reports, args.paragraphs)
+        if not args.models and not os.path.isfile(MLService(token_svc=None).dict_loc):
+            args.models = os.path.join(temp_dir, "model_dict.p")
+            print(f"Building models for {args.techniques} techniques...")
+            build_models(args.techniques, args.models)
+
+        results = []
+        print(f"{'db':>10} {'sentences':>9} {'tasks':>5} {'reports/min':>11} {'peak (MB)':>9}  mean stage times (s)")
+        for sentence_limit in args.sentence_limits:
+            for max_tasks in args.max_tasks:
+                result = run_in_subprocess(args, sentence_limit, max_tasks)
+                results.append(result)
+                stages = " ".join(f"{stage}={seconds:.2f}" for stage, seconds in result["stage_seconds"].items())
+                print(
+                    f"{result['db']:>10} {sentence_limit:>9} {max_tasks:>5} {result['reports_per_minute']:>11.1f} "
+                    f"{result['peak_memory_mb'] or 0:>9.0f}  {stages}"
+                )
+
+    if args.output:
+        summary = dict(
+            commit=git_commit(),
+            date=time.strftime("%Y-%m-%dT%H:%M:%S"),
+            python=platform.python_version(),
+            platform=platform.platform(),
+            results=results,
+        )
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            json.dump(summary, output_file, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+"""Benchmark for flattening ATT&CK STIX data (AttackDataService.flatten_attack_stix_data()).
+
+Compares loading the whole bundle into a stix2 MemoryStore and querying it per object-type with reading the bundle one
+object at a time, checking both produce the same attack data. Time and peak (Python-allocated) memory are reported.
+Pass a downloaded enterprise-attack.json with --bundle; otherwise a bundle is generated from the bundled attack
+dictionary (threadcomponents/models/attack_dict.json). Run from the repository root:
+
+    python -m benchmarks.bench_attack_stix --bundle enterprise-attack.json
+"""
+
+import argparse
+import json
+import os
+import re
+import tempfile
+import time
+import tracemalloc
+import uuid
+
+from stix2 import Filter, MemoryStore
+from threadcomponents.helpers.stix_stream import iter_stix_bundle_objects
+from threadcomponents.service.attack_data_svc import (
+    NO_DESC,
+    AttackDataService,
+    attack_data_get_tid,
+    attack_data_reject,
+)
+
+ATTACK_DICT = os.path.join("threadcomponents", "models", "attack_dict.json")
+TIMESTAMP = "2024-01-01T00:00:00.000Z"
+
+
+def legacy_flatten(stix_memory_store):
+    """The previous flattening: a MemoryStore queried once per object-type."""
+    attack_data = {}
+    for technique in stix_memory_store.query(Filter("type", "=", "attack-pattern")):
+        if attack_data_reject(technique):
+            continue
+        attack_data[technique["id"]] = {
+            "name": technique["name"],
+            "tid": attack_data_get_tid(technique),
+            "example_uses": [],
+            "description": technique.get("description", NO_DESC)
+            .replace("<code>", "")
+            .replace("</code>", "")
+            .replace("\n", "")
+            .encode("ascii", "ignore")
+            .decode("ascii"),
+            "similar_words": [technique["name"]],
+        }
+
+    link_pattern = re.compile(r"\[.*?\]\(.*?\)")
+    citation_pattern = re.compile(r"\(Citation: .*?\)")
+    for relationship in stix_memory_store.query(Filter("type", "=", "relationship")):
+        if attack_data_reject(relationship) or relationship["relationship_type"] != "uses":
+            continue
+        target_ref = relationship["target_ref"]
+        if ("attack-pattern" not in target_ref) or (target_ref not in attack_data):
+            continue
+        example_use = (
+            relationship.get("description", NO_DESC)
+            .replace("<code>", "")
+            .replace("</code>", "")
+            .replace('"', "")
+            .replace(",", "")
+            .replace("\t", "")
+            .replace("  ", " ")
+            .replace("\n", "")
+            .encode("ascii", "ignore")
+            .decode("ascii")
+        )
+        example_use = link_pattern.sub("", example_use)
+        example_use = citation_pattern.sub("", example_use)
+        if example_use[0:2] == "'s":
+            example_use = example_use[3:]
+        example_use = example_use.strip()
+        if len(example_use) > 0:
+            attack_data[target_ref]["example_uses"].append(example_use)
+
+    for object_type in ["malware", "tool"]:
+        for software in stix_memory_store.query(Filter("type", "=", object_type)):
+            if (object_type == "malware" and "description" not in software) or attack_data_reject(software):
+                continue
+            attack_data[software["id"]] = {
+                "tid": attack_data_get_tid(software),
+                "name": software["name"],
+                "description": software.get("description", NO_DESC),
+                "examples": [],
+                "example_uses": [],
+                "similar_words": [software["name"]],
+            }
+    return attack_data
+
+
+def generate_bundle(bundle_file):
+    """Function to write a STIX bundle generated from the bundled attack dictionary."""
+    with open(ATTACK_DICT, encoding="utf-8") as attack_dict_file:
+        attack_dict = json.load(attack_dict_file)
+
+    objects = []
+    for stix_id, entry in attack_dict.items():
+        object_type = stix_id.split("--")[0]
+        stix_object = dict(
+            type=object_type,
+            spec_version="2.1",
+            id=stix_id,
+            created=TIMESTAMP,
+            modified=TIMESTAMP,
+            name=entry["name"],
+            description=entry["description"],
+            external_references=[
+                dict(source_name="mitre-attack", url="https://attack.mitre.org/", external_id=entry["id"])
+            ],
+        )
+        if object_type == "malware":
+            stix_object["is_family"] = True
+        objects.append(stix_object)
+
+        for example_use in entry.get("example_uses", []):
+            objects.append(
+                dict(
+                    type="relationship",
+                    spec_version="2.1",
+                    id=f"relationship--{uuid.uuid4()}",
+                    created=TIMESTAMP,
+                    modified=TIMESTAMP,
+                    relationship_type="uses",
+                    source_ref=f"intrusion-set--{uuid.uuid4()}",
+                    target_ref=stix_id,
+                    description=example_use,
+                )
+            )
+
+    json.dump(dict(type="bundle", id=f"bundle--{uuid.uuid4()}", objects=objects), bundle_file)
+
+
+def measure(func):
+    """Function to return the time, peak memory (MB) and result of calling func()."""
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+    tracemalloc.stop()
+    return elapsed, peak, result
+
+
+def run_legacy(bundle_path):
+    with open(bundle_path, encoding="utf-8") as bundle_file:
+        stix_json = json.load(bundle_file)
+    return legacy_flatten(MemoryStore(stix_data=stix_json["objects"]))
+
+
+def run_streaming(bundle_path):
+    with open(bundle_path, "rb") as bundle_file:
+        return AttackDataService.flatten_attack_stix_data(iter_stix_bundle_objects(bundle_file))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark flattening ATT&CK STIX data.")
+    parser.add_argument("--bundle", help="A STIX bundle (e.g. enterprise-attack.json) to use.")
+    parser.add_argument("--skip-legacy", action="store_true", help="Only measure the streaming flattener.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        bundle_path = args.bundle
+        if not bundle_path:
+            bundle_path = os.path.join(temp_dir, "bundle.json")
+            with open(bundle_path, "w", encoding="utf-8") as bundle_file:
+                generate_bundle(bundle_file)
+        print(f"Bundle: {bundle_path} ({os.path.getsize(bundle_path) / (1024 * 1024):.1f} MB)")
+
+        print(f"{'flattener':>10} {'time (s)':>10} {'peak (MB)':>10}")
+        stream_time, stream_peak, streamed = measure(lambda: run_streaming(bundle_path))
+        if not args.skip_legacy:
+            legacy_time, legacy_peak, legacy = measure(lambda: run_legacy(bundle_path))
+            if legacy != streamed:
+                raise AssertionError("Flattened attack data differs.")
+            print(f"{'legacy':>10} {legacy_time:>10.2f} {legacy_peak:>10.1f}")
+        print(f"{'streaming':>10} {stream_time:>10.2f} {stream_peak:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+"""Load test of the web and REST routes analysts use while reports are being analysed.
+
+Seeds a (temporary SQLite) database with analysed reports, then has concurrent analysts load the index, edit pages and
+exports and add/reject attacks and set statuses through the REST API; meanwhile, the queue analyses reports served
+from a local web server (see bench_analysis.py). The app is served with aiohttp's test utilities (as the tests do) and
+the p50, p95 and p99 latencies of each route are reported. Run from the repository root:
+
+    python -m benchmarks.bench_load --analysts 10 --duration 60 --output results.json
+
+Use --queue-reports 0 to compare against an idle queue.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import tempfile
+import time
+
+from collections import Counter, defaultdict
+from urllib.parse import quote
+from uuid import uuid4
+
+import aiohttp_jinja2
+import jinja2
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+from benchmarks.bench_analysis import (
+    build_models,
+    create_db,
+    create_services,
+    generate_corpus,
+    git_commit,
+    prepare_db,
+    serve_corpus,
+)
+from threadcomponents.enums import ReportStatus
+from threadcomponents.handlers.web_api import WebAPI
+from threadcomponents.reports.report_exporter import ReportExporter
+from threadcomponents.service.ml_svc import MLService
+from threadcomponents.service.web_svc import WebService
+
+PERCENTILES = (50, 95, 99)
+# How often each action is taken relative to the others
+ACTION_WEIGHTS = dict(
+    index=2,
+    edit=6,
+    add_attack=4,
+    reject_attack=3,
+    set_status=1,
+    export_nav=1,
+    export_afb=1,
+    export_pdf=1,
+    export_bulk=1,
+)
+
+
+def percentile(sorted_values, percent):
+    """Function to return the nearest-rank percentile of a sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, round(percent / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def create_app(web_api, web_svc):
+    """Function to create the app with the routes analysts use (as main.py does)."""
+    app = web.Application(middlewares=[WebAPI.req_handler])
+    app.router.add_route("GET", web_svc.get_route(WebService.HOME_KEY), web_api.index)
+    app.router.add_route("GET", web_svc.get_route(WebService.EDIT_KEY), web_api.edit)
+    app.router.add_route("*", web_svc.get_route(WebService.REST_KEY), web_api.rest_api)
+    app.router.add_route("GET", web_svc.get_route(WebService.EXPORT_PDF_KEY), web_api.pdf_export)
+    app.router.add_route("GET", web_svc.get_route(WebService.EXPORT_NAV_KEY), web_api.nav_export)
+    app.router.add_route("GET", web_svc.get_route(WebService.EXPORT_AFB_KEY), web_api.afb_export)
+    app.router.add_route("GET", web_svc.get_route(WebService.EXPORT_BULK_KEY), web_api.bulk_export)
+    aiohttp_jinja2.setup(app, loader=jinja2.FileSystemLoader(os.path.join("webapp", "html")))
+    web_svc.set_internal_app(app)
+    return app
+
+
+async def seed_reports(dao, reports, sentences, rng):
+    """Function to insert analysed reports (awaiting review); returns each report's title and sentences' attacks."""
+    attacks = await dao.get("attack_uids", equal=dict(inactive=dao.db_false_val))
+    seeded = []
+    for index in range(reports):
+        report_id, title = str(uuid4()), f"Load test report {index}"
+        report = dict(
+            uid=report_id,
+            title=title,
+            url=f"https://example.com/load-test/{index}",
+            current_status=ReportStatus.NEEDS_REVIEW.value,
+            error=dao.db_false_val,
+            date_written="2024-01-15",
+        )
+        await dao.insert("reports", report)
+        sentence_rows, hit_rows, sentence_attacks = [], [], dict()
+        for sen_index in range(sentences):
+            sentence_id = str(uuid4())
+            text = f"Sentence {sen_index} of {title} describing what the attackers did."
+            hits = rng.sample(attacks, k=rng.choice([0, 0, 1, 2]))
+            sentence_rows.append((sentence_id, report_id, text, f"<p>{text}</p>", sen_index, bool(hits)))
+            for attack in hits:
+                hit_rows.append((str(uuid4()), attack["uid"], attack["name"], report_id, sentence_id, attack["tid"]))
+            sentence_attacks[sentence_id] = [attack["uid"] for attack in hits]
+        sql_list = [
+            dao.insert_many_sql(
+                "report_sentences", ["uid", "report_uid", "text", "html", "sen_index", "found_status"], sentence_rows
+            ),
+            dao.insert_many_sql(
+                "report_sentence_hits",
+                ["uid", "attack_uid", "attack_technique_name", "report_uid", "sentence_id", "attack_tid"],
+                hit_rows,
+            ),
+        ]
+        await dao.run_sql_list(sql_list=sql_list)
+        seeded.append((title, sentence_attacks))
+    return seeded, [attack["uid"] for attack in attacks]
+
+
+async def analyst(client, seeded, attack_uids, end_time, think_time, latencies, statuses, rng):
+    """Function to act as an analyst reviewing reports until the end time."""
+    actions, weights = list(ACTION_WEIGHTS), list(ACTION_WEIGHTS.values())
+    while time.perf_counter() < end_time:
+        title, sentence_attacks = rng.choice(seeded)
+        title_quoted = quote(title, safe="")
+        sentence_id = rng.choice(list(sentence_attacks))
+        action = rng.choices(actions, weights=weights)[0]
+        if action == "index":
+            route, method, path, data = "GET /", "GET", "/", None
+        elif action == "edit":
+            route, method, path, data = "GET /edit/{file}", "GET", f"/edit/{title_quoted}", None
+        elif action.startswith("export_") and action != "export_bulk":
+            export_type = action.split("_")[1]
+            route, method, path = f"GET /export/{export_type}/{{file}}", "GET", f"/export/{export_type}/{title_quoted}"
+            data = None
+        elif action == "export_bulk":
+            route, method, path, data = "GET /export/bulk", "GET", "/export/bulk?format=nav&container=ndjson", None
+        else:
+            route, method, path = f"POST /rest {action}", "POST", "/rest"
+            data = dict(index=action, sentence_id=sentence_id)
+            if action == "add_attack":
+                data.update(attack_uid=rng.choice(attack_uids))
+            elif action == "reject_attack":
+                data.update(attack_uid=rng.choice(sentence_attacks[sentence_id] or attack_uids))
+            else:
+                data = dict(index=action, report_title=title_quoted, set_status=ReportStatus.COMPLETED.value)
+
+        start = time.perf_counter()
+        async with client.request(method, path, json=data) as response:
+            await response.read()
+            latencies[route].append(time.perf_counter() - start)
+            statuses[route][response.status] += 1
+        if think_time:
+            await asyncio.sleep(rng.uniform(0, 2 * think_time))
+
+
+async def run_load_test(args):
+    """Function to run the analysts against the app while the queue is busy; returns the results."""
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db = create_db(args, temp_dir)
+        dao, data_svc, rest_svc = create_services(db, args)
+        await prepare_db(dao, data_svc, rest_svc.attack_data_svc, is_postgresql=False)
+        seeded, attack_uids = await seed_reports(dao, args.reports, args.sentences, rng)
+
+        # Queued reports are added to the queue when the app is initialised
+        if args.queue_reports:
+            corpus_dir = os.path.join(temp_dir, "corpus")
+            os.makedirs(corpus_dir)
+            generate_corpus(corpus_dir, args.queue_reports, paragraphs=60, seed=args.seed)
+            base_url = serve_corpus(corpus_dir)
+            for filename in sorted(os.listdir(corpus_dir)):
+                report = dict(title=filename, url=base_url + filename, current_status=ReportStatus.QUEUE.value)
+                await dao.insert_generate_uid("reports", report)
+
+        services = dict(
+            dao=dao,
+            data_svc=data_svc,
+            token_svc=rest_svc.token_svc,
+            ml_svc=rest_svc.ml_svc,
+            reg_svc=rest_svc.reg_svc,
+            web_svc=rest_svc.web_svc,
+            rest_svc=rest_svc,
+            attack_data_svc=rest_svc.attack_data_svc,
+        )
+        web_api = WebAPI(services=services, report_exporter=ReportExporter(services=services))
+        await web_api.pre_launch_init()
+        queue_size = rest_svc.queue.qsize()
+
+        latencies, statuses = defaultdict(list), defaultdict(Counter)
+        async with TestClient(TestServer(create_app(web_api, rest_svc.web_svc))) as client:
+            queue_task = asyncio.create_task(rest_svc.check_queue())
+            end_time = time.perf_counter() + args.duration
+            await asyncio.gather(
+                *[
+                    analyst(client, seeded, attack_uids, end_time, args.think_time, latencies, statuses, rng)
+                    for _ in range(args.analysts)
+                ]
+            )
+            queue_task.cancel()
+            await asyncio.gather(queue_task, *rest_svc.current_tasks, return_exceptions=True)
+        still_queued = await dao.get("reports", equal=dict(current_status=ReportStatus.QUEUE.value))
+
+    routes = dict()
+    for route, values in sorted(latencies.items()):
+        values.sort()
+        routes[route] = dict(
+            requests=len(values),
+            # The REST API responds with 500 for refused actions (e.g. completing a report with unconfirmed attacks)
+            statuses={str(status): count for status, count in sorted(statuses[route].items())},
+            **{f"p{percent}_ms": percentile(values, percent) * 1000 for percent in PERCENTILES},
+        )
+    return dict(
+        analysts=args.analysts,
+        duration=args.duration,
+        think_time=args.think_time,
+        queued_reports=queue_size,
+        reports_analysed=queue_size - len(still_queued),
+        routes=routes,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the routes analysts use while reports are analysed.")
+    parser.add_argument("--analysts", type=int, default=10, help="The number of concurrent analysts.")
+    parser.add_argument("--duration", type=float, default=60, help="How long to run for (seconds).")
+    parser.add_argument("--think-time", type=float, default=0.5, help="The mean pause between an analyst's requests.")
+    parser.add_argument("--reports", type=int, default=20, help="The number of analysed reports to seed.")
+    parser.add_argument("--sentences", type=int, default=100, help="The sentences per seeded report.")
+    parser.add_argument("--queue-reports", type=int, default=10, help="The number of reports to analyse meanwhile.")
+    parser.add_argument("--max-tasks", type=int, default=1)
+    parser.add_argument("--sentence-limit", type=int)
+    parser.add_argument("--techniques", type=int, default=20, help="Models to build if there is no models file.")
+    parser.add_argument("--models", help="A models file to use (default: the app's models file if it exists).")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="A file to write the results to as JSON.")
+    args = parser.parse_args()
+    # Only SQLite is supported; bench_analysis.py covers PostgreSQL
+    args.postgresql = None
+    logging.basicConfig(level=logging.CRITICAL)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        if args.queue_reports and not args.models and not os.path.isfile(MLService(token_svc=None).dict_loc):
+            args.models = os.path.join(temp_dir, "model_dict.p")
+            print(f"Building models for {args.techniques} techniques...")
+            build_models(args.techniques, args.models)
+        result = asyncio.run(run_load_test(args))
+
+    print(f"{args.analysts} analysts for {args.duration:.0f}s; {result['reports_analysed']} reports analysed meanwhile")
+    print(f"{'route':<28} {'requests':>8} {'p50 (ms)':>9} {'p95 (ms)':>9} {'p99 (ms)':>9}  statuses")
+    for route, stats in result["routes"].items():
+        print(
+            f"{route:<28} {stats['requests']:>8} {stats['p50_ms']:>9.1f} {stats['p95_ms']:>9.1f} "
+            f"{stats['p99_ms']:>9.1f}  {' '.join(f'{k}:{v}' for k, v in stats['statuses'].items())}"
+        )
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            json.dump(
+                dict(commit=git_commit(), date=time.strftime("%Y-%m-%dT%H:%M:%S"), **result), output_file, indent=2
+            )
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
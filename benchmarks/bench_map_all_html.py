@@ -0,0 +1,119 @@
+"""Benchmark for aligning an article's plaintext with its html (the alignment part of WebService.map_all_html()).
+
+Generates large synthetic articles and compares the single-pass aligner with the previous per-line forward scan,
+checking both produce the same results. Run from the repository root:
+
+    python -m benchmarks.bench_map_all_html --paragraphs 2000 --repeat 3
+"""
+
+import argparse
+import random
+import time
+
+from functools import partial
+
+from bs4 import BeautifulSoup
+from threadcomponents.service.web_svc import BLOCKED_IMG_TYPES, WebService
+
+
+def legacy_alignment(web_svc, html_doc, plaintext, images, sentence_limit=None):
+    """The previous alignment: a forward scan per plaintext line which re-parses elements with images."""
+    results, seen_images = [], []
+    html_elements, htmltags, htmltext = web_svc._extract_html_as_list(html_doc)
+    text_count = 0
+    counter = 0
+    for pt in plaintext:
+        text_match_found = False
+        image_found = False
+        for forward_advancer in range(counter, len(html_elements)):
+            if "src=" in html_elements[forward_advancer] and image_found is False:
+                soup = BeautifulSoup(html_elements[forward_advancer], "html.parser")
+                for cur_img in soup.find_all("img"):
+                    try:
+                        source = cur_img["src"]
+                    except KeyError:
+                        continue
+                    if not source or any(source.lower().endswith(img_type) for img_type in BLOCKED_IMG_TYPES):
+                        continue
+                    img_dict = web_svc._match_and_construct_img(images, source)
+                    if source not in seen_images:
+                        results.append(img_dict)
+                        seen_images.append(source)
+                        image_found = True
+            for temp in [pt, pt.strip()]:
+                if temp == htmltext[forward_advancer]:
+                    results.append(web_svc._construct_text_dict(temp, htmltags[forward_advancer]))
+                    counter = forward_advancer + 1
+                    text_match_found = True
+                    break
+            if text_match_found:
+                break
+        if not text_match_found:
+            if image_found:
+                seen_images = seen_images[:-1]
+                results = results[:-1]
+            else:
+                results.append(web_svc._construct_text_dict(pt, "p"))
+                text_match_found = True
+        if text_match_found:
+            text_count += 1
+        if sentence_limit and (text_count >= sentence_limit):
+            break
+    return results
+
+
+def generate_article(paragraphs, image_every=5, missing_every=7, seed=0):
+    """Function to generate a synthetic article: its html, plaintext lines and image URLs."""
+    rng = random.Random(seed)
+    words = ["adversary", "payload", "loader", "beacon", "registry", "persistence", "domain", "credential", "lateral"]
+    html_parts, plaintext, images = ["<div>"], [], []
+    for i in range(paragraphs):
+        text = " ".join(rng.choice(words) for _ in range(rng.randint(8, 30))) + f" ({i})."
+        if image_every and i % image_every == 0:
+            image = f"https://example.com/images/figure-{i}.png"
+            images.append(image)
+            html_parts.append(f'<figure><img src="/images/figure-{i}.png"></figure>')
+        tag = "h2" if i % 25 == 0 else ("li" if i % 11 == 0 else "p")
+        html_parts.append(f"<{tag}>{text}</{tag}>")
+        # Newspaper's text doesn't always match the html: include lines which can't be found
+        plaintext.append(text if not (missing_every and i % missing_every == 0) else text.upper())
+    html_parts.append("</div>")
+    return "".join(html_parts), plaintext, images
+
+
+def time_call(func, repeat):
+    """Function to return the best time and the result of calling func() repeat times."""
+    best, result = None, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the plaintext-to-html alignment of articles.")
+    parser.add_argument("--paragraphs", type=int, nargs="+", default=[250, 1000, 2000])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--skip-legacy", action="store_true", help="Only time the current aligner.")
+    args = parser.parse_args()
+
+    web_svc = WebService()
+    print(f"{'paragraphs':>10} {'legacy (s)':>12} {'current (s)':>12} {'speed-up':>10}")
+    for paragraphs in args.paragraphs:
+        html_doc, plaintext, images = generate_article(paragraphs)
+        current_time, current = time_call(
+            partial(web_svc.align_plaintext_with_html, html_doc, plaintext, images), args.repeat
+        )
+        if args.skip_legacy:
+            print(f"{paragraphs:>10} {'-':>12} {current_time:>12.4f} {'-':>10}")
+            continue
+        legacy_time, legacy = time_call(partial(legacy_alignment, web_svc, html_doc, plaintext, images), args.repeat)
+        if legacy != current:
+            raise AssertionError(f"Alignment results differ for {paragraphs} paragraphs.")
+        print(f"{paragraphs:>10} {legacy_time:>12.4f} {current_time:>12.4f} {legacy_time / current_time:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
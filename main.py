@@ -9,18 +9,23 @@ import jinja2
 import logging
 import os
 import sys
+import time
 import yaml
 
 from aiohttp import web
 from datetime import datetime
 from threadcomponents.database.dao import Dao, DB_POSTGRESQL, DB_SQLITE
+from threadcomponents.database.thread_db import DEFAULT_REPEATED_QUERY_LIMIT, DEFAULT_SLOW_QUERY_MS
 from threadcomponents.handlers.web_api import WebAPI
+from threadcomponents.helpers.profiling import AnalysisProfiler, DEFAULT_PROFILE_LIMIT
+from threadcomponents.helpers.timing import StageTimer
 from threadcomponents.reports.report_exporter import ReportExporter
+from threadcomponents.reports.report_cache import DEFAULT_CACHE_SIZE
 from threadcomponents.service.attack_data_svc import AttackDataService
 from threadcomponents.service.data_svc import DataService
 from threadcomponents.service.ml_svc import MLService
 from threadcomponents.service.reg_svc import RegService
-from threadcomponents.service.rest_svc import RestService
+from threadcomponents.service.rest_svc import DEFAULT_JOB_LEASE_SECONDS, DEFAULT_JOB_POLL_SECONDS, RestService
 from threadcomponents.service.token_svc import TokenService
 from threadcomponents.service.web_svc import WebService
 
@@ -71,10 +76,11 @@ async def background_tasks(taxii_local=ONLINE_BUILD_SOURCE, build=False, json_fi
     :return: nil
     """
     if build:
-        await data_svc.reload_database()
-        if taxii_local == ONLINE_BUILD_SOURCE:
+        # The database was built before launching; once attack data has been loaded, the monthly update keeps it
+        # up-to-date
+        if taxii_local == ONLINE_BUILD_SOURCE and not await data_svc.has_attack_data():
             try:
-                await rest_svc.fetch_and_update_attack_data()
+                await rest_svc.fetch_and_update_attack_data(full_update=True)
             except Exception as exc:
                 logging.critical(
                     "!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!\n"
@@ -91,17 +97,18 @@ async def background_tasks(taxii_local=ONLINE_BUILD_SOURCE, build=False, json_fi
         await data_svc.insert_keyword_json_data()
 
 
-async def init(host, port, app_setup_func=None):
+async def init(host, port, app_setup_func=None, build=False):
     """
     Function to initialize the aiohttp app
 
     :param host: Address to reach webserver on
     :param port: Port to listen on
     :param app_setup_func: Optional, a function that applies extra config to the app
+    :param build: Defines whether or not the database is built (adding any new tables and columns) before launching
     :return: nil
     """
-    # Run any required functions before the app is launched
-    await website_handler.pre_launch_init()
+    # Run any required functions before the app is launched (building the database first as these use it)
+    await run_startup_steps(StageTimer(enabled=False), build=build)
 
     logging.info("server starting: %s:%s" % (host, port))
     webapp_dir = os.path.join(dir_prefix, "webapp")
@@ -116,7 +123,11 @@ async def init(host, port, app_setup_func=None):
     app.router.add_route("GET", web_svc.get_route(WebService.EXPORT_PDF_KEY), website_handler.pdf_export)
     app.router.add_route("GET", web_svc.get_route(WebService.EXPORT_NAV_KEY), website_handler.nav_export)
     app.router.add_route("GET", web_svc.get_route(WebService.EXPORT_AFB_KEY), website_handler.afb_export)
+    app.router.add_route("GET", web_svc.get_route(WebService.EXPORT_BULK_KEY), website_handler.bulk_export)
     app.router.add_route("GET", web_svc.get_route(WebService.COOKIE_KEY), website_handler.accept_cookies)
+    app.router.add_route("GET", web_svc.get_route(WebService.METRICS_KEY), website_handler.metrics)
+    app.router.add_route("GET", web_svc.get_route(WebService.ANALYSIS_PROFILE_KEY), website_handler.analysis_profile)
+    app.router.add_route("GET", web_svc.get_route(WebService.ANALYSIS_PROGRESS_KEY), website_handler.analysis_progress)
     if not web_svc.is_local:
         app.router.add_route("GET", web_svc.get_route(WebService.WHAT_TO_SUBMIT_KEY), website_handler.what_to_submit)
     app.router.add_static(web_svc.get_route(WebService.STATIC_KEY), os.path.join(webapp_dir, "theme"))
@@ -134,7 +145,15 @@ async def init(host, port, app_setup_func=None):
     await rest_svc.check_queue()
 
 
-def start(host, port, taxii_local=ONLINE_BUILD_SOURCE, build=False, json_file=None, app_setup_func=None):
+def start(
+    host,
+    port,
+    taxii_local=ONLINE_BUILD_SOURCE,
+    build=False,
+    json_file=None,
+    app_setup_func=None,
+    job_poll_seconds=DEFAULT_JOB_POLL_SECONDS,
+):
     """
     Main function to start app
     :param host: Address to reach webserver on
@@ -143,12 +162,15 @@ def start(host, port, taxii_local=ONLINE_BUILD_SOURCE, build=False, json_file=No
     :param build: Defines whether or not a new database will be rebuilt
     :param json_file: Expects a path to the enterprise attack json if the 'offline' build method is called
     :param app_setup_func: Optional, a function that applies extra config to the app
+    :param job_poll_seconds: How often to check the database for analysis jobs queued by other processes
     :return: nil
     """
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
-    loop.run_until_complete(init(host, port, app_setup_func=app_setup_func))
+    loop.run_until_complete(init(host, port, app_setup_func=app_setup_func, build=build))
     loop.create_task(background_tasks(taxii_local=taxii_local, build=build, json_file=json_file))
+    # Schedule the function to pick up reports queued by other processes (or left by stopped ones)
+    asyncio.ensure_future(repeat(job_poll_seconds, rest_svc.poll_jobs))
 
     if taxii_local == ONLINE_BUILD_SOURCE:
         # Schedule the function to update the attack-data (check daily if it is time to do so)
@@ -192,7 +214,26 @@ def retrain_deps(directory_prefix=""):
     return ml_svc, attack_data_svc
 
 
-def main(directory_prefix="", route_prefix=None, app_setup_func=None, db_connection_func=None):
+async def run_startup_steps(stage_timer, build=False):
+    """Function to run the steps before the app is launched, timing each of them."""
+    if build:
+        with stage_timer.stage("reload_database"):
+            await data_svc.reload_database()
+    await website_handler.pre_launch_init(stage_timer=stage_timer)
+
+
+def profile_startup(stage_timer, build=False):
+    """Function to run the steps before the app is launched and report how long each takes (without launching)."""
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        loop.run_until_complete(run_startup_steps(stage_timer, build=build))
+    finally:
+        loop.close()
+    print(stage_timer.report())
+
+
+def main(directory_prefix="", route_prefix=None, app_setup_func=None, db_connection_func=None, stage_timer=None):
     global data_svc, dir_prefix, ml_svc, rest_svc, web_svc, website_handler
 
     dir_prefix = directory_prefix
@@ -212,12 +253,26 @@ def main(directory_prefix="", route_prefix=None, app_setup_func=None, db_connect
         taxii_local = config.get("taxii-local", ONLINE_BUILD_SOURCE)
         js_src = config.get("js-libraries", "js-online-src")
         max_tasks = config.get("max-analysis-tasks", 1)
+        warm_up = config.get("warm_up", False)
+        slow_query_ms = config.get("slow_query_ms", DEFAULT_SLOW_QUERY_MS)
+        repeated_query_limit = config.get("repeated_query_limit", DEFAULT_REPEATED_QUERY_LIMIT)
+        analysis_profile_rate = config.get("analysis_profile_rate", 0)
+        analysis_profile_limit = config.get("analysis_profile_limit", DEFAULT_PROFILE_LIMIT)
         queue_limit = config.get("queue_limit", 0)
+        queue_weights = config.get("queue_weights", None)
+        job_lease_seconds = config.get("job_lease_seconds", DEFAULT_JOB_LEASE_SECONDS)
+        job_poll_seconds = config.get("job_poll_seconds", DEFAULT_JOB_POLL_SECONDS)
+        analysis_stage_timeouts = config.get("analysis_stage_timeouts", None)
         sentence_limit = config.get("sentence_limit", 0)
+        report_cache_size = config.get("report_cache_size", DEFAULT_CACHE_SIZE)
         json_file = config.get("json_file", None)
         update_json_file = config.get("update_json_file", False)
         json_file_indent = config.get("json_file_indent", 2)
         json_file_path = os.path.join(dir_prefix, "threadcomponents", "models", json_file) if json_file else None
+        attack_stix_cache = config.get("attack_stix_cache_dir", None)
+        attack_stix_cache_dir = (
+            os.path.join(dir_prefix, "threadcomponents", "models", attack_stix_cache) if attack_stix_cache else None
+        )
         attack_dict = None
 
     # Set the attack dictionary filepath if applicable
@@ -237,10 +292,38 @@ def main(directory_prefix="", route_prefix=None, app_setup_func=None, db_connect
             sentence_limit = None
     except TypeError:
         raise ValueError(int_error % "sentence_limit")
+    try:
+        report_cache_size = max(0, report_cache_size)
+    except TypeError:
+        raise ValueError(int_error % "report_cache_size")
     try:
         max_tasks = max(1, max_tasks)
     except TypeError:
         raise ValueError(int_error % "max-analysis-tasks")
+    try:
+        job_lease_seconds = max(3, job_lease_seconds)
+    except TypeError:
+        raise ValueError(int_error % "job_lease_seconds")
+    try:
+        job_poll_seconds = max(1, job_poll_seconds)
+    except TypeError:
+        raise ValueError(int_error % "job_poll_seconds")
+    try:
+        slow_query_ms = max(0, slow_query_ms)
+    except TypeError:
+        raise ValueError(int_error % "slow_query_ms")
+    try:
+        repeated_query_limit = max(1, repeated_query_limit)
+    except TypeError:
+        raise ValueError(int_error % "repeated_query_limit")
+    try:
+        analysis_profiler = AnalysisProfiler(
+            directory=os.path.join(dir_prefix, "threadcomponents", "profiles"),
+            sample_rate=analysis_profile_rate,
+            limit=max(1, analysis_profile_limit),
+        )
+    except (TypeError, ValueError):
+        raise ValueError("analysis_profile_rate and analysis_profile_limit config set incorrectly: expected numbers")
     try:
         int(port)
     except ValueError:
@@ -262,14 +345,24 @@ def main(directory_prefix="", route_prefix=None, app_setup_func=None, db_connect
 
         db_obj = ThreadPostgreSQL(db_connection_func=db_connection_func)
 
+    if db_obj:
+        db_obj.set_query_thresholds(slow_query_ms=slow_query_ms, repeated_query_limit=repeated_query_limit)
+
     # Initialise DAO, start services and initiate main function
+    stage_timer = stage_timer or StageTimer(enabled=False)
+    services_started = time.perf_counter()
     dao = Dao(engine=db_obj)
     web_svc = WebService(route_prefix=route_prefix, is_local=is_local)
     reg_svc = RegService()
-    data_svc = DataService(dao=dao, web_svc=web_svc, dir_prefix=dir_prefix)
+    data_svc = DataService(dao=dao, web_svc=web_svc, dir_prefix=dir_prefix, report_cache_size=report_cache_size)
     token_svc = TokenService()
     ml_svc = MLService(token_svc=token_svc, dir_prefix=dir_prefix)
-    attack_file_settings = dict(filepath=json_file_path, update=update_json_file, indent=json_file_indent)
+    attack_file_settings = dict(
+        filepath=json_file_path,
+        update=update_json_file,
+        indent=json_file_indent,
+        stix_cache_dir=attack_stix_cache_dir,
+    )
     attack_data_svc = AttackDataService(dir_prefix=dir_prefix, attack_file_settings=attack_file_settings)
     rest_svc = RestService(
         web_svc=web_svc,
@@ -282,6 +375,10 @@ def main(directory_prefix="", route_prefix=None, app_setup_func=None, db_connect
         sentence_limit=sentence_limit,
         max_tasks=max_tasks,
         attack_data_svc=attack_data_svc,
+        analysis_profiler=analysis_profiler,
+        queue_weights=queue_weights,
+        job_lease_seconds=job_lease_seconds,
+        analysis_deadlines=analysis_stage_timeouts,
     )
     services = dict(
         dao=dao,
@@ -294,15 +391,34 @@ def main(directory_prefix="", route_prefix=None, app_setup_func=None, db_connect
         attack_data_svc=attack_data_svc,
     )
     report_exporter = ReportExporter(services=services)
-    website_handler = WebAPI(services=services, report_exporter=report_exporter, js_src=js_src)
-    start(host, port, taxii_local=taxii_local, build=conf_build, json_file=attack_dict, app_setup_func=app_setup_func)
+    website_handler = WebAPI(services=services, report_exporter=report_exporter, js_src=js_src, warm_up=warm_up)
+    stage_timer.add("create services", time.perf_counter() - services_started)
+    if stage_timer.enabled:
+        profile_startup(stage_timer, build=conf_build)
+        return
+    start(
+        host,
+        port,
+        taxii_local=taxii_local,
+        build=conf_build,
+        json_file=attack_dict,
+        app_setup_func=app_setup_func,
+        job_poll_seconds=job_poll_seconds,
+    )
 
 
 if __name__ == "__main__":
+    # The CPU time used so far: starting the interpreter and importing this module's dependencies
+    import_time = time.process_time()
     # Help information for the program
     parser = argparse.ArgumentParser(description="Launch the Thread webapp.")
     parser.add_argument("--build-db", action="store_true", help="builds the (PostgreSQL) database")
     parser.add_argument("--schema", help="the schema file to use if --build-db option is used")
+    parser.add_argument(
+        "--profile-startup",
+        action="store_true",
+        help="reports how long importing and each step before launching takes (without launching the webapp)",
+    )
     given_args = vars(parser.parse_args())
 
     if given_args.get("build_db"):
@@ -311,5 +427,9 @@ if __name__ == "__main__":
         from threadcomponents.database.thread_postgresql import build_db as build_postgresql
 
         build_postgresql(schema)
+    elif given_args.get("profile_startup"):
+        startup_timer = StageTimer()
+        startup_timer.add("imports (CPU time)", import_time)
+        main(stage_timer=startup_timer)
     else:
         main()
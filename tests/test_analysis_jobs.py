@@ -0,0 +1,274 @@
+import asyncio
+import os
+import sqlite3
+import time
+
+from tests.thread_app_test import ThreadAppTest
+from threadcomponents.enums import ReportStatus
+from threadcomponents.helpers.timing import StagesCancelled, StageTimeout, StageTimer
+from threadcomponents.service import rest_svc as rest_svc_module
+from threadcomponents.service.reg_svc import RegService
+from threadcomponents.service.rest_svc import ANALYSIS_PROGRESS_TABLES, JOBS_TABLE, MAX_JOB_ATTEMPTS, RestService
+from threadcomponents.service.web_svc import WebService
+from unittest.mock import patch
+from uuid import uuid4
+
+
+class TestAnalysisJobs(ThreadAppTest):
+    """A test suite for sharing the analysis of queued reports between Thread processes using the same db."""
+
+    DB_TEST_FILE = os.path.join("tests", "threadtestanalysisjobs.db")
+
+    async def setUpAsync(self):
+        await super().setUpAsync()
+        # The two RestService instances share the db: treat these as separate Thread processes
+        self.other_rest_svc = self.rest_svc_with_limit
+        for rest_svc in [self.rest_svc, self.other_rest_svc]:
+            self.reset_queue(rest_svc=rest_svc)
+        # Start each test without queued reports (deleting their jobs with them)
+        await self.db.run_sql_list(sql_list=[("DELETE FROM reports",)])
+
+    async def queue_report(self, title="Queued report", url="queued.url"):
+        """Function to submit a report to the first process's queue; returns the queued report."""
+        await self.patches_on_insert()
+        resp = await self.client.post("/rest", json=dict(index="insert_report", title=title, url=url))
+        self.assertEqual(resp.status, 204)
+        return self.rest_svc.queue.get_nowait()
+
+    async def test_job_claimed_once(self):
+        """Function to test a job can only be leased to one worker at a time."""
+        report_id = str(uuid4())
+        await self.db.insert("reports", dict(uid=report_id, title="Claimed", url="claimed.url", current_status="queue"))
+        job_id = await self.db.insert_generate_uid(JOBS_TABLE, dict(report_uid=report_id, queued_at=time.time()))
+        now = time.time()
+        self.assertTrue(await self.dao.claim_job(JOBS_TABLE, job_id, "worker-1", now + 60, now))
+        self.assertFalse(await self.dao.claim_job(JOBS_TABLE, job_id, "worker-2", now + 60, now))
+        self.assertTrue(await self.dao.renew_job_lease(JOBS_TABLE, job_id, "worker-1", now + 120))
+        self.assertFalse(await self.dao.renew_job_lease(JOBS_TABLE, job_id, "worker-2", now + 120))
+        # Once the lease has expired, another worker can claim the job
+        self.assertFalse(await self.dao.claim_job(JOBS_TABLE, job_id, "worker-2", now + 180, now + 100))
+        self.assertTrue(await self.dao.claim_job(JOBS_TABLE, job_id, "worker-2", now + 240, now + 121))
+        self.assertFalse(await self.dao.renew_job_lease(JOBS_TABLE, job_id, "worker-1", now + 300))
+        jobs = await self.db.get(JOBS_TABLE, equal=dict(uid=job_id))
+        self.assertEqual((jobs[0]["worker"], jobs[0]["attempts"]), ("worker-2", 2))
+
+    async def test_job_analysed_by_one_process(self):
+        """Function to test a report queued by one process can be analysed by another (and not by both)."""
+        report = await self.queue_report()
+        self.assertEqual(len(await self.data_svc.get_analysis_jobs()), 1)
+
+        self.assertEqual(await self.other_rest_svc.refresh_queue(), 1)
+        self.assertEqual(await self.other_rest_svc.refresh_queue(), 0, "A job was added to the queue twice.")
+        other_report = self.other_rest_svc.queue.get_nowait()
+        self.assertEqual(other_report["uid"], report["uid"])
+        self.assertTrue(await self.other_rest_svc.claim_job(other_report))
+        # The first process has the report queued but can no longer claim it
+        self.assertFalse(await self.rest_svc.claim_job(report))
+        self.assertEqual(self.rest_svc.get_queue_for_user(), [])
+
+        await self.other_rest_svc.finish_job(other_report)
+        self.assertEqual(await self.data_svc.get_analysis_jobs(), [])
+
+    async def test_job_errored_after_attempts(self):
+        """Function to test a report is errored once its job has been claimed too many times."""
+        report = await self.queue_report(title="Unlucky report", url="unlucky.url")
+        await self.db.update(JOBS_TABLE, where=dict(uid=report["job_uid"]), data=dict(attempts=MAX_JOB_ATTEMPTS))
+        self.reset_queue()
+        await self.rest_svc.refresh_queue()
+        self.assertFalse(await self.rest_svc.claim_job(self.rest_svc.queue.get_nowait()))
+        db_report = await self.db.get("reports", equal=dict(uid=report["uid"]))
+        self.assertEqual(db_report[0]["error"], self.db.val_as_true)
+        self.assertEqual(await self.data_svc.get_analysis_jobs(), [])
+
+    async def test_prepare_queue_adds_missing_jobs(self):
+        """Function to test reports queued before jobs were kept in the db are given jobs and queued."""
+        report_id = str(uuid4())
+        report = dict(uid=report_id, title="Old report", url="old.url", current_status=ReportStatus.QUEUE.value)
+        await self.db.insert("reports", report)
+        await self.rest_svc.prepare_queue()
+        await self.rest_svc.prepare_queue()
+        jobs = await self.data_svc.get_analysis_jobs()
+        self.assertEqual([job["uid"] for job in jobs], [report_id])
+        self.assertEqual(self.rest_svc.queue.qsize(), 1)
+        self.assertEqual(self.rest_svc.get_queue_for_user(), ["old.url"])
+
+    async def test_analysis_resumes_from_checkpoint(self):
+        """Function to test an interrupted analysis carries on from the last saved batch of sentences."""
+        report_id = str(uuid4())
+        report = dict(uid=report_id, title="Long report", url="long.url")
+        sentences = [f"Sentence number {index}." for index in range(5)]
+        # Each batch of sentences is analysed without finding anything (patching the instance overrides the class)
+        self.create_patch(target=self.ml_svc, attribute="analyze_html", side_effect=lambda techs, models, batch: batch)
+        # Interrupt the analysis whilst it is on the second batch of sentences
+        interrupted = RuntimeError("Process stopped")
+        reg_analysis = self.create_patch(target=RegService, attribute="analyze_html")
+        reg_analysis.side_effect = [[dict(reg_techniques_found=[])] * 2, interrupted]
+        with patch.object(rest_svc_module, "ANALYSIS_BATCH_SIZE", 2), self.assertRaises(RuntimeError):
+            await self.submit_test_report(report, sentences=sentences)
+
+        progress = await self.db.get("report_sentence_queue_progress", equal=dict(report_uid=report_id))
+        self.assertEqual((progress[0]["sentence_count"], progress[0]["sentences_done"]), (5, 2))
+        saved = await self.db.get("report_sentences", equal=dict(report_uid=report_id))
+        self.assertEqual(len(saved), 2)
+
+        # Resume without fetching the report again
+        reg_analysis.side_effect = lambda patterns, batch: batch
+        fetch = self.create_patch(target=WebService, attribute="map_all_html")
+        with patch.object(rest_svc_module, "ANALYSIS_BATCH_SIZE", 2):
+            await self.rest_svc.start_analysis(criteria=dict(report, attempts=1))
+        fetch.assert_not_called()
+        saved = await self.db.get("report_sentences", equal=dict(report_uid=report_id), order_by_asc=dict(sen_index=1))
+        self.assertEqual([sentence["text"] for sentence in saved], sentences)
+        self.assertEqual(len(await self.db.get("original_html", equal=dict(report_uid=report_id))), 5)
+        self.assertEqual(await self.db.get("report_sentence_queue_progress", equal=dict(report_uid=report_id)), [])
+        db_report = await self.db.get("reports", equal=dict(uid=report_id))
+        self.assertEqual(db_report[0]["current_status"], ReportStatus.NEEDS_REVIEW.value)
+
+    def run_on_second_batch(self, sql, parameters):
+        """Function to return a regex-analysis side effect which runs an SQL statement whilst the second batch of a
+        report's sentences is analysed (as another process would)."""
+
+        def analyse(patterns, batch):
+            if reg_analysis.call_count > 1:
+                with sqlite3.connect(self.DB_TEST_FILE) as conn:
+                    conn.execute(sql, parameters)
+            return batch
+
+        reg_analysis = self.create_patch(target=RegService, attribute="analyze_html", side_effect=analyse)
+        self.create_patch(target=self.ml_svc, attribute="analyze_html", side_effect=lambda techs, models, batch: batch)
+
+    async def test_batch_not_saved_after_checkpoint_moved(self):
+        """Function to test a batch of sentences isn't saved if the checkpoint has moved on since the batch started."""
+        report_id = str(uuid4())
+        report = dict(uid=report_id, title="Raced report", url="raced.url")
+        # e.g. another process saved the second batch first
+        sql = "UPDATE report_sentence_queue_progress SET sentences_done = 4 WHERE report_uid = ?"
+        self.run_on_second_batch(sql, (report_id,))
+        sentences = [f"Sentence number {index}." for index in range(4)]
+        with patch.object(rest_svc_module, "ANALYSIS_BATCH_SIZE", 2), self.assertRaises(RuntimeError):
+            await self.submit_test_report(report, sentences=sentences)
+        saved = await self.db.get("report_sentences", equal=dict(report_uid=report_id))
+        self.assertEqual(len(saved), 2, "A batch was saved over the checkpoint.")
+
+    async def test_batch_not_saved_after_job_taken_over(self):
+        """Function to test an analysis stops (without erroring the report) once another process has its job."""
+        report_id = str(uuid4())
+        report = dict(uid=report_id, title="Taken report", url="taken.url")
+        sql = f"UPDATE {JOBS_TABLE} SET worker = ? WHERE report_uid = ?"
+        self.run_on_second_batch(sql, (self.other_rest_svc.worker_id, report_id))
+
+        # Claim the report's job once it is in the db (before it is analysed)
+        async def claim_report_job(criteria, stage_timer):
+            job_uid = await self.db.insert_generate_uid(JOBS_TABLE, dict(report_uid=report_id, queued_at=time.time()))
+            criteria["job_uid"] = job_uid
+            self.assertTrue(await self.rest_svc.claim_job(criteria))
+            return await fetch_report(criteria, stage_timer)
+
+        fetch_report = self.rest_svc._fetch_report
+        self.create_patch(target=self.rest_svc, attribute="_fetch_report", side_effect=claim_report_job)
+        sentences = [f"Sentence number {index}." for index in range(4)]
+        with patch.object(rest_svc_module, "ANALYSIS_BATCH_SIZE", 2):
+            await self.submit_test_report(report, sentences=sentences)
+        saved = await self.db.get("report_sentences", equal=dict(report_uid=report_id))
+        self.assertEqual(len(saved), 2, "A batch was saved after the job was taken over.")
+        db_report = await self.db.get("reports", equal=dict(uid=report_id))
+        self.assertEqual(db_report[0]["error"], self.db.val_as_false)
+
+    async def assert_no_partial_analysis(self, report_id):
+        """Function to assert nothing is left from a report's stopped analysis."""
+        for table in ANALYSIS_PROGRESS_TABLES:
+            self.assertEqual(await self.db.get(table, equal=dict(report_uid=report_id)), [], f"{table} not cleaned up.")
+
+    def test_stage_deadlines(self):
+        """Function to test stages are stopped once over their deadline or cancelled (and not mid-stage)."""
+        stage_timer = StageTimer(deadlines=dict(slow=0.01))
+        with stage_timer.stage("quick"):
+            time.sleep(0.02)
+        with self.assertRaises(StageTimeout):
+            with stage_timer.stage("slow"):
+                time.sleep(0.02)
+        stage_timer.cancel()
+        with self.assertRaises(StagesCancelled):
+            with stage_timer.stage("quick"):
+                self.fail("A stage started after being cancelled.")
+        services = [self.web_svc, self.reg_svc, self.data_svc, self.token_svc, self.ml_svc, None, self.dao]
+        self.assertRaises(ValueError, RestService, *services, analysis_deadlines=dict(cleanup=10))
+        self.assertRaises(ValueError, RestService, *services, analysis_deadlines=dict(ml="10"))
+
+    async def test_stage_timeout_errors_report(self):
+        """Function to test a report whose analysis goes over a stage's deadline is stopped and cleaned up."""
+        report_id = str(uuid4())
+        report = dict(uid=report_id, title="Slow report", url="slow.url")
+        sentences = [f"Sentence number {index}." for index in range(5)]
+        self.create_patch(target=self.ml_svc, attribute="analyze_html", side_effect=lambda techs, models, batch: batch)
+        # The regex stage goes over its deadline on the second batch of sentences
+        reg_analysis = self.create_patch(target=RegService, attribute="analyze_html")
+        reg_analysis.side_effect = lambda patterns, batch: time.sleep(0.2 * (reg_analysis.call_count > 1)) or batch
+        self.rest_svc.analysis_deadlines = dict(regex=0.1)
+        try:
+            with patch.object(rest_svc_module, "ANALYSIS_BATCH_SIZE", 2), self.assertRaises(StageTimeout):
+                await self.submit_test_report(report, sentences=sentences)
+        finally:
+            self.rest_svc.analysis_deadlines = dict()
+        await self.assert_no_partial_analysis(report_id)
+        self.assertEqual(self.rest_svc.running_analyses, dict())
+
+    async def test_cancel_queued_report(self):
+        """Function to test a queued report can be cancelled, removing it from the queue and erroring it."""
+        report = await self.queue_report(title="Unwanted report", url="unwanted.url")
+        resp = await self.client.post("/rest", json=dict(index="cancel_report", report_title="Unwanted report"))
+        self.assertEqual(resp.status, 204)
+        db_report = await self.db.get("reports", equal=dict(uid=report["uid"]))
+        self.assertEqual(db_report[0]["error"], self.db.val_as_true)
+        self.assertEqual(await self.data_svc.get_analysis_jobs(), [])
+        self.assertEqual(self.rest_svc.get_queue_for_user(), [])
+        # An errored report can't be cancelled again
+        resp = await self.client.post("/rest", json=dict(index="cancel_report", report_title="Unwanted report"))
+        self.assertEqual(resp.status, 500)
+
+    async def test_cancel_running_analysis(self):
+        """Function to test cancelling a report whilst it is analysed stops the analysis and cleans up after it."""
+        report = await self.queue_report(title="Cancelled report", url="cancelled.url")
+        stage_timer = self.rest_svc.running_analyses[report["uid"]] = StageTimer()
+        resp = await self.client.post("/rest", json=dict(index="cancel_report", report_title="Cancelled report"))
+        self.assertEqual(resp.status, 204)
+        self.assertTrue(stage_timer.cancelled)
+        self.rest_svc.running_analyses.clear()
+
+        # The analysis stops once the stage it is on finishes
+        report_id = str(uuid4())
+        report = dict(uid=report_id, title="Stopped report", url="stopped.url")
+        sentences = [f"Sentence number {index}." for index in range(5)]
+        self.create_patch(target=self.ml_svc, attribute="analyze_html", side_effect=lambda techs, models, batch: batch)
+
+        def cancel_second_batch(patterns, batch):
+            if reg_analysis.call_count > 1:
+                self.rest_svc.running_analyses[report_id].cancel()
+            return batch
+
+        reg_analysis = self.create_patch(target=RegService, attribute="analyze_html", side_effect=cancel_second_batch)
+        with patch.object(rest_svc_module, "ANALYSIS_BATCH_SIZE", 2):
+            await self.submit_test_report(report, sentences=sentences)
+        await self.assert_no_partial_analysis(report_id)
+        self.assertEqual(self.rest_svc.running_analyses, dict())
+
+    async def test_stuck_analysis_frees_slot(self):
+        """Function to test a report is errored (freeing its slot) if its analysis is stuck within a stage."""
+        report = dict(uid=str(uuid4()), title="Stuck report", url="stuck.url", current_status=ReportStatus.QUEUE.value)
+        await self.db.insert("reports", report)
+        await self.rest_svc.queue_job(report)
+        stopped = []
+        # The analysis is stuck in a stage until after the report has been given up on
+        stuck = lambda criteria, stage_timer: time.sleep(0.5) or stopped.append(stage_timer.cancelled)  # noqa: E731
+        self.create_patch(target=RestService, attribute="run_start_analysis", side_effect=stuck)
+        self.rest_svc.analysis_timeout = 0.1
+        try:
+            await self.rest_svc.check_queue()
+        finally:
+            self.rest_svc.analysis_timeout = None
+        db_report = await self.db.get("reports", equal=dict(uid=report["uid"]))
+        self.assertEqual(db_report[0]["error"], self.db.val_as_true)
+        self.assertEqual(self.rest_svc.current_tasks, [])
+        self.assertEqual(await self.data_svc.get_analysis_jobs(), [])
+        await asyncio.sleep(0.5)
+        self.assertEqual(stopped, [True])
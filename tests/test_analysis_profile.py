@@ -0,0 +1,85 @@
+import os
+import pstats
+import tempfile
+
+from tests.thread_app_test import ThreadAppTest
+from threadcomponents.helpers.profiling import AnalysisProfiler
+from unittest.mock import patch
+from uuid import uuid4
+
+
+class TestAnalysisProfile(ThreadAppTest):
+    """A test suite for profiling the analysis of reports."""
+
+    DB_TEST_FILE = os.path.join("tests", "threadtestanalysisprofile.db")
+
+    async def setUpAsync(self):
+        await super().setUpAsync()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        profiler = AnalysisProfiler(directory=self.temp_dir.name, sample_rate=1, limit=2)
+        self.create_patch(target=self.rest_svc, attribute="analysis_profiler", new=profiler)
+
+    async def submit_reports(self, count):
+        """Function to submit and analyse some reports; returns their IDs."""
+        report_ids = []
+        for index in range(count):
+            report_id = str(uuid4())
+            await self.submit_test_report(dict(uid=report_id, title=f"Profile {index}", url=f"profile{index}.url"))
+            report_ids.append(report_id)
+        return report_ids
+
+    async def test_profiles_saved_and_downloaded(self):
+        """Function to test a profile is saved for each analysed report, keeping only the latest."""
+        report_ids = await self.submit_reports(3)
+        resp = await self.client.post("/rest", json=dict(index="analysis_profiles"))
+        self.assertEqual(resp.status, 200)
+        profiles = await resp.json()
+        self.assertEqual(profiles["sample_rate"], 1)
+        self.assertEqual(profiles["reports"], report_ids[:0:-1], "Only the latest profiles should be kept.")
+
+        resp = await self.client.get(f"/analysis-profile/{report_ids[-1]}")
+        self.assertEqual(resp.status, 200)
+        self.assertIn(f"filename={report_ids[-1]}.pstats", resp.headers["Content-Disposition"])
+        profile_file = os.path.join(self.temp_dir.name, "downloaded.pstats")
+        with open(profile_file, "wb") as downloaded:
+            downloaded.write(await resp.read())
+        functions = [function_name for _, _, function_name in pstats.Stats(profile_file).stats]
+        self.assertIn("_analyse_report", functions)
+
+        for report_id in [report_ids[0], "no-such-report", "..%2Fsecret"]:
+            resp = await self.client.get(f"/analysis-profile/{report_id}")
+            self.assertEqual(resp.status, 404, msg=f"Profile found for {report_id}.")
+
+    async def test_set_analysis_profiling(self):
+        """Function to test the fraction of reports profiled can be changed (and switched off)."""
+        for sample_rate in [2, "all", None]:
+            resp = await self.client.post("/rest", json=dict(index="set_analysis_profiling", sample_rate=sample_rate))
+            self.assertEqual(resp.status, 500, msg=f"Sample rate {sample_rate} was accepted.")
+
+        resp = await self.client.post("/rest", json=dict(index="set_analysis_profiling", sample_rate=0))
+        self.assertEqual(resp.status, 204)
+        await self.submit_reports(1)
+        self.assertEqual(self.rest_svc.analysis_profiler.list_profiles(), [])
+
+    async def test_metrics_saved_when_profiling_fails(self):
+        """Function to test an analysis whose profiling fails to start raises that error and still saves metrics."""
+        report_id = str(uuid4())
+        with patch.object(self.rest_svc.analysis_profiler, "profile", side_effect=OSError("Profiling failed.")):
+            with self.assertRaisesRegex(OSError, "Profiling failed."):
+                await self.rest_svc.start_analysis(criteria=dict(uid=report_id, url="unprofiled.url"))
+        metrics = await self.db.get("report_analysis_metrics", equal=dict(report_uid=report_id))
+        self.assertEqual(len(metrics), 1)
+        self.assertEqual(metrics[0]["db_query_count"], 0)
+        self.assertNotIn(report_id, self.rest_svc.running_analyses)
+
+    async def test_analysis_not_affected_by_failing_to_save_metrics(self):
+        """Function to test a report is still analysed if its analysis metrics cannot be saved."""
+        self.create_patch(
+            target=self.rest_svc, attribute="save_analysis_metrics", side_effect=ValueError("No metrics.")
+        )
+        with self.assertLogs(level="WARNING") as logs:
+            report_id = (await self.submit_reports(1))[0]
+        self.assertTrue(any("Could not save analysis metrics" in line for line in logs.output))
+        reports = await self.db.get("reports", equal=dict(uid=report_id))
+        self.assertEqual(reports[0]["current_status"], "needs_review")
@@ -0,0 +1,100 @@
+import asyncio
+import os
+import threading
+
+from tests.thread_app_test import ThreadAppTest
+from threadcomponents.helpers.progress import AnalysisProgress
+from unittest import IsolatedAsyncioTestCase
+from uuid import uuid4
+
+
+class TestAnalysisProgress(IsolatedAsyncioTestCase):
+    """A test suite for keeping the progress of analysing reports."""
+
+    async def test_wait_for_update_from_thread(self):
+        """Function to test a client waiting on progress is woken by an update from an analysis thread."""
+        progress = AnalysisProgress()
+        report = dict(uid="r1", title="Report", token=None)
+        waiting = asyncio.create_task(progress.wait(5))
+        await asyncio.sleep(0)
+        thread = threading.Thread(target=progress.update, args=(report,), kwargs=dict(stage="download"))
+        thread.start()
+        await asyncio.wait_for(waiting, timeout=1)
+        thread.join()
+        expected = dict(title="Report", token=None, stage="download", sentences_done=0, sentence_count=0)
+        self.assertEqual(progress.get(), dict(r1=expected))
+
+    def test_reports_filtered_and_finished_forgotten(self):
+        """Function to test progress is only given for a user's reports and finished reports are not kept forever."""
+        progress = AnalysisProgress(finished_limit=1)
+        progress.update(dict(uid="r1", title="Mine", token="abc"), stage="done")
+        progress.update(dict(uid="r2", title="Public"), stage="ml")
+        self.assertEqual(list(progress.get(token="abc")), ["r1"])
+        self.assertEqual(list(progress.get()), ["r2"])
+        etag = progress.get_etag(list(progress.get(all_tokens=True).values()))
+        progress.update(dict(uid="r2", title="Public"), stage="done")
+        self.assertEqual(list(progress.get(all_tokens=True)), ["r2"])
+        self.assertNotEqual(progress.get_etag(list(progress.get(all_tokens=True).values())), etag)
+
+
+class TestAnalysisProgressEndpoint(ThreadAppTest):
+    """A test suite for the route giving the progress of analysing reports."""
+
+    DB_TEST_FILE = os.path.join("tests", "threadtestanalysisprogress.db")
+
+    async def test_analysis_updates_progress(self):
+        """Function to test the analysis of a report updates its progress."""
+        report_id = str(uuid4())
+        await self.submit_test_report(dict(uid=report_id, title="Progressing", url="progressing.url"))
+        resp = await self.client.get("/analysis-progress")
+        self.assertEqual(resp.status, 200)
+        reports = [report for report in (await resp.json())["reports"] if report["title"] == "Progressing"]
+        self.assertEqual(reports, [dict(title="Progressing", stage="done", sentences_done=2, sentence_count=2)])
+        self.assertNotIn(report_id, await resp.text())
+
+    async def test_progress_of_other_processes(self):
+        """Function to test progress includes reports queued and analysed by other processes (read from the db)."""
+        other_rest_svc = self.rest_svc_with_limit
+        report_id = str(uuid4())
+        report = dict(uid=report_id, title="Elsewhere", url="elsewhere.url", current_status="queue")
+        await self.db.insert("reports", report)
+        await other_rest_svc.queue_job(report)
+        expected = dict(title="Elsewhere", stage="queued", sentences_done=0, sentence_count=0)
+        self.assertEqual(await self.get_progress("Elsewhere"), [expected])
+
+        # The other process claims the report and saves some of its progress
+        self.assertTrue(await other_rest_svc.claim_job(other_rest_svc.queue.get_nowait()))
+        progress = dict(report_uid=report_id, sentence_count=4, sentences_done=2)
+        await self.db.insert_generate_uid("report_sentence_queue_progress", progress)
+        expected = dict(title="Elsewhere", stage="analysing", sentences_done=2, sentence_count=4)
+        self.assertEqual(await self.get_progress("Elsewhere"), [expected])
+        # This process can't claim the report so doesn't keep any progress for it
+        self.assertFalse(await self.rest_svc.claim_job(dict(report)))
+        self.assertNotIn(report_id, self.rest_svc.analysis_progress.get(all_tokens=True))
+        await other_rest_svc.finish_job(report)
+        self.assertEqual(await self.get_progress("Elsewhere"), [])
+
+    async def get_progress(self, title):
+        """Function to return the progress given for reports with a title."""
+        resp = await self.client.get("/analysis-progress")
+        return [report for report in (await resp.json())["reports"] if report["title"] == title]
+
+    async def test_long_poll(self):
+        """Function to test a client with the latest progress waits for it to change."""
+        resp = await self.client.get("/analysis-progress")
+        etag = resp.headers["ETag"]
+        resp = await self.client.get("/analysis-progress", params=dict(wait=0.1), headers={"If-None-Match": etag})
+        self.assertEqual(resp.status, 304)
+
+        async def update_soon():
+            await asyncio.sleep(0.1)
+            self.rest_svc.analysis_progress.update(dict(uid=str(uuid4()), title="New report"), stage="queued")
+
+        update = asyncio.create_task(update_soon())
+        resp = await self.client.get("/analysis-progress", params=dict(wait=5), headers={"If-None-Match": etag})
+        await update
+        self.assertEqual(resp.status, 200)
+        self.assertNotEqual(resp.headers["ETag"], etag)
+        self.assertIn("New report", [report["title"] for report in (await resp.json())["reports"]])
+        resp = await self.client.get("/analysis-progress", params=dict(wait="soon"))
+        self.assertEqual(resp.status, 400)
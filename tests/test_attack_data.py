@@ -44,3 +44,26 @@ class TestAttackData(ThreadAppTest):
         self.assertTrue(
             in_dropdown_list in self.web_api.attack_dropdown_list, "New attack did not appear in web-dropdown-list."
         )
+
+    async def test_update_renamed_and_inactive_attacks(self):
+        """Function to test attacks being renamed, made inactive and made active again in one update."""
+        fire, drain = dict(uid="f12345", tid="T1562", name="Fire"), dict(uid="d99999", tid="T1029", name="Drain")
+        # Rename one attack and leave the other out of the current data
+        self.mock_current_attack_data(attack_list=[dict(fire, name="Inferno")])
+        await self.web_api.fetch_and_update_attack_data()
+        attacks = await self.db.get_dict_value_as_key("uid", table="attack_uids", columns=["name", "inactive"])
+        self.assertEqual(attacks["f12345"], dict(name="Inferno", inactive=0), "Attack was not renamed.")
+        self.assertEqual(attacks["d99999"]["inactive"], 1, "Missing attack was not made inactive.")
+        similar_words = await self.db.get("similar_words", equal=dict(attack_uid="f12345"))
+        similar_words = {row["similar_word"] for row in similar_words}
+        self.assertTrue({"Fire", "Inferno"}.issubset(similar_words), "Similar words do not have both names.")
+
+        # The attacks returning to the current data reverses this (without duplicating similar words)
+        self.mock_current_attack_data(attack_list=[fire, drain])
+        await self.web_api.fetch_and_update_attack_data()
+        attacks = await self.db.get_dict_value_as_key("uid", table="attack_uids", columns=["name", "inactive"])
+        self.assertEqual(attacks["f12345"], dict(name="Fire", inactive=0), "Attack was not renamed back.")
+        self.assertEqual(attacks["d99999"]["inactive"], 0, "Returning attack was not made active.")
+        similar_words = await self.db.get("similar_words", equal=dict(attack_uid="f12345"))
+        fire_words = [row["similar_word"] for row in similar_words if row["similar_word"] == "Fire"]
+        self.assertEqual(len(fire_words), 1, "Similar word was duplicated.")
@@ -0,0 +1,87 @@
+import json
+import os
+import tempfile
+
+from threadcomponents.service.attack_data_svc import AttackDataService
+from unittest import TestCase
+from unittest.mock import patch
+
+ATTACK_DICT = {
+    "attack-pattern--1": dict(id="T1562", name="Fire", example_uses=["Uses fire."] * 9, similar_words=["Fire"]),
+    "attack-pattern--2": dict(id="T1029", name="Drain", example_uses=[], similar_words=["Drain"]),
+}
+
+
+class TestAttackSnapshot(TestCase):
+    """A test suite for checking the attack dictionary is loaded lazily and from its snapshot."""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.attack_dict_loc = os.path.join(self.temp_dir.name, "attack_dict.json")
+        self.write_attack_dict(ATTACK_DICT)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def write_attack_dict(self, attack_dict):
+        """Function to write an attack dictionary to the test location."""
+        with open(self.attack_dict_loc, "w", encoding="utf-8") as attack_dict_file:
+            json.dump(attack_dict, attack_dict_file)
+
+    def new_service(self):
+        """Function to return an AttackDataService using the test attack dictionary."""
+        return AttackDataService(attack_file_settings=dict(filepath=self.attack_dict_loc))
+
+    def test_lazy_load_and_snapshot(self):
+        """Function to test the attack dictionary is parsed once and then loaded from its snapshot."""
+        attack_data_svc = self.new_service()
+        self.assertFalse(os.path.isfile(attack_data_svc.snapshot_loc), "Attack dictionary was loaded on creation.")
+        self.assertEqual(attack_data_svc.list_of_techs, [("T1562", "Fire")])
+        self.assertEqual(attack_data_svc.list_of_legacy, ["T1029"])
+        self.assertTrue(os.path.isfile(attack_data_svc.snapshot_loc), "Snapshot was not saved.")
+
+        # A new service (e.g. another worker) uses the snapshot rather than parsing the JSON
+        with patch("threadcomponents.service.attack_data_svc.json.loads") as mock_loads:
+            attack_data_svc = self.new_service()
+            self.assertEqual(attack_data_svc.json_tech, ATTACK_DICT)
+            self.assertEqual(attack_data_svc.list_of_techs, [("T1562", "Fire")])
+        mock_loads.assert_not_called()
+
+    def test_snapshot_regenerated(self):
+        """Function to test a changed attack dictionary is not loaded from an old snapshot."""
+        self.assertEqual(len(self.new_service().json_tech), 2)
+        self.write_attack_dict(dict(ATTACK_DICT, **{"tool--1": dict(id="S0001", name="Axe", example_uses=[])}))
+        attack_data_svc = self.new_service()
+        self.assertEqual(len(attack_data_svc.json_tech), 3, "Old snapshot was used.")
+        self.assertEqual(attack_data_svc.list_of_legacy, ["T1029", "S0001"])
+        # A corrupt snapshot is ignored
+        with open(attack_data_svc.snapshot_loc, "wb") as snapshot_file:
+            snapshot_file.write(b"not a snapshot")
+        self.assertEqual(len(self.new_service().json_tech), 3)
+
+    def test_update_attack_dict_file(self):
+        """Function to test updates are merged, logged and only written to the attack dictionary when changed."""
+        attack_data_svc = AttackDataService(attack_file_settings=dict(filepath=self.attack_dict_loc, update=True))
+        retrieved = dict(tid="T1562", name="Inferno", description="Fire.", example_uses=["Uses fire.", "Burns."])
+        retrieved["similar_words"] = ["Inferno"]
+        attack_data_svc.json_tech["attack-pattern--1"]["description"] = "Fire."
+        attack_data_svc.update_json_tech_with_flattened_attack_data({"attack-pattern--1": retrieved})
+
+        with open(self.attack_dict_loc, encoding="utf-8") as attack_dict_file:
+            entry = json.load(attack_dict_file)["attack-pattern--1"]
+        self.assertEqual(entry["name"], "Inferno")
+        self.assertEqual(entry["example_uses"], ["Uses fire."] * 9 + ["Burns."])
+        self.assertEqual(entry["similar_words"], ["Fire", "Inferno"])
+        with open(attack_data_svc.changelog_loc, encoding="utf-8") as changelog:
+            logged = [json.loads(line) for line in changelog]
+        self.assertEqual(len(logged), 1)
+        self.assertEqual(logged[0]["uid"], "attack-pattern--1")
+        self.assertEqual(logged[0]["example_uses"], ["Burns."])
+        self.assertEqual(logged[0]["name"], ["Fire", "Inferno"])
+
+        # Nothing is written if there are no changes
+        modified = os.path.getmtime(self.attack_dict_loc)
+        with patch("threadcomponents.service.attack_data_svc.os.replace") as mock_replace:
+            attack_data_svc.update_json_tech_with_flattened_attack_data({"attack-pattern--1": dict(retrieved)})
+        mock_replace.assert_not_called()
+        self.assertEqual(os.path.getmtime(self.attack_dict_loc), modified)
@@ -0,0 +1,136 @@
+import json
+import os
+import tempfile
+
+from tests.test_stix_stream import attack_pattern, uses
+from threadcomponents.helpers.attack_stix_cache import compute_delta, index_stix_object
+from threadcomponents.service.attack_data_svc import AttackDataService, attack_data_reject
+from unittest import TestCase
+from unittest.mock import patch
+
+OLD, NEW = "2024-01-01T00:00:00.000Z", "2024-06-01T00:00:00.000Z"
+
+
+class FakeResponse:
+    """A streamed response returning a STIX bundle (or 304 if the ETag matches)."""
+
+    def __init__(self, objects, etag, if_none_match=None):
+        self.etag = etag
+        self.status_code = 304 if (if_none_match == etag) else 200
+        self.headers = dict(ETag=etag)
+        self.body = json.dumps(dict(type="bundle", id="bundle--1", objects=objects)).encode("utf-8")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size=1):
+        for i in range(0, len(self.body), chunk_size):
+            yield self.body[i : i + chunk_size]
+
+
+class TestAttackStixCache(TestCase):
+    """A test suite for checking only changed ATT&CK data is applied."""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.cache_dir = os.path.join(self.temp_dir.name, "attack_stix_cache")
+        self.attack_data_svc = AttackDataService(attack_file_settings=dict(stix_cache_dir=self.cache_dir))
+        self.requests_made = []
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def fetch(self, objects, etag, full_update=False):
+        """Function to fetch the given objects as the latest ATT&CK data and record it as applied."""
+
+        def get(url, headers=None, stream=False):
+            self.requests_made.append(headers)
+            return FakeResponse(objects, etag, if_none_match=(headers or dict()).get("If-None-Match"))
+
+        with patch("threadcomponents.helpers.attack_stix_cache.requests.get", side_effect=get):
+            attack_data, delta = self.attack_data_svc.fetch_attack_data_delta(full_update=full_update)
+        self.attack_data_svc.save_attack_data_delta(delta)
+        return attack_data, delta
+
+    def test_index_stix_object(self):
+        """Function to test only objects which make up our attack data are recorded."""
+        technique = attack_pattern("attack-pattern--1", "Fire", "T1562", modified=OLD)
+        self.assertEqual(index_stix_object(technique, attack_data_reject), [OLD, False, None])
+        revoked = attack_pattern("attack-pattern--1", "Fire", "T1562", modified=NEW, revoked=True)
+        self.assertEqual(index_stix_object(revoked, attack_data_reject), [NEW, True, None])
+        example = uses("attack-pattern--1", "Example", id="relationship--1", modified=OLD)
+        self.assertEqual(index_stix_object(example, attack_data_reject), [OLD, False, "attack-pattern--1"])
+        self.assertIsNone(index_stix_object(uses("malware--1", "Example", modified=OLD), attack_data_reject))
+        self.assertIsNone(index_stix_object(dict(type="intrusion-set", modified=OLD), attack_data_reject))
+
+    def test_compute_delta(self):
+        """Function to test added, changed, revoked and removed objects and the attacks they affect."""
+        old_objects = {
+            "attack-pattern--1": [OLD, False, None],
+            "attack-pattern--2": [OLD, False, None],
+            "attack-pattern--3": [OLD, False, None],
+            "relationship--1": [OLD, False, "attack-pattern--3"],
+            "tool--1": [OLD, False, None],
+        }
+        new_objects = {
+            "attack-pattern--1": [OLD, False, None],
+            "attack-pattern--2": [NEW, False, None],
+            "attack-pattern--3": [OLD, False, None],
+            "relationship--1": [NEW, False, "attack-pattern--1"],
+            "tool--1": [NEW, True, None],
+            "malware--1": [NEW, False, None],
+        }
+        delta = compute_delta(old_objects, new_objects)
+        self.assertEqual(delta["added"], ["malware--1"])
+        self.assertEqual(sorted(delta["changed"]), ["attack-pattern--2", "relationship--1"])
+        self.assertEqual(delta["revoked"], ["tool--1"])
+        self.assertEqual(delta["removed"], [])
+        # The relationship moved between attacks so both are affected
+        predicted = {"attack-pattern--1", "attack-pattern--2", "attack-pattern--3", "tool--1", "malware--1"}
+        self.assertEqual(delta["affected"], predicted)
+
+        delta = compute_delta(new_objects, old_objects)
+        self.assertEqual(delta["removed"], ["malware--1"])
+        self.assertEqual(compute_delta(new_objects, new_objects)["affected"], set())
+
+    def test_only_changes_applied(self):
+        """Function to test unchanged ATT&CK data is not applied again and changes are."""
+        objects = [
+            attack_pattern("attack-pattern--1", "Fire", "T1562", modified=OLD),
+            attack_pattern("attack-pattern--2", "Drain", "T1029", modified=OLD),
+            uses("attack-pattern--1", "Uses fire.", id="relationship--1", modified=OLD),
+        ]
+        # With no previous data, everything is applied
+        attack_data, delta = self.fetch(objects, etag="v1")
+        self.assertTrue(delta["full"])
+        self.assertEqual(set(attack_data), {"attack-pattern--1", "attack-pattern--2"})
+        self.assertTrue(os.path.isfile(os.path.join(self.cache_dir, delta["sha256"] + ".json")))
+
+        # An unmodified bundle (here, by its ETag) means there is nothing to apply
+        attack_data, delta = self.fetch(objects, etag="v1")
+        self.assertEqual(self.requests_made[-1], {"If-None-Match": "v1"})
+        self.assertEqual((attack_data, delta["full"], delta["inactive"]), (dict(), False, set()))
+
+        # A new example use and a revoked technique only affect those techniques
+        objects[1] = attack_pattern("attack-pattern--2", "Drain", "T1029", modified=NEW, revoked=True)
+        objects.append(uses("attack-pattern--1", "Uses more fire.", id="relationship--2", modified=NEW))
+        attack_data, delta = self.fetch(objects, etag="v2")
+        self.assertEqual(list(attack_data), ["attack-pattern--1"])
+        self.assertEqual(attack_data["attack-pattern--1"]["example_uses"], ["Uses fire.", "Uses more fire."])
+        self.assertEqual(delta["inactive"], {"attack-pattern--2"})
+        self.assertEqual(delta["added"], ["relationship--2"])
+        self.assertEqual(delta["revoked"], ["attack-pattern--2"])
+        # Only the latest bundle is kept
+        bundles = [name for name in os.listdir(self.cache_dir) if name != "manifest.json"]
+        self.assertEqual(bundles, [delta["sha256"] + ".json"])
+
+        # A full update returns all attack data even if unchanged
+        attack_data, delta = self.fetch(objects, etag="v2", full_update=True)
+        self.assertEqual(list(attack_data), ["attack-pattern--1"])
+        self.assertTrue(delta["full"])
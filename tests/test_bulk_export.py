@@ -0,0 +1,101 @@
+import io
+import json
+import os
+import zipfile
+
+from tests.thread_app_test import ThreadAppTest
+from threadcomponents.reports.report_exporter import sanitise_filename
+from uuid import uuid4
+
+
+class TestBulkExport(ThreadAppTest):
+    """A test suite for checking bulk-exports of reports."""
+
+    DB_TEST_FILE = os.path.join("tests", "threadtestbulkexport.db")
+
+    async def setUpAsync(self):
+        await super().setUpAsync()
+
+        # Reports from previous tests remain in the db so give these reports unique titles
+        self.report_id, self.report_title = str(uuid4()), f"Sphere Grid {uuid4().hex[:8]}"
+        await self.submit_test_report(
+            dict(uid=self.report_id, title=self.report_title, url="sphere.grid", date_written="2025-07-25"),
+            sentences=["The airship is ready.", "Set course for Zanarkand."],
+            attacks_found=[[("d99999", "Drain")], []],
+            post_confirm_attack=True,
+        )
+        self.old_report_id, self.old_report_title = str(uuid4()), f"Old Guide {uuid4().hex[:8]}"
+        await self.submit_test_report(
+            dict(uid=self.old_report_id, title=self.old_report_title, url="old.guide", date_written="2001-07-19"),
+            sentences=["Kweh."],
+            attacks_found=[[("f32451", "Firaga")]],
+        )
+
+    async def get_bulk_export(self, **params):
+        """Requests a bulk export with the given query parameters and returns the response."""
+        return await self.client.get("/export/bulk", params=params)
+
+    async def get_bulk_zip(self, **params):
+        """Requests a bulk export as a ZIP and returns the opened ZIP file."""
+        response = await self.get_bulk_export(container="zip", **params)
+        self.assertEqual(response.status, 200, msg="Bulk export resulted in a non-200 response.")
+        self.assertEqual(response.content_type, "application/zip", msg="Bulk export is not a ZIP file.")
+        return zipfile.ZipFile(io.BytesIO(await response.read()))
+
+    async def test_zip_contains_each_format(self):
+        """Function to test a ZIP bulk export contains each format for the filtered reports only."""
+        # Export the report on its own first so its (timestamped) AFB file is cached for the bulk export to reuse
+        single = await self.client.get(f"/export/afb/{self.report_title}")
+        exported = await self.get_bulk_zip(start_date="2025-07-25", end_date="2025-07-25")
+        names = exported.namelist()
+        filename = sanitise_filename(self.report_title)
+        for expected in [f"nav/{filename}.json", f"afb/{filename}.afb", f"pdf/{filename}.pdfmake.json"]:
+            self.assertIn(expected, names, msg=f"{expected} missing from bulk export.")
+        self.assertFalse(
+            [name for name in names if sanitise_filename(self.old_report_title) in name],
+            msg="Bulk export includes a report outside of the date range.",
+        )
+
+        # The files should be the same as exporting the report on its own
+        self.assertEqual(json.loads(exported.read(f"afb/{filename}.afb")), await single.json())
+
+    async def test_ndjson_with_selected_format(self):
+        """Function to test an NDJSON bulk export contains one line per report for the selected format."""
+        response = await self.get_bulk_export(container="ndjson", format="nav", end_date="2001-12-31")
+        self.assertEqual(response.content_type, "application/x-ndjson", msg="Bulk export is not NDJSON.")
+        lines = [json.loads(line) for line in (await response.text()).splitlines()]
+        exported = [line for line in lines if line["title"] == self.old_report_title]
+        self.assertEqual(len(exported), 1, msg="Report missing from NDJSON bulk export.")
+        self.assertEqual(exported[0]["format"], "nav")
+        self.assertEqual(exported[0]["data"]["name"], self.old_report_title)
+        self.assertFalse(
+            [line for line in lines if line["title"] == self.report_title],
+            msg="Bulk export includes a report outside of the date range.",
+        )
+
+    async def test_export_reflects_report_changes(self):
+        """Function to test exported files are rebuilt after a report is changed."""
+        filename = f"nav/{sanitise_filename(self.report_title)}.json"
+        before = json.loads((await self.get_bulk_zip(format="nav", start_date="2025-07-25")).read(filename))
+        await self.confirm_report_sentence_attacks(self.report_id, 0, ["f12345"])
+        after = json.loads((await self.get_bulk_zip(format="nav", start_date="2025-07-25")).read(filename))
+        self.assertEqual(len(after["techniques"]), len(before["techniques"]) + 1, msg="Export was not rebuilt.")
+
+    async def test_export_does_not_fill_cache(self):
+        """Function to test a bulk export uses cached files but doesn't cache the files it builds."""
+        await self.data_svc.report_cache.clear()
+        await self.get_bulk_zip(start_date="2025-07-25")
+        self.assertEqual(self.data_svc.report_cache.stats()["reports"], 0, msg="Bulk export filled the cache.")
+
+        # A report viewed on its own stays cached and its cached file is reused
+        await self.client.get(f"/export/afb/{self.report_title}")
+        hits = self.data_svc.report_cache.stats()["hits"]
+        await self.get_bulk_zip(format="afb", start_date="2025-07-25")
+        self.assertEqual(self.data_svc.report_cache.stats()["reports"], 1)
+        self.assertEqual(self.data_svc.report_cache.stats()["hits"], hits + 1, msg="Cached file was not reused.")
+
+    async def test_invalid_query(self):
+        """Function to test invalid bulk-export queries are rejected."""
+        for params in [dict(format="docx"), dict(container="tar"), dict(status="queue"), dict(start_date="25/07")]:
+            response = await self.get_bulk_export(**params)
+            self.assertEqual(response.status, 400, msg=f"Bulk export with {params} was not rejected.")
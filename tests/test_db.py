@@ -1,10 +1,14 @@
+import asyncio
 import os
 import sqlite3
 
 from tests.misc import delete_db_file, SCHEMA_FILE
 from threadcomponents.constants import UID as UID_KEY
 from threadcomponents.enums import ReportStatus
+from threadcomponents.database.dao import Dao
+from threadcomponents.database.thread_db import get_schema_columns, normalise_sql, query_scope
 from threadcomponents.database.thread_sqlite3 import ThreadSQLite
+from threadcomponents.service.data_svc import DataService
 from unittest import IsolatedAsyncioTestCase
 from uuid import UUID
 
@@ -105,6 +109,9 @@ class TestDBSQL(IsolatedAsyncioTestCase):
             "report_sentence_indicators_of_compromise",
             "report_regions",
             "report_sentence_queue_progress",
+            "analysis_jobs",
+            "report_analysis_metrics",
+            "thread_metadata",
         ]
         # Check the expectations against the results
         for table in results:
@@ -211,6 +218,26 @@ class TestDBSQL(IsolatedAsyncioTestCase):
             "reports", expect_found=False, found_check=report_found, fail_msg="deleted data was found", **checking_args
         )
 
+    async def test_snapshot_reads_consistent_data(self):
+        """Function to test queries in a snapshot (including concurrent ones) don't see changes made during it."""
+        report = dict(title="Snapshot Report", url="snap.shot", current_status=ReportStatus.QUEUE.value)
+        report_id = await self.db.insert_generate_uid("reports", report)
+        async with self.db.snapshot() as snapshot:
+            self.assertIsNotNone(snapshot, msg="Snapshot could not be opened.")
+            self.assertEqual(snapshot, self.db.current_snapshot, msg="Snapshot not used in its context.")
+            # Update the report whilst the snapshot is open: this should not be seen by the snapshot's queries
+            update = asyncio.create_task(
+                self.db.update("reports", where=dict(uid=report_id), data=dict(title="Snapshot Report Changed"))
+            )
+            await asyncio.sleep(0.1)
+            results = await asyncio.gather(*[self.db.get("reports", equal=dict(uid=report_id)) for _ in range(3)])
+        await update
+        self.assertIsNone(self.db.current_snapshot, msg="Snapshot still used after its context.")
+        for result in results:
+            self.assertEqual(result[0]["title"], "Snapshot Report", msg="Change seen during snapshot.")
+        result = await self.db.get("reports", equal=dict(uid=report_id))
+        self.assertEqual(result[0]["title"], "Snapshot Report Changed", msg="Change not seen after snapshot.")
+
     async def test_select_with_no_args(self):
         """Function to test behaviour of SELECT statements with no clauses specified."""
         # Both calls should work without raising an error
@@ -303,3 +330,69 @@ class TestDBSQL(IsolatedAsyncioTestCase):
         # ValueError where WHERE-clause data is (a dictionary but) empty
         with self.assertRaises(ValueError, msg="Expected ValueError over empty value for report."):
             await self.db.delete("reports", dict())
+
+    async def test_add_missing_columns(self):
+        """Function to test a schema's new columns are added to existing tables."""
+        old_schema = "CREATE TABLE IF NOT EXISTS migrations (\n    uid VARCHAR(60) PRIMARY KEY\n);"
+        new_schema = (
+            "CREATE TABLE IF NOT EXISTS migrations (\n    uid VARCHAR(60) PRIMARY KEY,\n"
+            "    -- The name (e.g. a, b or c)\n    name VARCHAR(200) DEFAULT 'a',\n"
+            "    UNIQUE (uid, name)\n);"
+        )
+        self.assertEqual(
+            get_schema_columns(new_schema),
+            dict(migrations=dict(uid="uid VARCHAR(60) PRIMARY KEY", name="name VARCHAR(200) DEFAULT 'a'")),
+        )
+        db_file = os.path.join("tests", "threadtestmigrations.db")
+        db = ThreadSQLite(db_file)
+        try:
+            await db.run_sql_list(sql_list=[tuple([old_schema])])
+            await db.insert("migrations", dict(uid="m1"))
+            self.assertEqual(len(await db.add_missing_columns(new_schema)), 1, "Column was not added.")
+            self.assertEqual(await db.get("migrations"), [dict(uid="m1", name="a")])
+            self.assertEqual(await db.add_missing_columns(new_schema), [], "Columns were added twice.")
+        finally:
+            delete_db_file(db_file)
+
+    async def test_build_skipped_when_unchanged(self):
+        """Function to test the database is only built when the schema has changed since the last build."""
+        db_file = os.path.join("tests", "threadtestfingerprint.db")
+        data_svc = DataService(dao=Dao(engine=ThreadSQLite(db_file)), web_svc=None)
+        try:
+            self.assertTrue(await data_svc.reload_database(), "Database was not built initially.")
+            self.assertFalse(await data_svc.reload_database(), "Database was built with an unchanged schema.")
+            self.assertTrue(await data_svc.reload_database(force=True), "Database was not built when forced.")
+            # Seed data is only loaded when its file has changed
+            self.assertIsNotNone(await data_svc.get_changed_fingerprint("test_seed", b"[1]"))
+            await data_svc.set_metadata("test_seed", await data_svc.get_changed_fingerprint("test_seed", b"[1]"))
+            self.assertIsNone(await data_svc.get_changed_fingerprint("test_seed", b"[1]"))
+            self.assertIsNotNone(await data_svc.get_changed_fingerprint("test_seed", b"[1, 2]"))
+        finally:
+            delete_db_file(db_file)
+
+    async def test_query_instrumentation(self):
+        """Function to test db calls are counted per scope and slow or repeated statements are logged."""
+        self.assertEqual(
+            normalise_sql("SELECT * FROM reports\n  WHERE title = 'It''s' AND uid IN (?, ?, ?) LIMIT 10"),
+            "SELECT * FROM reports WHERE title = ? AND uid IN (...) LIMIT ?",
+        )
+        db = ThreadSQLite(self.DB_TEST_FILE)
+        db.set_query_thresholds(repeated_query_limit=2)
+        with self.assertLogs(level="WARNING") as captured, query_scope("test scope") as scope:
+            for uid in ["r1", "r2", "r3", "r4"]:
+                await db.get("reports", equal=dict(uid=uid))
+            await db.run_sql_list(sql_list=[("SELECT uid FROM reports",)])
+        self.assertEqual(scope.count, 5)
+        # The repeated statement is only logged once
+        self.assertEqual(len(captured.records), 1)
+        self.assertIn("Possible N+1 queries in test scope", captured.records[0].getMessage())
+        self.assertIn("SELECT * FROM reports WHERE uid = ?", captured.records[0].getMessage())
+        self.assertEqual(db.metrics.get("thread_db_queries_total", dict(kind="select")), 4)
+
+        # Without a scope, calls are not counted against one but slow calls are still logged
+        db.set_query_thresholds(slow_query_ms=0)
+        with self.assertLogs(level="WARNING") as captured:
+            await db.raw_select("SELECT uid FROM reports WHERE title = 'Slow'")
+        self.assertEqual(scope.count, 5)
+        self.assertIn("Slow query", captured.records[0].getMessage())
+        self.assertIn("WHERE title = ?", captured.records[0].getMessage())
@@ -0,0 +1,76 @@
+import asyncio
+
+from threadcomponents.helpers.fair_queue import FairQueue
+from threadcomponents.service.rest_svc import AUTOMATIC_LANE, BULK_LANE, INTERACTIVE_LANE, PUBLIC, RestService
+from unittest import IsolatedAsyncioTestCase, TestCase
+
+
+class TestFairQueue(TestCase):
+    """A test suite for taking items from a queue's lanes in turn."""
+
+    @staticmethod
+    def drain(queue):
+        """Function to return all items from a queue in the order they are taken."""
+        return [queue.get_nowait() for _ in range(queue.qsize())]
+
+    def test_lanes_take_turns(self):
+        """Function to test a lane with many items doesn't hold up the other lanes."""
+        queue = FairQueue(lambda item: item[0])
+        for item in ["a1", "a2", "a3", "a4", "b1", "c1", "b2"]:
+            queue.put_nowait(item)
+        self.assertEqual(queue.lane_sizes(), dict(a=4, b=2, c=1))
+        self.assertEqual(self.drain(queue), ["a1", "b1", "c1", "a2", "b2", "a3", "a4"])
+        self.assertRaises(asyncio.QueueEmpty, queue.get_nowait)
+
+    def test_weights(self):
+        """Function to test lanes take as many items each turn as their weight (over turns if under 1)."""
+        weights = dict(a=2, b=1, c=0.5)
+        queue = FairQueue(lambda item: item[0], weight_func=weights.get)
+        for lane in "abc":
+            for i in range(1, 5):
+                queue.put_nowait(f"{lane}{i}")
+        taken = self.drain(queue)
+        self.assertEqual(taken[:7], ["a1", "a2", "b1", "a3", "a4", "b2", "c1"])
+        self.assertEqual(taken[7:], ["b3", "b4", "c2", "c3", "c4"])
+
+    def test_new_lane_not_behind_queued_items(self):
+        """Function to test an item in a new lane is taken before the rest of a busy lane."""
+        queue = FairQueue(lambda item: item[0])
+        for i in range(1, 101):
+            queue.put_nowait(f"a{i}")
+        queue.get_nowait()
+        queue.put_nowait("b1")
+        self.assertEqual([queue.get_nowait() for _ in range(2)], ["a2", "b1"])
+        queue.clear()
+        self.assertTrue(queue.empty())
+
+
+class TestQueueLanes(IsolatedAsyncioTestCase):
+    """A test suite for which queue-lane reports are analysed from."""
+
+    def test_get_queue_lane(self):
+        """Function to test reports are queued by user and whether they were submitted individually or by CSV."""
+        self.assertEqual(RestService.get_queue_lane(dict(token=None)), (INTERACTIVE_LANE, PUBLIC))
+        self.assertEqual(RestService.get_queue_lane(dict(token="abc", bulk=True)), (BULK_LANE, "abc"))
+        self.assertEqual(RestService.get_queue_lane(dict(automatically_generated="feed")), (AUTOMATIC_LANE, None))
+
+    async def test_interactive_report_not_behind_csv(self):
+        """Function to test a report submitted on its own is analysed before most of an earlier CSV."""
+        queue = FairQueue(RestService.get_queue_lane, weight_func=lambda lane: 1)
+        for i in range(200):
+            await queue.put(dict(token="bulk-user", bulk=True, uid=f"csv{i}"))
+        await queue.put(dict(token=None, uid="single"))
+        taken = [(await queue.get())["uid"] for _ in range(3)]
+        self.assertEqual(taken, ["csv0", "single", "csv1"])
+
+    async def test_get_waits_for_put(self):
+        """Function to test get() calls waiting on an empty queue are woken by put() in the order they waited."""
+        queue = FairQueue(lambda item: item[0])
+        getters = [asyncio.create_task(queue.get()) for _ in range(3)]
+        await asyncio.sleep(0)
+        getters[1].cancel()
+        for item in ["a1", "b1"]:
+            queue.put_nowait(item)
+        taken = await asyncio.wait_for(asyncio.gather(getters[0], getters[2]), timeout=1)
+        self.assertEqual(taken, ["a1", "b1"])
+        self.assertTrue(queue.empty())
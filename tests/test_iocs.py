@@ -299,6 +299,26 @@ class TestIoCs(ThreadAppTest):
         sen_data = await resp.json()
         self.assertFalse(sen_data["ioc"], msg="IoC-text from sentence-context is not empty after removal.")
 
+    async def test_export_reflects_ioc_changes(self):
+        """Function to test cached export data is refreshed after a sentence's IoC flag changes."""
+        testing = "reloaded.example"
+        report_id, sen_id = await self.create_report_with_sentence(testing)
+        exported = await self.data_svc.export_report_data(report_id=report_id)
+        self.assertFalse(exported["indicators_of_compromise"], msg="Unexpected IoC before flagging sentence.")
+
+        await self.check_allowed_ioc(testing, report_id=report_id, sen_id=sen_id)
+        exported = await self.data_svc.export_report_data(report_id=report_id)
+        self.assertEqual(
+            [ioc[self.FIELD] for ioc in exported["indicators_of_compromise"]],
+            [testing],
+            msg="Exported report data does not include a newly-flagged IoC.",
+        )
+
+        data = dict(index="remove_indicator_of_compromise", sentence_id=sen_id)
+        await self.client.post("/rest", json=data)
+        exported = await self.data_svc.export_report_data(report_id=report_id)
+        self.assertFalse(exported["indicators_of_compromise"], msg="Exported report data includes a removed IoC.")
+
     async def test_suggest_and_save_ioc(self):
         """Function to test suggest-and-save IoC."""
         await self.check_allowed_ioc("d414d90f656356636d6d632c8bae3731", suggest_and_save=True)
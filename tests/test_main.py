@@ -0,0 +1,96 @@
+import main
+import os
+import sqlite3
+
+from tests.misc import delete_db_file
+from threadcomponents.database.dao import Dao
+from threadcomponents.database.thread_sqlite3 import ThreadSQLite
+from threadcomponents.enums import ReportStatus
+from threadcomponents.handlers.web_api import WebAPI
+from threadcomponents.reports.report_exporter import ReportExporter
+from threadcomponents.service.attack_data_svc import AttackDataService
+from threadcomponents.service.data_svc import DataService
+from threadcomponents.service.ml_svc import MLService
+from threadcomponents.service.reg_svc import RegService
+from threadcomponents.service.rest_svc import JOBS_TABLE, RestService
+from threadcomponents.service.token_svc import TokenService
+from threadcomponents.service.web_svc import WebService
+from unittest import IsolatedAsyncioTestCase
+from unittest.mock import AsyncMock, MagicMock, patch
+
+# The tables (queried before launching) as they were before analysis jobs and checkpoints were kept in the db
+OLD_SCHEMA = """
+CREATE TABLE reports (
+    uid VARCHAR(60) PRIMARY KEY, title VARCHAR(210), url VARCHAR(500), current_status VARCHAR(20),
+    error BOOLEAN DEFAULT 0, token VARCHAR(60) DEFAULT NULL, automatically_generated VARCHAR(60) DEFAULT NULL
+);
+CREATE TABLE report_sentence_queue_progress (
+    uid VARCHAR(60) PRIMARY KEY, report_uid VARCHAR(60), sentence_count INTEGER,
+    FOREIGN KEY(report_uid) REFERENCES reports(uid) ON DELETE CASCADE
+);
+"""
+
+
+class TestStartup(IsolatedAsyncioTestCase):
+    """A test suite for starting Thread."""
+
+    DB_TEST_FILE = os.path.join("tests", "threadtestmain.db")
+
+    def setUp(self):
+        """Any setting-up before each test method."""
+        if os.path.isfile(self.DB_TEST_FILE):
+            delete_db_file(self.DB_TEST_FILE)
+        self.addCleanup(delete_db_file, self.DB_TEST_FILE)
+
+    async def test_init_upgrades_old_database(self):
+        """Function to test launching with a database built from an older schema adds what is new before using it."""
+        with sqlite3.connect(self.DB_TEST_FILE) as conn:
+            conn.executescript(OLD_SCHEMA)
+            conn.execute(
+                "INSERT INTO reports (uid, title, url, current_status) VALUES ('r1', 'Old', 'old.url', ?)",
+                (ReportStatus.QUEUE.value,),
+            )
+
+        dao = Dao(engine=ThreadSQLite(self.DB_TEST_FILE))
+        web_svc = WebService()
+        reg_svc = RegService()
+        data_svc = DataService(dao=dao, web_svc=web_svc)
+        token_svc = TokenService()
+        ml_svc = MLService(token_svc=token_svc)
+        attack_data_svc = AttackDataService(attack_file_settings=dict(update=False))
+        rest_svc = RestService(
+            web_svc=web_svc,
+            reg_svc=reg_svc,
+            data_svc=data_svc,
+            token_svc=token_svc,
+            ml_svc=ml_svc,
+            dao=dao,
+            attack_data_svc=attack_data_svc,
+        )
+        services = dict(
+            dao=dao,
+            data_svc=data_svc,
+            token_svc=token_svc,
+            ml_svc=ml_svc,
+            reg_svc=reg_svc,
+            web_svc=web_svc,
+            rest_svc=rest_svc,
+            attack_data_svc=attack_data_svc,
+        )
+        website_handler = WebAPI(services=services, report_exporter=ReportExporter(services=services))
+        globals_patch = dict(data_svc=data_svc, rest_svc=rest_svc, web_svc=web_svc, website_handler=website_handler)
+        site = MagicMock(start=AsyncMock())
+        with patch.multiple(main, create=True, **globals_patch), patch.object(main.web, "TCPSite", return_value=site):
+            with patch.object(RestService, "check_queue") as mock_check_queue:
+                await main.init("localhost", 9999, build=True)
+        mock_check_queue.assert_called_once()
+        # Without warming up, nltk's sentence tokenizer is left to be created when the first report is analysed
+        self.assertIsNone(token_svc._tokenizer_sen)
+
+        jobs = await dao.get(JOBS_TABLE, dict(report_uid="r1"))
+        self.assertEqual(len(jobs), 1, msg="The queued report was not given an analysis job.")
+        report = await dao.get("reports", dict(uid="r1"))
+        self.assertEqual(report[0]["data_version"], 0)
+        with sqlite3.connect(self.DB_TEST_FILE) as conn:
+            progress_columns = [row[1] for row in conn.execute("PRAGMA table_info(report_sentence_queue_progress)")]
+        self.assertTrue({"sentences_done", "article"}.issubset(progress_columns))
@@ -0,0 +1,65 @@
+from tests.thread_app_test import ThreadAppTest
+from threadcomponents.helpers.metrics import MetricsRegistry
+from unittest import TestCase
+
+
+class TestMetricsRegistry(TestCase):
+    """A test suite for rendering metrics in the Prometheus text format."""
+
+    def test_render(self):
+        """Function to test counters, gauges and histograms are rendered with their labels."""
+        registry = MetricsRegistry(buckets=(0.1, 1))
+        registry.describe("requests_total", "counter", "Requests.")
+        registry.describe("duration_seconds", "histogram", "Durations.")
+        registry.inc("requests_total", dict(route="/rest", status=200))
+        registry.inc("requests_total", dict(status=200, route="/rest"), amount=2)
+        registry.set("queue_depth", 4)
+        for value in [0.05, 0.5, 5]:
+            registry.observe("duration_seconds", value, dict(route='/"quoted"'))
+
+        lines = registry.render().splitlines()
+        self.assertIn("# TYPE requests_total counter", lines)
+        self.assertIn('requests_total{route="/rest",status="200"} 3', lines)
+        self.assertIn("# TYPE queue_depth untyped", lines)
+        self.assertIn("queue_depth 4", lines)
+        # Buckets are cumulative, ending with +Inf being the count
+        self.assertIn('duration_seconds_bucket{route="/\\"quoted\\"",le="0.1"} 1', lines)
+        self.assertIn('duration_seconds_bucket{route="/\\"quoted\\"",le="1"} 2', lines)
+        self.assertIn('duration_seconds_bucket{route="/\\"quoted\\"",le="+Inf"} 3', lines)
+        self.assertIn('duration_seconds_sum{route="/\\"quoted\\""} 5.55', lines)
+        self.assertIn('duration_seconds_count{route="/\\"quoted\\""} 3', lines)
+
+
+class TestMetricsEndpoint(ThreadAppTest):
+    """A test suite for the metrics route."""
+
+    async def test_metrics(self):
+        """Function to test requests, the queue and db calls are reported by the metrics route."""
+        await self.client.get("/edit/some-report")
+        await self.client.get("/no-such-page")
+        self.rest_svc.get_queue_for_user(token="secret-token").extend(["a.url", "b.url"])
+        self.addCleanup(self.reset_queue)
+
+        resp = await self.client.get("/metrics")
+        self.assertEqual(resp.status, 200)
+        self.assertTrue(resp.headers["Content-Type"].startswith("text/plain"))
+        lines = (await resp.text()).splitlines()
+        # Requests are labelled by their route's pattern
+        self.assertTrue(
+            any(line.startswith('thread_http_responses_total{method="GET",route="/edit/{file}"') for line in lines)
+        )
+        self.assertTrue(any('route="unmatched",status="404"' in line for line in lines))
+        self.assertTrue(
+            any(
+                line.startswith('thread_http_request_duration_seconds_count{method="GET",route="/edit/{file}"}')
+                for line in lines
+            )
+        )
+        self.assertTrue(any(line.startswith('thread_db_queries_total{kind="select"}') for line in lines))
+        self.assertIn("thread_queue_depth 0", lines)
+        self.assertIn(f"thread_analysis_tasks_max {self.rest_svc.MAX_TASKS}", lines)
+        # Users' tokens are not exposed
+        user_queue_sizes = [line for line in lines if line.startswith("thread_user_queue_size{")]
+        self.assertEqual(len(user_queue_sizes), 1)
+        self.assertTrue(user_queue_sizes[0].endswith(" 2"))
+        self.assertNotIn("secret-token", await resp.text())
@@ -0,0 +1,96 @@
+import os
+
+from tests.misc import delete_db_file, SCHEMA_FILE
+from threadcomponents.database.dao import Dao
+from threadcomponents.database.thread_sqlite3 import ThreadSQLite
+from threadcomponents.reports.report_cache import ReportCache
+from unittest import IsolatedAsyncioTestCase
+
+
+class TestReportCache(IsolatedAsyncioTestCase):
+    """A test suite for checking cached report data is only returned whilst the report is unchanged."""
+
+    DB_TEST_FILE = os.path.join("tests", "threadtestcache.db")
+
+    @classmethod
+    def setUpClass(cls):
+        """Any setting-up before all the test methods."""
+        cls.db = ThreadSQLite(cls.DB_TEST_FILE)
+        cls.dao = Dao(engine=cls.db)
+        with open(SCHEMA_FILE) as schema_opened:
+            cls.schema = schema_opened.read()
+
+    @classmethod
+    def tearDownClass(cls):
+        """Any tidying-up after all the test methods."""
+        delete_db_file(cls.DB_TEST_FILE)
+
+    async def asyncSetUp(self):
+        """Any setting-up before each test method."""
+        await self.db.build(self.schema)
+        await self.db.initialise_column_names()
+        for report_id in ["r1", "r2", "r3"]:
+            await self.dao.delete("reports", dict(uid=report_id))
+            await self.dao.insert("reports", dict(uid=report_id, title=report_id))
+        self.cache = ReportCache(self.dao, max_reports=2)
+        self.loads = 0
+
+    async def load(self):
+        """Function to mimic loading report data from the db."""
+        self.loads += 1
+        return dict(loaded=self.loads)
+
+    async def test_value_reused_until_report_changes(self):
+        """Function to test a cached value is reused and reloaded after a report's data is changed."""
+        first = await self.cache.get_or_load("r1", "edit", self.load)
+        self.assertIs(await self.cache.get_or_load("r1", "edit", self.load), first)
+        await self.cache.bump("r1")
+        self.assertEqual(await self.cache.get_or_load("r1", "edit", self.load), dict(loaded=2))
+
+    async def test_clear_invalidates_all_reports(self):
+        """Function to test clearing the cache reloads every report's data."""
+        await self.cache.get_or_load("r1", "edit", self.load)
+        await self.cache.get_or_load("r2", "edit", self.load)
+        await self.cache.clear()
+        await self.cache.get_or_load("r1", "edit", self.load)
+        await self.cache.get_or_load("r2", "edit", self.load)
+        self.assertEqual(self.loads, 4)
+
+    async def test_stale_value_not_cached(self):
+        """Function to test data read before a report changed is not cached."""
+
+        async def load_then_change():
+            value = await self.load()
+            await self.cache.bump("r1")  # e.g. another request saved a change whilst this one was reading
+            return value
+
+        await self.cache.get_or_load("r1", "edit", load_then_change)
+        self.assertIsNone(self.cache.get("r1", "edit", await self.cache.get_version("r1")))
+
+    async def test_least_recently_used_report_evicted(self):
+        """Function to test the cache keeps data for a limited number of reports."""
+        for report_id in ["r1", "r2", "r1", "r3"]:
+            await self.cache.get_or_load(report_id, "edit", self.load)
+        self.assertEqual(self.loads, 3)
+        self.assertIsNone(self.cache.get("r2", "edit", await self.cache.get_version("r2")))
+        self.assertIsNotNone(self.cache.get("r1", "edit", await self.cache.get_version("r1")))
+
+    async def test_zero_size_disables_cache(self):
+        """Function to test nothing is cached when the cache size is zero."""
+        self.cache = ReportCache(self.dao, max_reports=0)
+        await self.cache.get_or_load("r1", "edit", self.load)
+        await self.cache.get_or_load("r1", "edit", self.load)
+        self.assertEqual(self.loads, 2)
+
+    async def test_change_by_another_process_invalidates_cache(self):
+        """Function to test a report changed through a different cache (e.g. in another worker) is read again."""
+        first = await self.cache.get_or_load("r1", "edit", self.load)
+        await ReportCache(self.dao).bump("r1")
+        self.assertIsNot(await self.cache.get_or_load("r1", "edit", self.load), first)
+        self.assertEqual(self.loads, 2)
+
+    async def test_deleted_report_not_cached(self):
+        """Function to test data for a report which doesn't exist is not cached."""
+        await self.cache.get_or_load("r4", "edit", self.load)
+        await self.cache.get_or_load("r4", "edit", self.load)
+        self.assertEqual(self.loads, 2)
@@ -3,6 +3,7 @@ import os
 from tests.thread_app_test import ThreadAppTest
 from threadcomponents.constants import UID as UID_KEY
 from threadcomponents.enums import ReportStatus
+from threadcomponents.service.rest_svc import ANALYSIS_STAGES
 from uuid import uuid4
 from urllib.parse import quote
 
@@ -174,6 +175,8 @@ class TestReports(ThreadAppTest):
         sen_db_backup = await self.db.get("report_sentences_initial", equal=dict(report_uid=report_id))
         self.assertEqual(len(sen_db), 2, msg="Analysed report did not create 2 sentences in DB.")
         self.assertEqual(len(sen_db_backup), 2, msg="Analysed report did not create 2 sentences in backup DB table.")
+        # Check each sentence was saved with the html element it is in
+        self.assertEqual(sorted((sen["sen_index"], sen["elem_index"]) for sen in sen_db), [(0, 0), (1, 1)])
 
     async def test_start_analysis_error(self):
         """Function to test the behaviour of start analysis when there is an error."""
@@ -196,6 +199,32 @@ class TestReports(ThreadAppTest):
             msg="Analysed report which errors did not have its error flag as True.",
         )
 
+    async def test_start_analysis_metrics(self):
+        """Function to test timings and counts are recorded when analysing a report and can be retrieved."""
+        report_id = str(uuid4())
+        # Submit and analyse a test report
+        await self.submit_test_report(dict(uid=report_id, title="Time This!", url="timing.this"))
+        resp = await self.client.post("/rest", json=dict(index="analysis_metrics", uid=report_id))
+        self.assertEqual(resp.status, 200, msg="Retrieving analysis metrics resulted in a non-200 response.")
+        metrics = await resp.json()
+        self.assertEqual(len(metrics), 1, msg="Analysed report did not have one record of analysis metrics.")
+        self.assertEqual((metrics[0]["url"], metrics[0]["sentence_count"]), ("timing.this", 2))
+        # One of the two sentences has an attack found
+        self.assertEqual((metrics[0]["ml_hit_count"], metrics[0]["reg_hit_count"]), (1, 0))
+        stage_times = [metrics[0][f"{stage}_time"] for stage in ANALYSIS_STAGES]
+        self.assertTrue(all(stage_time >= 0 for stage_time in stage_times))
+        self.assertAlmostEqual(metrics[0]["total_time"], sum(stage_times))
+        self.assertGreater(metrics[0]["persist_time"], 0)
+        self.assertGreater(metrics[0]["db_query_count"], 0)
+
+        # A report which could not be downloaded also has its (partial) metrics recorded
+        error_report_id = str(uuid4())
+        await self.submit_test_report(
+            dict(uid=error_report_id, title="Time This Too!", url="t.i.me"), fail_map_html=True
+        )
+        metrics = await self.data_svc.get_analysis_metrics(report_id=error_report_id)
+        self.assertEqual((len(metrics), metrics[0]["sentence_count"]), (1, 0))
+
     async def test_set_status(self):
         """Function to test setting the status of a report."""
         report_id, report_title = str(uuid4()), "To Set or Not to Set"
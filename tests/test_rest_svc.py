@@ -1,6 +1,14 @@
+import os
+import pickle
+import tempfile
+
 from tests.thread_app_test import ThreadAppTest
+from threadcomponents.service import rest_svc
+from threadcomponents.service.ml_svc import MLService
+from threadcomponents.service.reg_svc import RegService, compile_pattern
 from threadcomponents.service.rest_svc import REPORT_TECHNIQUES_MINIMUM
-from unittest.mock import AsyncMock
+from threadcomponents.service.token_svc import TokenService
+from unittest.mock import AsyncMock, MagicMock
 from uuid import uuid4
 
 
@@ -125,3 +133,105 @@ class TestRestService(ThreadAppTest):
         self.assertIn(
             f"{unique_techniques_count} technique(s) found for report {report_id}", captured.records[0].getMessage()
         )
+
+    async def test_warm_up_should_load_models_once_and_compile_regex_patterns(self):
+        """
+        Function to check the `warm_up` method loads existing models (which are then reused for reports),
+        compiles the regex patterns and runs a sentence through both.
+        """
+        # Arrange
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        ml_svc = MLService(token_svc=self.token_svc)
+        ml_svc.dict_loc = os.path.join(temp_dir.name, "model_dict.p")
+        with open(ml_svc.dict_loc, "wb") as model_file:
+            pickle.dump(dict(f12345=("cv", "logreg")), model_file)
+        ml_svc.analyze_document = AsyncMock(return_value=[True])
+        attack_data_svc = MagicMock(list_of_techs=[("f12345", "Fire"), ("d99999", "Drain")], json_tech=dict())
+        self.create_patch(target=self.rest_svc, attribute="ml_svc", new=ml_svc)
+        self.create_patch(target=self.rest_svc, attribute="attack_data_svc", new=attack_data_svc)
+        self.create_patch(target=rest_svc.importlib, attribute="import_module")
+        sentences = [dict(text="Fire!", html="Fire!", ml_techniques_found=[], reg_techniques_found=[])]
+        self.create_patch(target=TokenService, attribute="tokenize_sentence", return_value=sentences)
+        load_models = self.create_patch(
+            target=ml_svc, attribute="get_pre_saved_models", wraps=ml_svc.get_pre_saved_models
+        )
+        await self.db.insert(
+            "regex_patterns", dict(uid=str(uuid4()), attack_uid="f12345", regex_pattern="warm.?up|fire")
+        )
+        compile_pattern.cache_clear()
+
+        # Act
+        await self.rest_svc.warm_up()
+        rebuilt, model_dict = await ml_svc.build_pickle_file(attack_data_svc.list_of_techs, dict())
+
+        # Assert
+        self.assertEqual(sentences[0]["ml_techniques_found"], [("f12345", "Fire")])
+        self.assertEqual(sentences[0]["reg_techniques_found"], ["f12345"])
+        self.assertEqual((rebuilt, model_dict), (False, dict(f12345=("cv", "logreg"))))
+        load_models.assert_called_once()
+        self.assertEqual(compile_pattern.cache_info().hits, 1)
+
+    async def prescan_test_report(self, title, techniques, sentence_count=10, sample_size=4, minimum=3):
+        """Function to analyse an automatically-generated report (prescanning a sample of its sentences) whose
+        sentences have the given techniques in turn; returns the report ID, the sentences regex-analysed each time and
+        a mock of removing reports."""
+        report_id = str(uuid4())
+        report = dict(uid=report_id, title=title, url=f"{title}.url", automatically_generated=self.dao.db_true_val)
+        sentences = [f"Sentence number {index}." for index in range(sentence_count)]
+        self.create_patch(target=self.ml_svc, attribute="analyze_html", side_effect=lambda techs, models, batch: batch)
+        analysed = []
+
+        def find_techniques(patterns, batch):
+            analysed.append([sentence["text"] for sentence in batch])
+            for sentence in batch:
+                index = int(sentence["text"].split()[-1].strip("."))
+                if techniques:
+                    sentence["reg_techniques_found"].append(techniques[index % len(techniques)])
+            return batch
+
+        self.create_patch(target=RegService, attribute="analyze_html", side_effect=find_techniques)
+        self.create_patch(target=rest_svc, attribute="PRESCAN_SAMPLE_SIZE", new=sample_size)
+        self.create_patch(target=rest_svc, attribute="REPORT_TECHNIQUES_MINIMUM", new=minimum)
+        remove_report = self.create_patch(target=self.data_svc, attribute="remove_report_by_id")
+        await self.submit_test_report(report, sentences=sentences)
+        return report_id, analysed, remove_report
+
+    async def test_prescan_removes_report_unlikely_to_have_enough_techniques(self):
+        """Function to test an automatically-generated report is removed if a sample of it has too few techniques."""
+        # The sample has 1 technique (from the ML analysis of its odd-numbered sentences): 2.5 estimated for 10
+        # sentences
+        report_id, analysed, remove_report = await self.prescan_test_report("Unpromising", techniques=[], minimum=6)
+        self.assertEqual(
+            analysed, [["Sentence number 0.", "Sentence number 2.", "Sentence number 5.", "Sentence number 7."]]
+        )
+        remove_report.assert_called_once_with(report_id=report_id)
+        self.assertEqual(await self.db.get("report_sentences", equal=dict(report_uid=report_id)), [])
+
+    async def test_prescan_keeps_report_likely_to_have_enough_techniques(self):
+        """Function to test an automatically-generated report is analysed (without re-analysing its sample) if a
+        sample of it has enough techniques."""
+        techniques = ["f12345", "f32451", "d99999"]
+        report_id, analysed, remove_report = await self.prescan_test_report("Promising", techniques=techniques)
+        self.assertEqual(
+            sorted(sentence for batch in analysed for sentence in batch),
+            sorted(f"Sentence number {index}." for index in range(10)),
+        )
+        db_report = await self.db.get("reports", equal=dict(uid=report_id))
+        self.assertEqual(db_report[0]["current_status"], "needs_review")
+        hits = await self.db.get("report_sentence_hits", equal=dict(report_uid=report_id))
+        self.assertEqual(len(hits), 10)
+        remove_report.assert_not_called()
+
+    async def test_prescan_keeps_report_near_threshold(self):
+        """Function to test a report whose sample scales up to just under the techniques threshold is still analysed
+        (as the estimate could be low)."""
+        # 2 techniques in a sample of 100 of 201 sentences estimates 4.02 techniques for a threshold of 5 (the sample
+        # is of even-numbered sentences)
+        techniques = ["f12345", "f32451", "d99999", "f32451"]
+        report_id, analysed, _ = await self.prescan_test_report(
+            "Borderline", techniques=techniques, sentence_count=201, sample_size=100, minimum=5
+        )
+        self.assertEqual(
+            sum(len(batch) for batch in analysed), 201, msg="Report was removed after its sample was analysed."
+        )
@@ -0,0 +1,60 @@
+import io
+import json
+
+from threadcomponents.helpers.stix_stream import iter_stix_bundle_objects
+from threadcomponents.service.attack_data_svc import AttackDataService
+from unittest import TestCase
+
+
+def attack_pattern(uid, name, tid, **kwargs):
+    """Function to return a STIX attack-pattern."""
+    refs = [dict(source_name="mitre-attack", url=f"https://attack.mitre.org/techniques/{tid}", external_id=tid)]
+    return dict(type="attack-pattern", id=uid, name=name, external_references=refs, **kwargs)
+
+
+def uses(target_ref, description, **kwargs):
+    """Function to return a STIX 'uses' relationship."""
+    return dict(type="relationship", relationship_type="uses", target_ref=target_ref, description=description, **kwargs)
+
+
+class TestStixStream(TestCase):
+    """A test suite for checking STIX bundles are read and flattened one object at a time."""
+
+    def test_objects_read_across_chunks(self):
+        """Function to test each object is read from a bundle whether or not it is split across reads."""
+        objects = [dict(type="note", id=f"note--{i}", content="Café ✓ " * i, number=i * 1000.5) for i in range(20)]
+        bundle = json.dumps(dict(type="bundle", id="bundle--1", objects=objects, spec_version=21), indent=2)
+        for chunk_size in [1, 7, 1 << 16]:
+            for stix_file in [io.StringIO(bundle), io.BytesIO(bundle.encode("utf-8"))]:
+                read = list(iter_stix_bundle_objects(stix_file, chunk_size=chunk_size))
+                self.assertEqual(read, objects, msg=f"Objects not read as expected with chunk size {chunk_size}.")
+
+    def test_malformed_bundle(self):
+        """Function to test a truncated bundle raises an error."""
+        with self.assertRaises(ValueError):
+            list(iter_stix_bundle_objects(io.StringIO('{"type": "bundle", "objects": [{"id": 1}, {"id"'), 4))
+
+    def test_flatten_in_single_pass(self):
+        """Function to test objects are flattened regardless of the order relationships appear in."""
+        technique_id, other_id = "attack-pattern--1", "attack-pattern--2"
+        stix_objects = iter(
+            [
+                uses(technique_id, "[APT1](https://example.com) used <code>cmd</code>. (Citation: Report)"),
+                dict(type="tool", id="tool--1", name="Hammer", description="A tool."),
+                attack_pattern(technique_id, "Command Line", "T1059", description="Runs\ncommands."),
+                attack_pattern(other_id, "Old Technique", "T0000", x_mitre_deprecated=True),
+                uses(other_id, "Example for a deprecated technique."),
+                uses(technique_id, "Ignored as this is revoked.", revoked=True),
+                uses(technique_id, "A second example."),
+                dict(type="malware", id="malware--1", name="No Description"),
+                dict(type="malware", id="malware--2", name="Worm", description="A worm."),
+            ]
+        )
+        attack_data = AttackDataService.flatten_attack_stix_data(stix_objects)
+
+        self.assertEqual(list(attack_data), [technique_id, "malware--2", "tool--1"])
+        technique = attack_data[technique_id]
+        self.assertEqual(technique["tid"], "T1059")
+        self.assertEqual(technique["description"], "Runscommands.")
+        self.assertEqual(technique["example_uses"], ["used cmd.", "A second example."])
+        self.assertEqual(attack_data["tool--1"]["similar_words"], ["Hammer"])
@@ -0,0 +1,124 @@
+from threadcomponents.service.web_svc import WebService
+from unittest.mock import patch
+from unittest import IsolatedAsyncioTestCase
+
+
+class TestWebService(IsolatedAsyncioTestCase):
+    """A test suite for checking the web service's handling of article html."""
+
+    def setUp(self):
+        """Any setting-up before each test method."""
+        self.web_svc = WebService()
+
+    def test_alignment_matches_text_and_tags(self):
+        """Function to test plaintext lines are matched with their html elements in order."""
+        html_doc = "<div><h2>Overview</h2><p>The actor used a loader.</p><ul><li>Step one</li></ul></div>"
+        plaintext = ["Overview", "The actor used a loader.", "Step one"]
+        results = self.web_svc.align_plaintext_with_html(html_doc, plaintext, [])
+        self.assertEqual([(r["text"], r["tag"]) for r in results], list(zip(plaintext, ["header", "p", "li"])))
+
+    def test_alignment_adds_missing_text_as_paragraph(self):
+        """Function to test a plaintext line not in the html is kept as a paragraph."""
+        html_doc = "<div><p>First line.</p><p>Third line.</p></div>"
+        results = self.web_svc.align_plaintext_with_html(html_doc, ["First line.", "Second line.", "Third line."], [])
+        self.assertEqual([r["text"] for r in results], ["First line.", "Second line.", "Third line."])
+        self.assertEqual(results[1]["tag"], "p")
+
+    def test_alignment_places_images_once(self):
+        """Function to test images are placed before their following text, matched to full URLs and not repeated."""
+        html_doc = (
+            '<div><p><img src="/fig1.png"></p><p>Text one.</p><p><img src="/fig1.png"><img src="/anim.gif"></p>'
+            "<p>Text two.</p></div>"
+        )
+        images = ["https://example.com/fig1.png"]
+        results = self.web_svc.align_plaintext_with_html(html_doc, ["Text one.", "Text two."], images)
+        self.assertEqual(
+            [(r["text"], r["tag"]) for r in results],
+            [("https://example.com/fig1.png", "img"), ("Text one.", "p"), ("Text two.", "p")],
+        )
+
+    def test_alignment_drops_misplaced_image(self):
+        """Function to test an image found while searching for text that isn't in the html is not kept."""
+        html_doc = '<div><p>Text one.</p><p><img src="/fig1.png"></p><p>Text two.</p></div>'
+        results = self.web_svc.align_plaintext_with_html(html_doc, ["Text one.", "Not here.", "Text two."], [])
+        self.assertEqual([r["tag"] for r in results], ["p", "img", "p"])
+        self.assertEqual(results[1]["text"], "/fig1.png")
+        self.assertEqual(results[2]["text"], "Text two.")
+
+    def test_alignment_sentence_limit(self):
+        """Function to test the alignment stops at the sentence limit."""
+        html_doc = "<div><p>One.</p><p>Two.</p><p>Three.</p></div>"
+        results = self.web_svc.align_plaintext_with_html(html_doc, ["One.", "Two.", "Three."], [], sentence_limit=2)
+        self.assertEqual([r["text"] for r in results], ["One.", "Two."])
+
+    @staticmethod
+    def _sentence(uid, sentence_html):
+        """Function to return a sentence dictionary as it is retrieved for building the final html."""
+        return dict(uid=uid, text=sentence_html, html=sentence_html, found_status=0, is_ioc=0)
+
+    async def test_final_html_merges_sentences_and_images(self):
+        """Function to test sentences take their element's tag with images placed before them."""
+        original_html = [
+            dict(uid="e0", tag="header", text="Overview", found_status=0),
+            dict(uid="e1", tag="img", text="https://example.com/fig1.png", found_status=0),
+            dict(uid="e2", tag="li", text="First step. Second step.", found_status=0),
+        ]
+        sentences = [
+            self._sentence("s0", "Overview"),
+            self._sentence("s1", "First step."),
+            self._sentence("s2", "Second"),
+        ]
+        final_html = await self.web_svc.build_final_html(original_html, sentences)
+        self.assertEqual(
+            [(element["uid"], element["tag"]) for element in final_html],
+            [("s0", "header"), ("e1", "img"), ("s1", "li"), ("s2", "li")],
+        )
+
+    async def test_final_html_keeps_order_for_unfound_sentences(self):
+        """Function to test sentences not in the html are kept in order and unplaced images are added at the end."""
+        original_html = [
+            dict(uid="e0", tag="p", text="Found one.", found_status=0),
+            dict(uid="e1", tag="img", text="https://example.com/fig1.png", found_status=0),
+            dict(uid="e2", tag="p", text="Found two.", found_status=0),
+            dict(uid="e3", tag="img", text="https://example.com/fig2.png", found_status=0),
+        ]
+        sentences = [
+            self._sentence("s0", "Found two."),
+            self._sentence("s1", "Not found."),
+            self._sentence("s2", "Found one."),
+        ]
+        final_html = await self.web_svc.build_final_html(original_html, sentences)
+        self.assertEqual(
+            [(element["uid"], element["tag"]) for element in final_html],
+            [("e1", "img"), ("s0", "p"), ("s1", "p"), ("s2", "p"), ("e3", "img")],
+        )
+
+    async def test_final_html_uses_saved_elements(self):
+        """Function to test sentences saved with the element they are in are placed there without searching."""
+        original_html = [
+            dict(uid="e0", tag="h2", text="Title", found_status=0, elem_index=0),
+            dict(uid="e1", tag="img", text="https://example.com/fig1.png", found_status=0, elem_index=1),
+            dict(uid="e2", tag="li", text="Edited since.", found_status=0, elem_index=2),
+        ]
+        sentences = [
+            dict(self._sentence("s0", "Title"), elem_index=0),
+            dict(self._sentence("s1", "Not in the html."), elem_index=2),
+            dict(self._sentence("s2", "Not found."), elem_index=-1),
+        ]
+        with patch.object(WebService, "find_sentences_in_html") as mock_find:
+            final_html = await self.web_svc.build_final_html(original_html, sentences)
+        mock_find.assert_not_called()
+        self.assertEqual(
+            [(element["uid"], element["tag"]) for element in final_html],
+            [("s0", "h2"), ("e1", "img"), ("s1", "li"), ("s2", "p")],
+        )
+
+    def test_find_sentences_in_html(self):
+        """Function to test the element each sentence is in is found, searching on from the last one found."""
+        original_html = [
+            dict(uid="e0", tag="p", text="Repeated.", found_status=0),
+            dict(uid="e1", tag="img", text="Repeated.", found_status=0),
+            dict(uid="e2", tag="p", text="Other. Repeated.", found_status=0),
+        ]
+        sentences = [self._sentence(f"s{s_idx}", html) for s_idx, html in enumerate(["Other.", "Repeated.", "None."])]
+        self.assertEqual(self.web_svc.find_sentences_in_html(original_html, sentences), [2, 2, None])
@@ -1,5 +1,4 @@
 import aiohttp_jinja2
-import asyncio
 import jinja2
 import logging
 import os
@@ -9,7 +8,6 @@ import sqlite3
 from aiohttp import web
 from aiohttp.test_utils import AioHTTPTestCase
 from contextlib import suppress
-from stix2.base import _STIXBase
 from tests.misc import delete_db_file, SCHEMA_FILE
 
 from threadcomponents.constants import UID as UID_KEY
@@ -160,14 +158,22 @@ class ThreadAppTest(AioHTTPTestCase):
 
     async def get_application(self):
         """Overrides AioHTTPTestCase.get_application()."""
-        app = web.Application()
+        app = web.Application(middlewares=[WebAPI.req_handler])
         # Some of the routes we'll be testing
         app.router.add_route("GET", self.web_svc.get_route(WebService.HOME_KEY), self.web_api.index)
         app.router.add_route("GET", self.web_svc.get_route(WebService.EDIT_KEY), self.web_api.edit)
         app.router.add_route("GET", self.web_svc.get_route(WebService.ABOUT_KEY), self.web_api.about)
         app.router.add_route("GET", self.web_svc.get_route(WebService.HOW_IT_WORKS_KEY), self.web_api.how_it_works)
         app.router.add_route("GET", self.web_svc.get_route(WebService.EXPORT_AFB_KEY), self.web_api.afb_export)
+        app.router.add_route("GET", self.web_svc.get_route(WebService.EXPORT_BULK_KEY), self.web_api.bulk_export)
         app.router.add_route("*", self.web_svc.get_route(WebService.REST_KEY), self.web_api.rest_api)
+        app.router.add_route("GET", self.web_svc.get_route(WebService.METRICS_KEY), self.web_api.metrics)
+        app.router.add_route(
+            "GET", self.web_svc.get_route(WebService.ANALYSIS_PROFILE_KEY), self.web_api.analysis_profile
+        )
+        app.router.add_route(
+            "GET", self.web_svc.get_route(WebService.ANALYSIS_PROGRESS_KEY), self.web_api.analysis_progress
+        )
         # A different route for limit-testing
         app.router.add_route(
             "*", "/limit" + self.web_svc.get_route(WebService.REST_KEY), self.web_api_with_limit.rest_api
@@ -179,13 +185,11 @@ class ThreadAppTest(AioHTTPTestCase):
         """Function to reset the queue variables from a test RestService instance."""
         # Default parameter for rest service if not provided
         rest_svc = rest_svc or self.rest_svc
-        # Note all tasks in the queue object as done
-        with suppress(asyncio.QueueEmpty):
-            for _ in range(rest_svc.queue.qsize()):
-                rest_svc.queue.get_nowait()
-                rest_svc.queue.task_done()
+        # Empty the queue
+        rest_svc.queue.clear()
         # Reset the other variables
         rest_svc.queue_map = dict()
+        rest_svc.queued_job_uids.clear()
         rest_svc.clean_current_tasks()
 
     async def patches_on_insert(self):
@@ -242,6 +246,9 @@ class ThreadAppTest(AioHTTPTestCase):
         self.create_patch(
             target=AttackDataService, attribute="ml_and_reg_split", return_value=([], list(self.attacks.items()))
         )
+        # Don't load (or save) the attack dictionary's snapshot so the mocked split is used and not kept
+        self.create_patch(target=AttackDataService, attribute="load_snapshot", return_value=None)
+        self.create_patch(target=AttackDataService, attribute="save_snapshot")
         self.create_patch(target=MLService, attribute="build_pickle_file", return_value=(False, dict()))
         self.create_patch(target=MLService, attribute="analyze_html", return_value=html)
 
@@ -310,7 +317,5 @@ class ThreadAppTest(AioHTTPTestCase):
             )
         # Mock the fetch-data method to return our mocked list
         self.create_patch(
-            target=attack_data_svc, attribute="fetch_attack_stix_data_json", return_value=dict(objects=new_attack_list)
+            target=attack_data_svc, attribute="fetch_attack_stix_data_objects", return_value=new_attack_list
         )
-        # Prevent the Stix library flagging incorrect data
-        self.create_patch(target=_STIXBase, attribute="_check_property", return_value=False)
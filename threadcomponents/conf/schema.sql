@@ -25,7 +25,9 @@ CREATE TABLE IF NOT EXISTS reports (
     -- If applicable, a token to limit who can view this report
     token VARCHAR(60) DEFAULT NULL,
     -- Whether it has been automatically generated
-    automatically_generated VARCHAR(60) DEFAULT NULL
+    automatically_generated VARCHAR(60) DEFAULT NULL,
+    -- Increased after every change to this report's data so any process with the data cached knows to read it again
+    data_version INTEGER DEFAULT 0
 );
 
 CREATE TABLE IF NOT EXISTS report_sentences (
@@ -38,6 +40,8 @@ CREATE TABLE IF NOT EXISTS report_sentences (
     html VARCHAR(900),
     -- The order this sentence has relative to the other sentences of a report (e.g. 0 = first sentence in report)
     sen_index INTEGER,
+    -- The elem_index of the original_html element this sentence is in (-1 if not found; NULL if not saved)
+    elem_index INTEGER DEFAULT NULL,
     -- Whether any attacks for this sentence have been found
     found_status BOOLEAN DEFAULT 0,
     FOREIGN KEY(report_uid) REFERENCES reports(uid) ON DELETE CASCADE
@@ -48,6 +52,29 @@ CREATE TABLE IF NOT EXISTS report_sentence_queue_progress (
     uid VARCHAR(60) PRIMARY KEY,
     report_uid VARCHAR(60),
     sentence_count INTEGER,
+    -- The number of sentences analysed and saved so far
+    sentences_done INTEGER DEFAULT 0,
+    -- The fetched article (its sentences and date as JSON) so an interrupted analysis can resume from sentences_done
+    article TEXT DEFAULT NULL,
+    FOREIGN KEY(report_uid) REFERENCES reports(uid) ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS analysis_jobs (
+    -- A queued report waiting to be (or being) analysed by any Thread process connected to this db
+    uid VARCHAR(60) PRIMARY KEY,
+    report_uid VARCHAR(60) UNIQUE,
+    -- The queue-lane kind (interactive, bulk or automatic) and the user (token or 'public') which queued the report
+    lane VARCHAR(20),
+    owner VARCHAR(60),
+    -- The minimum number of techniques for the report to be kept after analysis (if not the default)
+    techniques_threshold INTEGER DEFAULT NULL,
+    -- When the job was queued (seconds since the epoch)
+    queued_at FLOAT,
+    -- The process analysing the report and when its lease on the job expires unless renewed (seconds since the epoch)
+    worker VARCHAR(100) DEFAULT NULL,
+    lease_expires FLOAT DEFAULT NULL,
+    -- How many times the job has been claimed
+    attempts INTEGER DEFAULT 0,
     FOREIGN KEY(report_uid) REFERENCES reports(uid) ON DELETE CASCADE
 );
 
@@ -245,3 +272,31 @@ CREATE TABLE IF NOT EXISTS report_sentence_indicators_of_compromise (
   FOREIGN KEY(report_id) REFERENCES reports(uid) ON DELETE CASCADE,
   FOREIGN KEY(sentence_id) REFERENCES report_sentences(uid) ON DELETE CASCADE
 );
+
+-- How long each stage of analysing a report took (in seconds) and how much was analysed
+-- Kept for reports which are later removed (e.g. for being low quality) so this does not reference the reports table
+CREATE TABLE IF NOT EXISTS report_analysis_metrics (
+    uid VARCHAR(60) PRIMARY KEY,
+    report_uid VARCHAR(60),
+    url VARCHAR(500),
+    download_time FLOAT DEFAULT 0,
+    parse_time FLOAT DEFAULT 0,
+    tokenize_time FLOAT DEFAULT 0,
+    ml_time FLOAT DEFAULT 0,
+    regex_time FLOAT DEFAULT 0,
+    persist_time FLOAT DEFAULT 0,
+    cleanup_time FLOAT DEFAULT 0,
+    total_time FLOAT DEFAULT 0,
+    sentence_count INTEGER DEFAULT 0,
+    element_count INTEGER DEFAULT 0,
+    ml_hit_count INTEGER DEFAULT 0,
+    reg_hit_count INTEGER DEFAULT 0,
+    -- The number of db calls made during analysis
+    db_query_count INTEGER DEFAULT 0
+);
+
+-- Details of how the database was built (e.g. fingerprints of the schema and data loaded into it)
+CREATE TABLE IF NOT EXISTS thread_metadata (
+    keyname VARCHAR(60) PRIMARY KEY,
+    value VARCHAR(200)
+);
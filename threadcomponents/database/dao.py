@@ -33,6 +33,9 @@ class Dao:
     async def build(self, schema, is_partial=False):
         await self.db.build(schema, is_partial=is_partial)
 
+    def snapshot(self):
+        return self.db.snapshot()
+
     def generate_copied_tables(self, schema):
         return self.db.generate_copied_tables(schema)
 
@@ -55,12 +58,30 @@ class Dao:
     async def insert(self, table, data, return_sql=False):
         return await self.db.insert(table, data, return_sql=return_sql)
 
+    def insert_many_sql(self, table, columns, rows):
+        return self.db.insert_many_sql(table, columns, rows)
+
+    def update_in_sql(self, table, data, column, values):
+        return self.db.update_in_sql(table, data, column, values)
+
     async def insert_generate_uid(self, table, data, id_field="uid", return_sql=False):
         return await self.db.insert_generate_uid(table, data, id_field=id_field, return_sql=return_sql)
 
     async def insert_with_backup(self, table, data, id_field="uid"):
         return await self.db.insert_with_backup(table, data, id_field=id_field)
 
+    async def claim_job(self, table, uid, worker, lease_expires, now):
+        return await self.db.claim_job(table, uid, worker, lease_expires, now)
+
+    async def renew_job_lease(self, table, uid, worker, lease_expires):
+        return await self.db.renew_job_lease(table, uid, worker, lease_expires)
+
+    async def increment(self, table, column, uid=None):
+        return await self.db.increment(table, column, uid=uid)
+
+    async def insert_with_backup_sql(self, table, data, id_field="uid"):
+        return await self.db.insert_with_backup_sql(table, data, id_field=id_field)
+
     async def delete(self, table, data, return_sql=False):
         return await self.db.delete(table, data, return_sql=return_sql)
 
@@ -1,13 +1,91 @@
+import asyncio
 import logging
+import re
+import threading
+import time
 import uuid
 
 from abc import ABC, abstractmethod
-from contextlib import suppress
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager, suppress
+from contextvars import ContextVar
+from functools import partial
+
+from threadcomponents.helpers.metrics import MetricsRegistry
 
 BACKUP_TABLE_SUFFIX = "_initial"
 TABLES_WITH_BACKUPS = ["report_sentences", "report_sentence_hits", "original_html"]
 # The beginning and end strings of an SQL create statement
 CREATE_BEGIN, CREATE_END = "CREATE TABLE IF NOT EXISTS", ");"
+# A whole CREATE statement: its table name and the definitions between its brackets
+CREATE_STATEMENT = re.compile(re.escape(CREATE_BEGIN) + r"\s+(\w+)\s*\((.*?)\);", re.DOTALL)
+# The keywords which begin table constraints rather than column definitions
+CONSTRAINT_KEYWORDS = {"CONSTRAINT", "PRIMARY", "FOREIGN", "UNIQUE", "CHECK"}
+# The number of threads used to run blocking db calls away from the event loop
+DB_MAX_WORKERS = 8
+# Marks a run_sql_list() item as one SQL statement to execute for each of a list of parameters
+EXECUTE_MANY = "execute_many"
+# Marks a run_sql_list() item as an SQL statement which must change a row, else the whole list is rolled back
+REQUIRE_ROWS = "require_rows"
+# The maximum number of values in one `IN (...)` clause (keeping under SQLite's limit on query parameters)
+SQL_IN_BATCH_SIZE = 500
+# The snapshot (if any) SELECT queries in the current context should use
+_current_snapshot = ContextVar("current_snapshot", default=None)
+# The default time (in milliseconds) for a db call to be logged as slow; and the default number of times the same
+# statement can run within one request or analysis job before being logged as a possible N+1 pattern
+DEFAULT_SLOW_QUERY_MS = 500
+DEFAULT_REPEATED_QUERY_LIMIT = 20
+# The scope (e.g. a request being handled) which db calls in the current context are counted against
+_current_query_scope = ContextVar("current_query_scope", default=None)
+# Patterns to reduce SQL statements to their shape: literal values, lists of query parameters and whitespace
+SQL_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+SQL_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+SQL_PARAMETER_LIST = re.compile(r"\(\s*(?:\?|%s)(?:\s*,\s*(?:\?|%s))+\s*\)")
+SQL_WHITESPACE = re.compile(r"\s+")
+
+
+def normalise_sql(sql):
+    """Function to return the shape of an SQL statement: without its literal values and varying-length lists."""
+    sql = SQL_STRING_LITERAL.sub("?", sql)
+    sql = SQL_NUMBER_LITERAL.sub("?", sql)
+    sql = SQL_PARAMETER_LIST.sub("(...)", sql)
+    return SQL_WHITESPACE.sub(" ", sql).strip()
+
+
+class NoRowsChangedError(Exception):
+    """Raised when a run_sql_list() statement which must change a row (REQUIRE_ROWS) doesn't."""
+
+
+class QueryScope:
+    """The db calls made within a scope (e.g. whilst handling one request or analysing one report)."""
+
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self.seconds = 0.0
+        # statement shape -> number of times it was run
+        self.shapes = Counter()
+
+
+@contextmanager
+def query_scope(name):
+    """Function to count the db calls made within this context (including those gathered concurrently) as one scope."""
+    scope = QueryScope(name)
+    token = _current_query_scope.set(scope)
+    try:
+        yield scope
+    finally:
+        _current_query_scope.reset(token)
+
+
+class DBSnapshot:
+    """A db connection held open in a read transaction so queries using it see one consistent view of the db."""
+
+    def __init__(self, connection):
+        self.connection = connection
+        # Queries can be gathered concurrently but a connection can only run one at a time
+        self.lock = threading.Lock()
 
 
 def find_create_statement_in_schema(schema, table, log_error=True, find_closing_bracket=False):
@@ -45,6 +123,28 @@ def find_create_statement_in_schema(schema, table, log_error=True, find_closing_
     return start_pos, (start_pos + end_pos)
 
 
+def get_schema_columns(schema):
+    """Helper-method to return the column definitions of each table in a schema: {table: {column: definition}}."""
+    # Remove comments as they can contain brackets and commas
+    schema = "\n".join(line.split("--")[0] for line in schema.splitlines())
+    tables = dict()
+    for match in CREATE_STATEMENT.finditer(schema):
+        columns, depth, definition = dict(), 0, ""
+        # Split the definitions on commas which are not within brackets (e.g. `UNIQUE (a, b)`)
+        for char in match.group(2) + ",":
+            if char == "," and depth == 0:
+                definition = " ".join(definition.split())
+                name = definition.split(" ")[0] if definition else ""
+                if name and (name.upper() not in CONSTRAINT_KEYWORDS):
+                    columns[name] = definition
+                definition = ""
+                continue
+            depth += (char == "(") - (char == ")")
+            definition += char
+        tables[match.group(1)] = columns
+    return tables
+
+
 class ThreadDB(ABC):
     """A base class for DB tasks (where the SQL statements are the same across DB engines)."""
 
@@ -65,6 +165,19 @@ class ThreadDB(ABC):
             self._mapped_functions.update(mapped_functions)
         # A map tp store the column names of the initial-data tables
         self._table_columns = dict()
+        # The threads which db calls are run in
+        self._executor = ThreadPoolExecutor(max_workers=DB_MAX_WORKERS, thread_name_prefix="thread-db")
+        # Thresholds for logging slow and repeated queries (see set_query_thresholds())
+        self.slow_query_ms = DEFAULT_SLOW_QUERY_MS
+        self.repeated_query_limit = DEFAULT_REPEATED_QUERY_LIMIT
+        # Counts and timings of the queries run against the db
+        self.metrics = MetricsRegistry()
+        self.metrics.describe("thread_db_queries_total", "counter", "Database calls made, by kind of statement.")
+        self.metrics.describe("thread_db_query_duration_seconds", "histogram", "Time taken by database calls.")
+        self.metrics.describe("thread_db_slow_queries_total", "counter", "Database calls over the slow-query time.")
+        self.metrics.describe(
+            "thread_db_repeated_queries_total", "counter", "Statements repeated (possible N+1) within a request or job."
+        )
 
     @property
     @abstractmethod
@@ -92,6 +205,11 @@ class ThreadDB(ABC):
         """The db's value for False."""
         return 0  # default as int, 0
 
+    @property
+    def skip_locked_rows(self):
+        """The clause (if any) for a SELECT to lock the rows it returns, skipping those already locked."""
+        return ""
+
     def get_function_name(self, func_key, *args, unquote=None):
         """Function to retrieve a function name for this ThreadDB instance.
         Can take non-iterable args such that it returns the string `function(arg1, arg2, ...)`."""
@@ -152,11 +270,134 @@ class ThreadDB(ABC):
         # Return the new schema
         return new_schema.strip()
 
+    @property
+    def current_snapshot(self):
+        """The snapshot being used by the current context (or None)."""
+        return _current_snapshot.get()
+
+    def set_query_thresholds(self, slow_query_ms=None, repeated_query_limit=None):
+        """Method to set when db calls are logged as slow and when repeated statements are logged as possible N+1s."""
+        if slow_query_ms is not None:
+            self.slow_query_ms = slow_query_ms
+        if repeated_query_limit is not None:
+            self.repeated_query_limit = repeated_query_limit
+
+    @contextmanager
+    def instrument_query(self, kind, sql):
+        """Method to time a db call made within this context (of a kind, e.g. select, and its SQL statement)."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._record_query(kind, sql, time.perf_counter() - start)
+
+    def _record_query(self, kind, sql, seconds):
+        """Method to record a timed db call: counting it against the current scope and logging it if slow/repeated."""
+        labels = dict(kind=kind)
+        self.metrics.inc("thread_db_queries_total", labels)
+        self.metrics.observe("thread_db_query_duration_seconds", seconds, labels)
+        scope, shape = _current_query_scope.get(), None
+        if (seconds * 1000) >= self.slow_query_ms:
+            shape = normalise_sql(sql)
+            self.metrics.inc("thread_db_slow_queries_total", labels)
+            scope_str = f" in {scope.name}" if scope else ""
+            logging.warning(f"Slow query ({seconds * 1000:.0f} ms){scope_str}: {shape}")
+        if scope is None:
+            return
+        scope.count += 1
+        scope.seconds += seconds
+        shape = shape or normalise_sql(sql)
+        scope.shapes[shape] += 1
+        # Only log the first time a statement goes over the limit
+        if scope.shapes[shape] == self.repeated_query_limit + 1:
+            self.metrics.inc("thread_db_repeated_queries_total", labels)
+            logging.warning(
+                f"Possible N+1 queries in {scope.name}: statement run over {self.repeated_query_limit} times: {shape}"
+            )
+
+    def _execute_sql_list_items(self, cursor, sql_list):
+        """Method to execute each item of a run_sql_list() list with a cursor, logging any slow statements."""
+        # Each item's first part must be an SQL statement followed by optional parameters
+        for item in sql_list:
+            if item is None:  # skip None-items
+                continue
+            start = time.perf_counter()
+            if len(item) == 1:
+                cursor.execute(item[0])
+            elif len(item) == 2:
+                # execute() takes parameters as a tuple, ensure that is the case
+                parameters = item[1] if isinstance(item[1], tuple) else tuple(item[1])
+                cursor.execute(item[0], parameters)
+            elif item[2] == EXECUTE_MANY and item[1]:
+                cursor.executemany(item[0], item[1])
+            elif item[2] == REQUIRE_ROWS:
+                cursor.execute(item[0], tuple(item[1]))
+                if not cursor.rowcount:
+                    raise NoRowsChangedError(f"No rows changed by: {normalise_sql(item[0])}")
+            # This runs away from the event loop (outside of any scope): the list as a whole is counted in scopes
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            if elapsed_ms >= self.slow_query_ms:
+                logging.warning(f"Slow query ({elapsed_ms:.0f} ms) in SQL list: {normalise_sql(item[0])}")
+
+    @staticmethod
+    def describe_sql_list(sql_list):
+        """Function to return a statement describing a run_sql_list() list (for timing it as one db call)."""
+        statements = [item[0] for item in sql_list if item is not None]
+        return f"[{len(statements)} statements] " + (statements[0] if statements else "")
+
+    async def _run_blocking(self, func, *args, **kwargs):
+        """Method to run a blocking function (that uses the db) in a separate thread; the event loop is not blocked."""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, partial(func, *args, **kwargs))
+
+    @asynccontextmanager
+    async def snapshot(self):
+        """Method to have all SELECT queries within this context (including those gathered concurrently) read from a
+        single, consistent view of the db."""
+        # If we are already using a snapshot, continue using it
+        if self.current_snapshot is not None:
+            yield self.current_snapshot
+            return
+        try:
+            snapshot = DBSnapshot(await self._run_blocking(self._open_snapshot))
+        except Exception as e:
+            # Queries can still run, they just won't share a snapshot
+            logging.error(f"Unable to open db snapshot: {e}")
+            yield None
+            return
+        token = _current_snapshot.set(snapshot)
+        try:
+            yield snapshot
+        finally:
+            _current_snapshot.reset(token)
+            await self._run_blocking(self._close_snapshot, snapshot.connection)
+
+    @abstractmethod
+    def _open_snapshot(self):
+        """Method to open and return a db connection which has begun a read transaction."""
+        pass
+
+    @abstractmethod
+    def _close_snapshot(self, connection):
+        """Method to end the read transaction of a connection from _open_snapshot() and close it."""
+        pass
+
     @abstractmethod
     async def build(self, schema, is_partial=False):
         """Method to build the db given a schema."""
         pass
 
+    async def add_missing_columns(self, schema):
+        """Method to add columns from a schema to tables created before the column was in the schema."""
+        sql_list = []
+        for table, columns in get_schema_columns(schema).items():
+            existing = await self._get_column_names(f"SELECT * FROM {table} LIMIT 0")
+            for column, definition in columns.items():
+                if column not in existing:
+                    logging.info(f"Adding column `{column}` to table `{table}`")
+                    sql_list.append(tuple([f"ALTER TABLE {table} ADD COLUMN {definition}"]))
+        await self.run_sql_list(sql_list=sql_list)
+        return sql_list
+
     @abstractmethod
     async def _get_column_names(self, sql):
         """Method to get column names for data retrieved by a given SQL statement."""
@@ -174,7 +415,7 @@ class ThreadDB(ABC):
 
     @abstractmethod
     async def _execute_update(self, sql, data):
-        """Method to connect to the db and execute an SQL UPDATE statement."""
+        """Method to connect to the db and execute an SQL UPDATE statement; returns the number of rows affected."""
         pass
 
     @abstractmethod
@@ -342,6 +583,25 @@ class ThreadDB(ABC):
         # Else execute the SQL INSERT statement
         return await self._execute_insert(sql, non_null)
 
+    def insert_many_sql(self, table, columns, rows):
+        """Method to return a run_sql_list() item inserting many rows (each row a sequence of values for columns)."""
+        placeholders = ", ".join([self.query_param] * len(columns))
+        sql = "INSERT INTO {} ({}) VALUES ({})".format(table, ", ".join(columns), placeholders)
+        return tuple([sql, [tuple(row) for row in rows], EXECUTE_MANY])
+
+    def update_in_sql(self, table, data, column, values):
+        """Method to return run_sql_list() items updating the rows of a table whose column is one of many values."""
+        self._check_method_parameters(table, data, method_name="update_in_sql")
+        set_terms = ", ".join("{} = {}".format(k, self.query_param) for k in data.keys())
+        values, sql_list = list(values), []
+        # Batch the values so each statement has a bounded number of query parameters
+        for start in range(0, len(values), SQL_IN_BATCH_SIZE):
+            batch = values[start : start + SQL_IN_BATCH_SIZE]
+            placeholders = ", ".join([self.query_param] * len(batch))
+            sql = "UPDATE {} SET {} WHERE {} IN ({})".format(table, set_terms, column, placeholders)
+            sql_list.append(tuple([sql, tuple(data.values()) + tuple(batch)]))
+        return sql_list
+
     async def insert_generate_uid(self, table, data, id_field="uid", return_sql=False):
         """Method to generate an ID value whilst inserting into db."""
         # Check values passed to this method are valid
@@ -367,6 +627,18 @@ class ThreadDB(ABC):
         # Return the ID for the two records
         return record_id
 
+    async def insert_with_backup_sql(self, table, data, id_field="uid"):
+        """Method to return a generated ID and the SQL statements to insert data into a table and its backup table."""
+        # Check values passed to this method are valid
+        self._check_method_parameters(table, data, method_name="insert_with_backup_sql")
+        record_id = str(uuid.uuid4())
+        data = dict(data, **{id_field: record_id})
+        sql_list = [
+            await self.insert(table, data, return_sql=True),
+            await self.insert(f"{table}{BACKUP_TABLE_SUFFIX}", data, return_sql=True),
+        ]
+        return record_id, sql_list
+
     async def update(self, table, where=None, data=None, return_sql=False):
         """Method to update rows from a table of the db."""
         # Check values passed to this method are valid
@@ -420,6 +692,31 @@ class ThreadDB(ABC):
         # Run the statement by passing qparams as parameters
         return await self._execute_update(sql, qparams)
 
+    async def claim_job(self, table, uid, worker, lease_expires, now):
+        """Method to lease a job (a row with worker, lease_expires and attempts columns) to a worker if it is not
+        leased or its lease has expired; returns whether the job was claimed."""
+        qp = self.query_param
+        # The claimable row is re-checked as the UPDATE runs so only one of many concurrent claims succeeds
+        sql = (
+            f"UPDATE {table} SET worker = {qp}, lease_expires = {qp}, attempts = attempts + 1 "
+            f"WHERE uid IN (SELECT uid FROM {table} WHERE uid = {qp} "
+            f"AND (worker IS NULL OR lease_expires < {qp}){self.skip_locked_rows})"
+        )
+        return bool(await self._execute_update(sql, [worker, lease_expires, uid, now]))
+
+    async def renew_job_lease(self, table, uid, worker, lease_expires):
+        """Method to extend a worker's lease on a job; returns whether the worker still held the job."""
+        qp = self.query_param
+        sql = f"UPDATE {table} SET lease_expires = {qp} WHERE uid = {qp} AND worker = {qp}"
+        return bool(await self._execute_update(sql, [lease_expires, uid, worker]))
+
+    async def increment(self, table, column, uid=None):
+        """Method to add one to a column of a row (or of every row if no uid is given); returns the rows changed."""
+        sql = f"UPDATE {table} SET {column} = {column} + 1"
+        if uid is None:
+            return await self._execute_update(sql, [])
+        return await self._execute_update(sql + f" WHERE uid = {self.query_param}", [uid])
+
     async def delete(self, table, data, return_sql=False):
         """Method to delete rows from a table of the db."""
         # Check values passed to this method are valid
@@ -2,7 +2,8 @@ import logging
 import os
 import psycopg
 
-from .thread_db import ThreadDB
+from .thread_db import ThreadDB, get_schema_columns
+from contextlib import suppress
 from getpass import getpass
 from psycopg.rows import dict_row, tuple_row
 
@@ -86,6 +87,7 @@ def _create_tables(db_name, username, password, host, port, schema="", is_partia
         ("reports", end_date_field, not_partial_log, is_partial),
         ("report_sentence_hits", start_date_field, not_partial_log, is_partial),
         ("report_sentence_hits", end_date_field, not_partial_log, is_partial),
+        ("report_analysis_metrics", "date_analysed TIMESTAMP WITH TIME ZONE", not_partial_log, is_partial),
         # (3) and (4) are inverse above because report_sentence_hits_initial is from partial schema
         ("report_sentence_hits_initial", start_date_field, partial_log, not is_partial),
         ("report_sentence_hits_initial", end_date_field, partial_log, not is_partial),
@@ -107,6 +109,14 @@ def _create_tables(db_name, username, password, host, port, schema="", is_partia
         with psycopg.connect(conninfo=conn_info) as connection:
             with connection.cursor() as cursor:
                 cursor.execute(schema)
+                # Existing tables are not changed by the CREATE statements so add any new columns to them
+                for table, columns in get_schema_columns(schema).items():
+                    cursor.execute(f"SELECT * FROM {table} LIMIT 0")
+                    existing = [desc[0] for desc in cursor.description]
+                    for column, definition in columns.items():
+                        if column not in existing:
+                            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {definition}")
+                            print(f"Added column `{column}` to table `{table}`.")
 
         print("Schema successfully run.")
 
@@ -145,6 +155,12 @@ class ThreadPostgreSQL(ThreadDB):
         """Overrides ThreadDB.val_as_false"""
         return "FALSE"
 
+    @property
+    def skip_locked_rows(self):
+        """Overrides ThreadDB.skip_locked_rows"""
+        # Concurrent claims of a job skip it (rather than waiting for it) whilst another transaction has it locked
+        return " FOR UPDATE SKIP LOCKED"
+
     async def build(self, schema, is_partial=False):
         """Implements ThreadDB.build()"""
         logging.warning(
@@ -152,12 +168,9 @@ class ThreadPostgreSQL(ThreadDB):
             "Please run `main.py --build-db` separately instead."
         )
 
-    def _connection_wrapper(self, method, row_factory=None, return_success=False):
-        """A function to execute a method that requires a db connection cursor."""
-
-        # Blank variables for the return value and if the method was successful
-        return_val, success = None, True
-        conn_info = get_connection_string(
+    def _get_connection_string(self):
+        """Function to get the connection-string for this instance's database."""
+        return get_connection_string(
             host=self.host,
             port=self.port,
             database=self.db_name,
@@ -165,10 +178,37 @@ class ThreadPostgreSQL(ThreadDB):
             password=self.password,
         )
 
+    def _open_snapshot(self):
+        """Implements ThreadDB._open_snapshot()"""
+        connection = psycopg.connect(conninfo=self._get_connection_string())
+        # Every query in a repeatable-read transaction sees the data as of the transaction's first query: run one now
+        connection.isolation_level = psycopg.IsolationLevel.REPEATABLE_READ
+        connection.read_only = True
+        connection.execute("SELECT 1")
+        return connection
+
+    def _close_snapshot(self, connection):
+        """Implements ThreadDB._close_snapshot()"""
+        with suppress(psycopg.Error):
+            connection.rollback()
+        connection.close()
+
+    def _connection_wrapper(self, method, row_factory=None, return_success=False, snapshot=None):
+        """A function to execute a method that requires a db connection cursor."""
+
+        # Blank variables for the return value and if the method was successful
+        return_val, success = None, True
+
         try:
-            with psycopg.connect(conninfo=conn_info) as connection:
-                with connection.cursor(row_factory=row_factory) as cursor:
-                    return_val = method(cursor)
+            # Use the snapshot's connection if we have one (one query at a time on it)
+            if snapshot is not None:
+                with snapshot.lock:
+                    with snapshot.connection.cursor(row_factory=row_factory) as cursor:
+                        return_val = method(cursor)
+            else:
+                with psycopg.connect(conninfo=self._get_connection_string()) as connection:
+                    with connection.cursor(row_factory=row_factory) as cursor:
+                        return_val = method(cursor)
 
         except Exception as e:
             logging.error(f"Encountered error: {e}")
@@ -177,6 +217,12 @@ class ThreadPostgreSQL(ThreadDB):
         # If we're returning a success-boolean, return that; else return any value obtained
         return success if return_success else return_val
 
+    async def _run_with_connection(self, method, row_factory=None, return_success=False, snapshot=None):
+        """A function to execute a method that requires a db connection cursor without blocking the event loop."""
+        return await self._run_blocking(
+            self._connection_wrapper, method, row_factory=row_factory, return_success=return_success, snapshot=snapshot
+        )
+
     async def _get_column_names(self, sql):
         """Implements ThreadDB._get_column_names()"""
 
@@ -186,7 +232,7 @@ class ThreadPostgreSQL(ThreadDB):
             # Return the column names from the cursor description
             return [desc[0] for desc in cursor.description]
 
-        return self._connection_wrapper(cursor_select, row_factory=dict_row)
+        return await self._run_with_connection(cursor_select, row_factory=dict_row)
 
     async def _execute_select(self, sql, parameters=None, single_col=False, on_fetch=None):
         """Implements ThreadDB._execute_select()"""
@@ -206,7 +252,10 @@ class ThreadPostgreSQL(ThreadDB):
                 # psycopg.rows.tuple_row can be accessed with [int]; do so if not returning dictionary objects
                 return [ix[0] for ix in rows] if single_col else [dict(ix) for ix in rows]
 
-        return self._connection_wrapper(cursor_select, row_factory=tuple_row if single_col else dict_row)
+        with self.instrument_query("select", sql):
+            return await self._run_with_connection(
+                cursor_select, row_factory=tuple_row if single_col else dict_row, snapshot=self.current_snapshot
+            )
 
     async def _execute_insert(self, sql, data):
         """Implements ThreadDB._execute_insert()"""
@@ -215,15 +264,18 @@ class ThreadPostgreSQL(ThreadDB):
             # If needing to return newly-inserted data, update the query: https://github.com/psycopg/psycopg/issues/169
             cursor.execute(sql, tuple(data))
 
-        return self._connection_wrapper(cursor_insert)
+        with self.instrument_query("insert", sql):
+            return await self._run_with_connection(cursor_insert)
 
     async def _execute_update(self, sql, data):
         """Implements ThreadDB._execute_update()"""
 
         def cursor_update(cursor):
             cursor.execute(sql, tuple(data))
+            return cursor.rowcount
 
-        return self._connection_wrapper(cursor_update)
+        with self.instrument_query("update", sql):
+            return await self._run_with_connection(cursor_update)
 
     async def get_column_as_list(self, table, column):
         """Overrides ThreadDB.get_column_as_list()"""
@@ -237,16 +289,7 @@ class ThreadPostgreSQL(ThreadDB):
             return
 
         def cursor_multiple_execute(cursor):
-            # Execute each list item where the first part must be an SQL statement followed by optional parameters
-            for item in sql_list:
-                if item is None:  # skip None-items
-                    continue
-
-                if len(item) == 1:
-                    cursor.execute(item[0])
-                elif len(item) == 2:
-                    # execute() takes parameters as a tuple, ensure that is the case
-                    parameters = item[1] if isinstance(item[1], tuple) else tuple(item[1])
-                    cursor.execute(item[0], parameters)
-
-        return self._connection_wrapper(cursor_multiple_execute, return_success=return_success)
+            self._execute_sql_list_items(cursor, sql_list)
+
+        with self.instrument_query("sql_list", self.describe_sql_list(sql_list)):
+            return await self._run_with_connection(cursor_multiple_execute, return_success=return_success)
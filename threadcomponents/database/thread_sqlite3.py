@@ -5,7 +5,8 @@
 import logging
 import sqlite3
 
-from .thread_db import ThreadDB
+from .thread_db import NoRowsChangedError, ThreadDB
+from contextlib import suppress
 
 ENABLE_FOREIGN_KEYS = "PRAGMA foreign_keys = ON;"
 
@@ -42,6 +43,7 @@ class ThreadSQLite(ThreadDB):
             ("reports", end_date_field, not_partial_log, is_partial),
             ("report_sentence_hits", start_date_field, not_partial_log, is_partial),
             ("report_sentence_hits", end_date_field, not_partial_log, is_partial),
+            ("report_analysis_metrics", "date_analysed TEXT", not_partial_log, is_partial),
             ("report_sentence_hits_initial", start_date_field, partial_log, not is_partial),
             ("report_sentence_hits_initial", end_date_field, partial_log, not is_partial),
         ]
@@ -55,7 +57,13 @@ class ThreadSQLite(ThreadDB):
             except ValueError as e:
                 if not ignore_value_error:
                     raise e
-        try:  # Execute the schema's SQL statements
+        await self._run_blocking(self._execute_script, schema)
+        # Existing tables are not changed by the CREATE statements so add any new columns to them
+        await self.add_missing_columns(schema)
+
+    def _execute_script(self, schema):
+        """Function to execute a schema's SQL statements."""
+        try:
             with sqlite3.connect(self.database) as conn:
                 cursor = conn.cursor()
                 cursor.executescript(schema)
@@ -63,8 +71,28 @@ class ThreadSQLite(ThreadDB):
         except Exception as exc:
             logging.error("! error building db : {}".format(exc))
 
+    def _open_snapshot(self):
+        """Implements ThreadDB._open_snapshot()"""
+        # Autocommit-mode (isolation_level=None) so we control the transaction; this is used by the db's threads
+        conn = sqlite3.connect(self.database, isolation_level=None, check_same_thread=False)
+        conn.execute(ENABLE_FOREIGN_KEYS)
+        # A deferred transaction only starts reading at its first SELECT: run one now to fix the view of the db
+        conn.execute("BEGIN")
+        conn.execute("SELECT COUNT(*) FROM sqlite_master").fetchall()
+        return conn
+
+    def _close_snapshot(self, connection):
+        """Implements ThreadDB._close_snapshot()"""
+        with suppress(sqlite3.Error):
+            connection.execute("ROLLBACK")
+        connection.close()
+
     async def _get_column_names(self, sql):
         """Implements ThreadDB._get_column_names()"""
+        return await self._run_blocking(self._select_column_names, sql)
+
+    def _select_column_names(self, sql):
+        """Function to connect to the db and return the column names for data retrieved by an SQL statement."""
         with sqlite3.connect(self.database) as conn:
             cursor = conn.cursor()
             # Execute the SQL query
@@ -76,26 +104,43 @@ class ThreadSQLite(ThreadDB):
         """Implements ThreadDB._execute_select()"""
         if single_col and on_fetch:
             raise ValueError("Cannot request single-column and on_fetch transformations to be used at the same time.")
+        with self.instrument_query("select", sql):
+            return await self._run_blocking(self._select, sql, parameters, single_col, on_fetch, self.current_snapshot)
+
+    def _select(self, sql, parameters, single_col, on_fetch, snapshot):
+        """Function to execute an SQL SELECT query using a snapshot's connection or a new connection."""
+        if snapshot is not None:
+            with snapshot.lock:
+                return self._fetch_rows(snapshot.connection.cursor(), sql, parameters, single_col, on_fetch)
         with sqlite3.connect(self.database) as conn:
             conn.execute(ENABLE_FOREIGN_KEYS)
-            # If we are returning a single column, we just want to retrieve the first part of the row (row[0])
-            # else use sqlite3.Row to enable dictionary-conversions
-            conn.row_factory = (lambda cur, row: row[0]) if single_col else sqlite3.Row
-            cursor = conn.cursor()
-            # Execute the SQL query with parameters or not
-            if parameters is None:
-                cursor.execute(sql)
-            else:
-                cursor.execute(sql, parameters)
-            rows = cursor.fetchall()
-            if callable(on_fetch):
-                return on_fetch(rows)
-            else:
-                # Return the data as-is if returning a single column, else return the rows as dictionaries
-                return rows if single_col else [dict(ix) for ix in rows]
+            return self._fetch_rows(conn.cursor(), sql, parameters, single_col, on_fetch)
+
+    @staticmethod
+    def _fetch_rows(cursor, sql, parameters, single_col, on_fetch):
+        """Function to execute an SQL SELECT query with a cursor and return its (transformed) rows."""
+        # If we are returning a single column, we just want to retrieve the first part of the row (row[0])
+        # else use sqlite3.Row to enable dictionary-conversions
+        cursor.row_factory = (lambda cur, row: row[0]) if single_col else sqlite3.Row
+        # Execute the SQL query with parameters or not
+        if parameters is None:
+            cursor.execute(sql)
+        else:
+            cursor.execute(sql, parameters)
+        rows = cursor.fetchall()
+        if callable(on_fetch):
+            return on_fetch(rows)
+        else:
+            # Return the data as-is if returning a single column, else return the rows as dictionaries
+            return rows if single_col else [dict(ix) for ix in rows]
 
     async def _execute_insert(self, sql, data):
         """Implements ThreadDB._execute_insert()"""
+        with self.instrument_query("insert", sql):
+            return await self._run_blocking(self._insert, sql, data)
+
+    def _insert(self, sql, data):
+        """Function to connect to the db, execute an SQL INSERT statement and return the ID of the saved row."""
         with sqlite3.connect(self.database) as conn:
             conn.execute(ENABLE_FOREIGN_KEYS)
             cursor = conn.cursor()
@@ -107,37 +152,37 @@ class ThreadSQLite(ThreadDB):
 
     async def _execute_update(self, sql, data):
         """Implements ThreadDB._execute_update()"""
-        # Nothing extra do to or return:
-        # just connect to the db; execute the SQL statement with the data to update; and commit
+        with self.instrument_query("update", sql):
+            return await self._run_blocking(self._update, sql, data)
+
+    def _update(self, sql, data):
+        """Function to connect to the db, execute an SQL UPDATE (or DELETE) statement and return the rows affected."""
+        # SQLite allows one writer at a time so a statement's WHERE clause is checked and applied without interruption
         with sqlite3.connect(self.database) as conn:
             conn.execute(ENABLE_FOREIGN_KEYS)
             cursor = conn.cursor()
             cursor.execute(sql, tuple(data))
             conn.commit()
+            return cursor.rowcount
 
     async def run_sql_list(self, sql_list=None, return_success=True):
         """Implements ThreadDB.run_sql_list()"""
         # Don't do anything if we don't have a list
         if not sql_list:
             return
+        with self.instrument_query("sql_list", self.describe_sql_list(sql_list)):
+            return await self._run_blocking(self._run_sql_list, sql_list)
+
+    def _run_sql_list(self, sql_list):
+        """Function to connect to the db and execute a list of SQL statements in a single transaction."""
         try:
             with sqlite3.connect(self.database) as conn:
                 conn.execute(ENABLE_FOREIGN_KEYS)
                 cursor = conn.cursor()
-                # Else, execute each item in the list where the first part must be an SQL statement
-                # followed by optional parameters
-                for item in sql_list:
-                    if item is None:  # skip None-items
-                        continue
-                    elif len(item) == 1:
-                        cursor.execute(item[0])
-                    elif len(item) == 2:
-                        # execute() takes parameters as a tuple, ensure that is the case
-                        parameters = item[1] if isinstance(item[1], tuple) else tuple(item[1])
-                        cursor.execute(item[0], parameters)
+                self._execute_sql_list_items(cursor, sql_list)
                 # Finish by committing the changes from the list
                 conn.commit()
-        except sqlite3.Error as e:
+        except (sqlite3.Error, NoRowsChangedError) as e:
             logging.error("Encountered error: " + str(e))
             return False
         return True
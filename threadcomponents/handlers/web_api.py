@@ -2,7 +2,10 @@
 # This file has been moved into a different directory
 # To see its full history, please use `git log --follow <filename>` to view previous commits and additional contributors
 
+import asyncio
+import hashlib
 import logging
+import time
 
 from aiohttp import web as aiohttp_web
 from aiohttp.web_exceptions import HTTPException
@@ -12,17 +15,45 @@ from aiohttp_session import get_session
 from datetime import datetime
 from urllib.parse import quote
 
+from threadcomponents.database.thread_db import query_scope
 from threadcomponents.enums import ReportStatus
+from threadcomponents.helpers.metrics import CONTENT_TYPE, MetricsRegistry
+from threadcomponents.helpers.timing import StageTimer
 
 # The config options to load JS dependencies
 ONLINE_JS_SRC = "js-online-src"
 OFFLINE_JS_SRC = "js-local-src"
 # Key for a flag checking when a user has accepted the cookie notice
 ACCEPT_COOKIE = "accept_cookie_notice"
+# The longest (in seconds) a client can wait for the progress of analysing reports to change
+PROGRESS_WAIT_LIMIT = 30
+# How often (in seconds) the progress a client is waiting on is read again, for changes made by other processes
+PROGRESS_POLL_SECONDS = 2
+
+# Metrics for the requests handled by this process (recorded by WebAPI.req_handler)
+REQUEST_METRICS = MetricsRegistry()
+REQUEST_METRICS.describe("thread_http_requests_in_flight", "gauge", "Requests currently being handled.")
+REQUEST_METRICS.describe("thread_http_request_duration_seconds", "histogram", "Time taken to handle requests.")
+REQUEST_METRICS.describe("thread_http_responses_total", "counter", "Responses sent, by status code.")
+REQUEST_METRICS.describe("thread_http_db_queries_total", "counter", "Database calls made whilst handling requests.")
+# Metrics for the state of the app; these are read each time metrics are requested
+APP_METRICS = [
+    ("thread_queue_depth", "Reports waiting in the analysis queue."),
+    ("thread_queue_lane_depth", "Reports waiting in the analysis queue, by kind of lane."),
+    ("thread_queue_limit", "The maximum number of reports allowed in a user's queue (0 for no limit)."),
+    ("thread_analysis_tasks_active", "Reports currently being analysed."),
+    ("thread_analysis_tasks_max", "The maximum number of reports analysed at a time (max-analysis-tasks)."),
+    ("thread_user_queue_size", "Reports queued for each user (users are labelled by an anonymised ID)."),
+    ("thread_models_loaded", "Whether the classification models are loaded in memory."),
+    ("thread_models_count", "The number of classification models loaded in memory."),
+    ("thread_report_cache_reports", "Reports with data in the report cache."),
+    ("thread_report_cache_hits", "Requests for cached report data which were found in the cache."),
+    ("thread_report_cache_misses", "Requests for cached report data which were not found in the cache."),
+]
 
 
 class WebAPI:
-    def __init__(self, services, report_exporter, js_src=None):
+    def __init__(self, services, report_exporter, js_src=None, warm_up=False):
         self.dao = services["dao"]
         self.data_svc = services["data_svc"]
         self.web_svc = services["web_svc"]
@@ -33,6 +64,7 @@ class WebAPI:
         self.attack_data_svc = services["attack_data_svc"]
         self.is_local = self.web_svc.is_local
         self.report_exporter = report_exporter
+        self.warm_up = warm_up
         js_src_config = js_src if js_src in [ONLINE_JS_SRC, OFFLINE_JS_SRC] else ONLINE_JS_SRC
         self.BASE_PAGE_DATA = dict(
             about_url=self.web_svc.get_route(self.web_svc.ABOUT_KEY),
@@ -40,6 +72,7 @@ class WebAPI:
             how_it_works_url=self.web_svc.get_route(self.web_svc.HOW_IT_WORKS_KEY),
             what_to_submit_url=self.web_svc.get_route(self.web_svc.WHAT_TO_SUBMIT_KEY),
             rest_url=self.web_svc.get_route(self.web_svc.REST_KEY),
+            progress_url=self.web_svc.get_route(self.web_svc.ANALYSIS_PROGRESS_KEY),
             static_url=self.web_svc.get_route(self.web_svc.STATIC_KEY),
             js_src_online=js_src_config == ONLINE_JS_SRC,
             is_local=self.is_local,
@@ -62,18 +95,26 @@ class WebAPI:
         r2 = await self.dao.raw_select(non_apt_query, single_col=True)
         self.web_svc.keyword_dropdown_list = r1 + r2
 
-    async def pre_launch_init(self):
+    async def pre_launch_init(self, stage_timer=None):
         """Function to call any required methods before the app is initialised and launched."""
-        # We want nltk packs downloaded before startup; not run concurrently with startup
-        await self.token_svc.init()
+        stage_timer = stage_timer or StageTimer(enabled=False)
         # Before the app starts up, prepare the queue of reports
-        await self.rest_svc.prepare_queue()
+        with stage_timer.stage("rest_svc.prepare_queue"):
+            await self.rest_svc.prepare_queue()
         # We want the list of attacks, categories and keywords ready before the app starts
-        await self.set_attack_dropdown_list()
-        self.cat_dropdown_list = await self.data_svc.get_all_categories()
-        await self.set_keyword_dropdown_list()
+        with stage_timer.stage("set_attack_dropdown_list"):
+            await self.set_attack_dropdown_list()
+        with stage_timer.stage("get_all_categories"):
+            self.cat_dropdown_list = await self.data_svc.get_all_categories()
+        with stage_timer.stage("set_keyword_dropdown_list"):
+            await self.set_keyword_dropdown_list()
         # We want column names ready
-        await self.dao.db.initialise_column_names()
+        with stage_timer.stage("initialise_column_names"):
+            await self.dao.db.initialise_column_names()
+        # If wanted, load models and run a sentence through analysis so the first report isn't slower than the rest
+        if self.warm_up:
+            with stage_timer.stage("rest_svc.warm_up"):
+                await self.rest_svc.warm_up()
 
     async def fetch_and_update_attack_data(self):
         """Function to fetch and update the attack data."""
@@ -113,10 +154,18 @@ class WebAPI:
         """Function to intercept an application's requests and tweak the responses."""
         # Can't delete the Server header so leave as blank or junk
         server, server_msg = "Server", "Squeak, squeakin', squeakity"
+        # Label metrics by the matched route's pattern (not its path) so reports' pages are counted together
+        resource = request.match_info.route.resource
+        labels = dict(method=request.method, route=resource.canonical if resource is not None else "unmatched")
+        REQUEST_METRICS.inc("thread_http_requests_in_flight", labels)
+        start, status = time.perf_counter(), 500
         try:
-            # Get the response from the request as normal
-            response: web.Response = await handler(request)
+            # Get the response from the request as normal (counting the db calls made for it)
+            with query_scope(f"{request.method} {labels['route']}") as db_calls:
+                response: web.Response = await handler(request)
+            status = response.status
         except HTTPException as error_resp:
+            status = error_resp.status
             # If an exception occurred, override the server response header
             try:
                 error_resp.headers[server] = server_msg
@@ -126,10 +175,89 @@ class WebAPI:
             # Despite the exception, we want the error raised so the app can receive it
             finally:
                 raise error_resp
+        finally:
+            REQUEST_METRICS.inc("thread_http_requests_in_flight", labels, amount=-1)
+            REQUEST_METRICS.observe("thread_http_request_duration_seconds", time.perf_counter() - start, labels)
+            REQUEST_METRICS.inc("thread_http_responses_total", dict(labels, status=status))
+            REQUEST_METRICS.inc("thread_http_db_queries_total", labels, amount=db_calls.count)
         # If a response was retrieved, override the server response header and finally return the response
         response.headers[server] = server_msg
         return response
 
+    async def metrics(self, request):
+        """Function to return metrics about requests, the analysis queue, the db and caches in the Prometheus format."""
+        await self.web_svc.action_allowed(request, "view-metrics")
+        registries = [REQUEST_METRICS, self.dao.db.metrics, self.get_app_metrics()]
+        body = "".join(registry.render() for registry in registries)
+        return web.Response(body=body.encode("utf-8"), headers={"Content-Type": CONTENT_TYPE})
+
+    def get_app_metrics(self):
+        """Function to return a MetricsRegistry of the app's current state."""
+        app_metrics = MetricsRegistry()
+        for name, help_text in APP_METRICS:
+            app_metrics.describe(name, "gauge", help_text)
+        app_metrics.set("thread_queue_depth", self.rest_svc.queue.qsize())
+        lane_depths = dict.fromkeys(self.rest_svc.queue_weights, 0)
+        for (lane_kind, _), size in self.rest_svc.queue.lane_sizes().items():
+            lane_depths[lane_kind] += size
+        for lane_kind, size in lane_depths.items():
+            app_metrics.set("thread_queue_lane_depth", size, dict(lane=lane_kind))
+        app_metrics.set("thread_queue_limit", self.rest_svc.QUEUE_LIMIT or 0)
+        app_metrics.set("thread_analysis_tasks_active", len([t for t in self.rest_svc.current_tasks if not t.done()]))
+        app_metrics.set("thread_analysis_tasks_max", self.rest_svc.MAX_TASKS)
+        for user, queue in list(self.rest_svc.queue_map.items()):
+            # Users' queues are keyed by their tokens which should not be exposed
+            user_id = hashlib.sha256(user.encode("utf-8")).hexdigest()[:12]
+            app_metrics.set("thread_user_queue_size", len(queue), dict(user=user_id))
+        model_dict = self.ml_svc.model_dict
+        app_metrics.set("thread_models_loaded", int(model_dict is not None))
+        app_metrics.set("thread_models_count", len(model_dict or dict()))
+        for key, value in self.data_svc.report_cache.stats().items():
+            app_metrics.set(f"thread_report_cache_{key}", value)
+        return app_metrics
+
+    async def analysis_profile(self, request):
+        """Function to download the profile (a pstats file) taken whilst a report was analysed."""
+        await self.web_svc.action_allowed(request, "download-analysis-profile")
+        report_id = request.match_info.get(self.web_svc.REPORT_PARAM)
+        path = self.rest_svc.analysis_profiler.get_profile_path(report_id)
+        if not path:
+            raise web.HTTPNotFound()
+        return aiohttp_web.FileResponse(
+            path,
+            headers={
+                "Content-Type": "application/octet-stream",
+                "Content-Disposition": f"attachment; filename={report_id}.pstats",
+            },
+        )
+
+    async def analysis_progress(self, request):
+        """Function to return the stage (and sentences done) of each queued report; if the client already has this
+        (going by the If-None-Match header), wait up to the `wait` query parameter's seconds for it to change."""
+        try:
+            wait = min(max(0, float(request.query.get("wait", 0))), PROGRESS_WAIT_LIMIT)
+        except ValueError:
+            raise web.HTTPBadRequest()
+        token = None
+        # Only a user's own reports (or public ones if not logged in) are included
+        if not self.is_local and await authorized_userid(request):
+            _, token = await self.web_svc.get_current_arachne_user(request)
+
+        progress, client_etag = self.rest_svc.analysis_progress, request.headers.get("If-None-Match")
+        deadline = time.monotonic() + wait
+        while True:
+            reports = await self.rest_svc.get_analysis_progress(token=token, all_tokens=self.is_local)
+            etag = progress.get_etag(reports)
+            remaining = deadline - time.monotonic()
+            if etag != client_etag or remaining <= 0:
+                break
+            await progress.wait(min(remaining, PROGRESS_POLL_SECONDS))
+
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if etag == client_etag:
+            return aiohttp_web.Response(status=304, headers=headers)
+        return web.json_response(dict(reports=reports), headers=headers)
+
     async def accept_cookies(self, request):
         # There's no content expected for this request
         response = web.HTTPNoContent()
@@ -208,8 +336,9 @@ class WebAPI:
                     # Also add a fuller sentence describing the fraction
                     page_data[status.value]["column_info"] = "%s report(s) pending in Queue out of MAX %s" % queue_ratio
 
-                # Queued reports can't be deleted (unless errored)
+                # Queued reports can't be deleted (unless errored) but can be cancelled
                 page_data[status.value]["allow_delete"] = False
+                page_data[status.value]["allow_cancel"] = True
                 # There is no analysis button for queued reports
                 del page_data[status.value]["analysis_button"]
                 # Queued reports with errors have an error because the contents can't be viewed: update error message
@@ -246,6 +375,7 @@ class WebAPI:
                     insert_csv=lambda d: self.rest_svc.insert_csv(request=request, criteria=d),
                     remove_sentence=lambda d: self.rest_svc.remove_sentence(request=request, criteria=d),
                     delete_report=lambda d: self.rest_svc.delete_report(request=request, criteria=d),
+                    cancel_report=lambda d: self.rest_svc.cancel_report(request=request, criteria=d),
                     rollback_report=lambda d: self.rest_svc.rollback_report(request=request, criteria=d),
                     sentence_context=lambda d: self.rest_svc.sentence_context(request=request, criteria=d),
                     confirmed_attacks=lambda d: self.rest_svc.confirmed_attacks(request=request, criteria=d),
@@ -261,6 +391,9 @@ class WebAPI:
                     remove_indicator_of_compromise=lambda d: self.rest_svc.update_ioc(
                         request=request, criteria=d, deleting=True
                     ),
+                    analysis_metrics=lambda d: self.rest_svc.analysis_metrics(request=request, criteria=d),
+                    analysis_profiles=lambda d: self.rest_svc.analysis_profiles(request=request, criteria=d),
+                    set_analysis_profiling=lambda d: self.rest_svc.set_analysis_profiling(request=request, criteria=d),
                 )
             )
             method = options[request.method][index]
@@ -279,6 +412,41 @@ class WebAPI:
             status = 500
         return web.json_response(output, status=status)
 
+    async def _get_edit_page_data(self, report_id):
+        """Function to retrieve the data of a report needed for its edit page."""
+        # Read the report's data from one snapshot of the db so the page is consistent
+        async with self.dao.snapshot():
+            # These queries are independent so run them concurrently
+            (
+                sentences,
+                categories,
+                keywords,
+                indicators_of_compromise,
+                original_html,
+                unchecked,
+            ) = await asyncio.gather(
+                self.data_svc.get_report_sentences(report_id),
+                self.data_svc.get_report_categories_for_display(report_id, include_keynames=True),
+                self.data_svc.get_report_aggressors_victims(report_id),
+                self.data_svc.get_report_sentence_indicators_of_compromise(report_id),
+                self.dao.get("original_html", equal=dict(report_uid=report_id), order_by_asc=dict(elem_index=1)),
+                # Get the list of sentences with techniques that need to be confirmed
+                self.data_svc.get_unconfirmed_undated_attack_count(report_id=report_id, return_detail=True),
+            )
+
+        ioc_sentence_ids = {ioc["sentence_id"] for ioc in indicators_of_compromise}
+        for sentence in sentences:
+            sentence["is_ioc"] = sentence["uid"] in ioc_sentence_ids
+        final_html = await self.web_svc.build_final_html(original_html, sentences)
+        return dict(
+            sentences=sentences,
+            final_html=final_html,
+            original_html=original_html,
+            categories=categories,
+            keywords=keywords,
+            unchecked=unchecked,
+        )
+
     @template("columns.html")
     async def edit(self, request):
         """
@@ -310,19 +478,16 @@ class WebAPI:
         ]:
             raise web.HTTPNotFound()
 
-        # Proceed to gather the data for the template
-        sentences = await self.data_svc.get_report_sentences(report_id)
-        categories = await self.data_svc.get_report_categories_for_display(report_id, include_keynames=True)
-        keywords = await self.data_svc.get_report_aggressors_victims(report_id)
-        indicators_of_compromise = await self.data_svc.get_report_sentence_indicators_of_compromise(report_id)
-
-        for sentence in sentences:
-            sentence["is_ioc"] = any(ioc["sentence_id"] == sentence["uid"] for ioc in indicators_of_compromise)
-        original_html = await self.dao.get(
-            "original_html", equal=dict(report_uid=report_id), order_by_asc=dict(elem_index=1)
+        # Reuse the report's data if it hasn't changed since it was last viewed
+        edit_data = await self.data_svc.report_cache.get_or_load(
+            report_id, "edit", lambda: self._get_edit_page_data(report_id)
         )
-
-        final_html = await self.web_svc.build_final_html(original_html, sentences)
+        sentences, final_html, original_html = (
+            edit_data["sentences"],
+            edit_data["final_html"],
+            edit_data["original_html"],
+        )
+        categories, keywords, unchecked = edit_data["categories"], edit_data["keywords"], edit_data["unchecked"]
         pdf_link = self.web_svc.get_route(self.web_svc.EXPORT_PDF_KEY, param=title_quoted)
         nav_link = self.web_svc.get_route(self.web_svc.EXPORT_NAV_KEY, param=title_quoted)
         afb_link = self.web_svc.get_route(self.web_svc.EXPORT_AFB_KEY, param=title_quoted)
@@ -346,8 +511,6 @@ class WebAPI:
         if self.rest_svc.SENTENCE_LIMIT:
             sen_limit_help = "Reports are currently capped to the first %s sentences." % self.rest_svc.SENTENCE_LIMIT
 
-        # Get the list of sentences with techniques that need to be confirmed
-        unchecked = await self.data_svc.get_unconfirmed_undated_attack_count(report_id=report_id, return_detail=True)
         # Update overall template data and return
         template_data.update(
             file=report_title,
@@ -425,6 +588,18 @@ class WebAPI:
         pdfmake_data = await self.report_exporter.pdf_export(request)
         return web.json_response(pdfmake_data)
 
+    async def bulk_export(self, request):
+        """
+        Function to export all reports matching the request's filters (status, date range, category)
+        :param request: The query specifying the formats, container (ZIP or NDJSON) and filters
+        :return: a streamed response of the exported files
+        """
+        token = None
+        # Only a user's own reports (or public ones if not logged in) are exported
+        if not self.is_local and await authorized_userid(request):
+            _, token = await self.web_svc.get_current_arachne_user(request)
+        return await self.report_exporter.bulk_export(request, token=token)
+
     async def rebuild_ml(self, request):
         """
         This is a new api function to force a rebuild of the ML models.
@@ -0,0 +1,127 @@
+import hashlib
+import json
+import logging
+import os
+import requests
+import tempfile
+
+from threadcomponents.helpers.stix_stream import iter_stix_bundle_objects
+
+# The STIX object-types which make up our attack data
+INDEXED_TYPES = {"attack-pattern", "malware", "tool", "relationship"}
+MANIFEST_FILE = "manifest.json"
+
+
+def index_stix_object(stix_object, reject_func):
+    """Function to return what is recorded about an object in the manifest (or None if this isn't needed)."""
+    object_type = stix_object.get("type")
+    if object_type not in INDEXED_TYPES:
+        return None
+    target_ref = None
+    if object_type == "relationship":
+        # Only relationships giving example uses of attack-patterns are part of our attack data
+        target_ref = stix_object.get("target_ref") or ""
+        if (stix_object.get("relationship_type") != "uses") or ("attack-pattern" not in target_ref):
+            return None
+    return [stix_object.get("modified"), bool(reject_func(stix_object)), target_ref]
+
+
+def compute_delta(old_objects, new_objects):
+    """
+    Function to compare two manifests' objects ({STIX ID: [modified, rejected, target_ref]}).
+    :return: dictionary of added, changed, revoked and removed STIX IDs; plus the IDs of the attacks they affect
+    """
+    delta = dict(added=[], changed=[], revoked=[], removed=[], affected=set())
+
+    for stix_id, (modified, rejected, target_ref) in new_objects.items():
+        previous = old_objects.get(stix_id)
+        if previous is None:
+            delta["added"].append(stix_id)
+        elif previous[0] == modified and previous[1] == rejected:
+            continue
+        elif rejected and not previous[1]:
+            delta["revoked"].append(stix_id)
+        else:
+            delta["changed"].append(stix_id)
+        delta["affected"].add(target_ref or stix_id)
+        # A relationship moved from one attack affects both attacks
+        if previous and previous[2] and (previous[2] != target_ref):
+            delta["affected"].add(previous[2])
+
+    for stix_id, (modified, rejected, target_ref) in old_objects.items():
+        if stix_id not in new_objects:
+            delta["removed"].append(stix_id)
+            delta["affected"].add(target_ref or stix_id)
+
+    return delta
+
+
+class AttackStixCache:
+    """A local copy of the ATT&CK STIX bundle: stored by its checksum alongside a manifest of its objects."""
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.manifest_path = os.path.join(cache_dir, MANIFEST_FILE)
+
+    def load_manifest(self):
+        """Function to return the manifest of the last-applied bundle (or an empty manifest)."""
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as manifest_file:
+                return json.load(manifest_file)
+        except FileNotFoundError:
+            pass
+        except (ValueError, OSError) as e:
+            logging.warning(f"Could not read ATT&CK data manifest; all attack data will be updated: {e}")
+        return dict(sha256=None, etag=None, objects=dict())
+
+    def bundle_path(self, sha256):
+        """Function to return the file path of a stored bundle given its checksum."""
+        return os.path.join(self.cache_dir, f"{sha256}.json")
+
+    def fetch(self, url, manifest):
+        """
+        Function to download the bundle if it has changed since the last-applied one.
+        :return: the checksum and ETag of the (new or current) bundle
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        current_sha, current_etag = manifest.get("sha256"), manifest.get("etag")
+        have_current = bool(current_sha) and os.path.isfile(self.bundle_path(current_sha))
+        headers = {"If-None-Match": current_etag} if (have_current and current_etag) else None
+
+        with requests.get(url, headers=headers, stream=True) as response:
+            if have_current and response.status_code == 304:
+                logging.info("ATT&CK data has not been modified since it was last downloaded")
+                return current_sha, current_etag
+            response.raise_for_status()
+
+            # Write to a temporary file in the cache (so it can be renamed into place) whilst computing its checksum
+            sha256 = hashlib.sha256()
+            with tempfile.NamedTemporaryFile(dir=self.cache_dir, suffix=".tmp", delete=False) as temp_file:
+                try:
+                    for chunk in response.iter_content(chunk_size=1 << 16):
+                        sha256.update(chunk)
+                        temp_file.write(chunk)
+                except BaseException:
+                    temp_file.close()
+                    os.remove(temp_file.name)
+                    raise
+
+        checksum = sha256.hexdigest()
+        os.replace(temp_file.name, self.bundle_path(checksum))
+        return checksum, response.headers.get("ETag")
+
+    def iter_objects(self, sha256):
+        """Function to yield each object of a stored bundle."""
+        with open(self.bundle_path(sha256), "rb") as bundle_file:
+            yield from iter_stix_bundle_objects(bundle_file)
+
+    def save_manifest(self, sha256, etag, objects):
+        """Function to record a bundle as applied; older bundles are removed."""
+        temp_path = self.manifest_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as manifest_file:
+            json.dump(dict(sha256=sha256, etag=etag, objects=objects), manifest_file)
+        os.replace(temp_path, self.manifest_path)
+
+        for filename in os.listdir(self.cache_dir):
+            if filename.endswith(".json") and filename not in (MANIFEST_FILE, f"{sha256}.json"):
+                os.remove(os.path.join(self.cache_dir, filename))
@@ -0,0 +1,100 @@
+import asyncio
+
+from collections import deque, OrderedDict
+from contextlib import suppress
+
+
+class FairQueue:
+    """A queue of items in lanes which are served by (deficit) round-robin, so one busy lane can't starve the others.
+
+    Each turn, a lane may take as many items as its weight (carrying over any fraction) before the next lane's turn."""
+
+    def __init__(self, lane_func, weight_func=None):
+        # Functions returning an item's lane and a lane's weight (how many items it takes per turn)
+        self.lane_func = lane_func
+        self.weight_func = weight_func or (lambda lane: 1)
+        # Only lanes with items are kept, in the order of their turns
+        self._lanes = OrderedDict()
+        self._deficits = dict()
+        self._size = 0
+        # Futures of the get() calls waiting for an item, in the order they started waiting
+        self._getters = deque()
+
+    def qsize(self):
+        """Function to return the number of items in the queue."""
+        return self._size
+
+    def empty(self):
+        """Function to return whether the queue is empty."""
+        return not self._size
+
+    def lane_sizes(self):
+        """Function to return the number of items in each lane."""
+        return {lane: len(items) for lane, items in self._lanes.items()}
+
+    def put_nowait(self, item):
+        """Function to add an item to the end of its lane."""
+        lane = self.lane_func(item)
+        if lane not in self._lanes:
+            self._lanes[lane] = deque()
+            self._deficits[lane] = 0
+        self._lanes[lane].append(item)
+        self._size += 1
+        self._wake_next_getter()
+
+    def _wake_next_getter(self):
+        """Function to wake the longest-waiting get() which is still waiting."""
+        while self._getters:
+            getter = self._getters.popleft()
+            if not getter.done():
+                getter.set_result(None)
+                return
+
+    async def put(self, item):
+        """Function to add an item to the end of its lane (as asyncio.Queue.put())."""
+        self.put_nowait(item)
+
+    def get_nowait(self):
+        """Function to remove and return the next item; raises asyncio.QueueEmpty if there are none."""
+        if not self._size:
+            raise asyncio.QueueEmpty()
+        while True:
+            lane = next(iter(self._lanes))
+            if self._deficits[lane] < 1:
+                # Start this lane's turn; a lane with a weight under 1 may need a few turns to take an item
+                self._deficits[lane] += self.weight_func(lane)
+                if self._deficits[lane] < 1:
+                    self._lanes.move_to_end(lane)
+                    continue
+            items = self._lanes[lane]
+            item = items.popleft()
+            self._deficits[lane] -= 1
+            self._size -= 1
+            if not items:
+                # An emptied lane loses its turn and anything left of it
+                del self._lanes[lane], self._deficits[lane]
+            elif self._deficits[lane] < 1:
+                self._lanes.move_to_end(lane)
+            return item
+
+    async def get(self):
+        """Function to remove and return the next item, waiting until there is one (as asyncio.Queue.get())."""
+        while not self._size:
+            getter = asyncio.get_running_loop().create_future()
+            self._getters.append(getter)
+            try:
+                await getter
+            except asyncio.CancelledError:
+                with suppress(ValueError):
+                    self._getters.remove(getter)
+                # Pass on a wake-up this cancelled get() was given
+                if self._size and getter.done() and not getter.cancelled():
+                    self._wake_next_getter()
+                raise
+        return self.get_nowait()
+
+    def clear(self):
+        """Function to remove all items."""
+        self._lanes.clear()
+        self._deficits.clear()
+        self._size = 0
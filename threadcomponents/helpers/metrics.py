@@ -0,0 +1,113 @@
+import math
+import threading
+
+from bisect import bisect_left
+
+# The upper bounds (in seconds) of the latency-histogram buckets
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def escape_label_value(value):
+    """Function to escape a label value for the Prometheus text format."""
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(labels):
+    """Function to format a tuple of (label, value) pairs for the Prometheus text format."""
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{escape_label_value(value)}"' for key, value in labels) + "}"
+
+
+def format_value(value):
+    """Function to format a sample value for the Prometheus text format."""
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class MetricsRegistry:
+    """Counters, gauges and histograms which are rendered in the Prometheus text format.
+
+    Metrics are keyed by name and a tuple of sorted label pairs; these can be updated from any thread."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        # name -> (type, help text)
+        self._descriptions = dict()
+        # name -> {labels: value}; histogram values are [bucket counts, sum, count]
+        self._samples = dict()
+
+    def describe(self, name, metric_type, help_text):
+        """Function to set the type and help text of a metric."""
+        with self._lock:
+            self._descriptions[name] = (metric_type, help_text)
+            self._samples.setdefault(name, dict())
+
+    @staticmethod
+    def _labels_key(labels):
+        return tuple(sorted((labels or dict()).items()))
+
+    def inc(self, name, labels=None, amount=1):
+        """Function to increase a counter (or gauge) by an amount."""
+        key = self._labels_key(labels)
+        with self._lock:
+            samples = self._samples.setdefault(name, dict())
+            samples[key] = samples.get(key, 0) + amount
+
+    def set(self, name, value, labels=None):
+        """Function to set the value of a gauge."""
+        key = self._labels_key(labels)
+        with self._lock:
+            self._samples.setdefault(name, dict())[key] = value
+
+    def observe(self, name, value, labels=None):
+        """Function to record a value in a histogram."""
+        key = self._labels_key(labels)
+        with self._lock:
+            samples = self._samples.setdefault(name, dict())
+            histogram = samples.get(key)
+            if histogram is None:
+                histogram = samples[key] = [[0] * len(self.buckets), 0, 0]
+            # Buckets are stored non-cumulatively and summed on rendering
+            bucket_index = bisect_left(self.buckets, value)
+            if bucket_index < len(self.buckets):
+                histogram[0][bucket_index] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def get(self, name, labels=None):
+        """Function to return the current value of a counter or gauge (or None)."""
+        with self._lock:
+            return self._samples.get(name, dict()).get(self._labels_key(labels))
+
+    def clear(self, name):
+        """Function to remove all samples of a metric (e.g. for a gauge with labels which have since gone)."""
+        with self._lock:
+            self._samples[name] = dict()
+
+    def render(self):
+        """Function to return all metrics in the Prometheus text format."""
+        lines = []
+        with self._lock:
+            for name in sorted(self._samples):
+                metric_type, help_text = self._descriptions.get(name, ("untyped", ""))
+                if help_text:
+                    lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                for labels, value in sorted(self._samples[name].items()):
+                    if metric_type != "histogram":
+                        lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+                        continue
+                    bucket_counts, total, count = value
+                    cumulative = 0
+                    for bound, bucket_count in zip(self.buckets, bucket_counts):
+                        cumulative += bucket_count
+                        bucket_labels = labels + (("le", format_value(bound)),)
+                        lines.append(f"{name}_bucket{format_labels(bucket_labels)} {cumulative}")
+                    lines.append(f"{name}_bucket{format_labels(labels + (('le', '+Inf'),))} {count}")
+                    lines.append(f"{name}_sum{format_labels(labels)} {format_value(float(total))}")
+                    lines.append(f"{name}_count{format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,79 @@
+import cProfile
+import logging
+import os
+import random
+import re
+
+from contextlib import contextmanager
+
+PROFILE_SUFFIX = ".pstats"
+DEFAULT_PROFILE_LIMIT = 20
+# Profiles are named by report ID; anything else (e.g. a path) is not a valid name
+PROFILE_NAME = re.compile(r"^[\w-]+$")
+
+
+class AnalysisProfiler:
+    """Profiles the analysis of a sampled fraction of reports, keeping a pstats file for each of the latest reports."""
+
+    def __init__(self, directory=None, sample_rate=0, limit=DEFAULT_PROFILE_LIMIT):
+        self.directory = directory
+        self.limit = limit
+        self.sample_rate = 0
+        self.set_sample_rate(sample_rate)
+
+    def set_sample_rate(self, sample_rate):
+        """Function to set the fraction of reports to profile (0 for none, 1 for all)."""
+        sample_rate = float(sample_rate)
+        if not 0 <= sample_rate <= 1:
+            raise ValueError("Sample rate must be between 0 and 1.")
+        self.sample_rate = sample_rate
+
+    def should_profile(self):
+        """Function to return whether the next report should be profiled."""
+        return bool(self.directory) and random.random() < self.sample_rate
+
+    @contextmanager
+    def profile(self, report_id):
+        """Function to profile the code run within this context if this report is sampled."""
+        if not self.should_profile():
+            yield
+            return
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError as e:
+            # Only one profiler can be active at a time in some Python versions (e.g. whilst analysing concurrently)
+            logging.warning(f"Not profiling analysis of report {report_id}: {e}")
+            yield
+            return
+        try:
+            yield
+        finally:
+            profiler.disable()
+            self.save(report_id, profiler)
+
+    def save(self, report_id, profiler):
+        """Function to save a report's profile and remove the oldest profiles over the limit."""
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            profiler.dump_stats(os.path.join(self.directory, report_id + PROFILE_SUFFIX))
+            for name in self.list_profiles()[self.limit :]:
+                os.remove(os.path.join(self.directory, name + PROFILE_SUFFIX))
+        except OSError as e:
+            logging.warning(f"Could not save profile of report {report_id}: {e}")
+
+    def list_profiles(self):
+        """Function to return the report IDs which have a profile (newest first)."""
+        try:
+            filenames = [name for name in os.listdir(self.directory) if name.endswith(PROFILE_SUFFIX)]
+        except (OSError, TypeError):
+            return []
+        filenames.sort(key=lambda name: os.path.getmtime(os.path.join(self.directory, name)), reverse=True)
+        return [name[: -len(PROFILE_SUFFIX)] for name in filenames]
+
+    def get_profile_path(self, report_id):
+        """Function to return the path of a report's profile (or None if there isn't one)."""
+        if not (self.directory and report_id and PROFILE_NAME.match(report_id)):
+            return None
+        path = os.path.join(self.directory, report_id + PROFILE_SUFFIX)
+        return path if os.path.isfile(path) else None
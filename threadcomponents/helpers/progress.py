@@ -0,0 +1,83 @@
+import asyncio
+import hashlib
+import json
+import threading
+
+from collections import OrderedDict
+from contextlib import suppress
+
+# The stages a report's progress ends with
+FINISHED_STAGES = ["done", "error"]
+# The number of finished reports to keep the progress of (so clients waiting on them find out they finished)
+FINISHED_LIMIT = 100
+
+
+class AnalysisProgress:
+    """Keeps the stage (and number of sentences done) of each report this process is analysing (or has finished), so
+    clients can wait on changes. The reports queued by every process are kept in the db's analysis_jobs table.
+
+    Updates can come from any thread (analysis runs in an executor) whilst clients wait in the app's event loop."""
+
+    def __init__(self, finished_limit=FINISHED_LIMIT):
+        self.finished_limit = finished_limit
+        self._reports = OrderedDict()
+        self._lock = threading.Lock()
+        # Futures (with their event loops) of the clients waiting for the next update
+        self._waiters = set()
+
+    def update(self, report, **progress):
+        """Function to update the progress of a report (starting it if new) and wake any waiting clients."""
+        with self._lock:
+            entry = self._reports.pop(report["uid"], None) or dict(
+                title=report["title"], token=report.get("token"), stage="analysing", sentences_done=0, sentence_count=0
+            )
+            entry.update(progress)
+            # Keep the most recently updated reports last, so the oldest finished ones are forgotten first
+            self._reports[report["uid"]] = entry
+            finished = [uid for uid, item in self._reports.items() if item["stage"] in FINISHED_STAGES]
+            for uid in finished[: max(0, len(finished) - self.finished_limit)]:
+                del self._reports[uid]
+        self.notify()
+
+    def notify(self):
+        """Function to wake any waiting clients (e.g. as a report was queued)."""
+        with self._lock:
+            waiters, self._waiters = self._waiters, set()
+        for loop, future in waiters:
+            with suppress(RuntimeError):  # the waiting client's loop has closed
+                loop.call_soon_threadsafe(self._wake, future)
+
+    def remove(self, report_id):
+        """Function to stop keeping the progress of a report (e.g. it was deleted)."""
+        with self._lock:
+            self._reports.pop(report_id, None)
+
+    def get(self, token=None, all_tokens=False):
+        """Function to return the progress of reports (submitted with a token unless all are requested) by ID."""
+        with self._lock:
+            return {uid: dict(entry) for uid, entry in self._reports.items() if all_tokens or entry["token"] == token}
+
+    @staticmethod
+    def get_etag(entries):
+        """Function to return an ETag for a list of reports' progress."""
+        body = json.dumps(entries, sort_keys=True).encode("utf-8")
+        return '"%s"' % hashlib.sha1(body).hexdigest()
+
+    async def wait(self, timeout):
+        """Function to wait until the next update (or until timeout seconds have passed)."""
+        loop = asyncio.get_running_loop()
+        waiter = (loop, loop.create_future())
+        with self._lock:
+            self._waiters.add(waiter)
+        try:
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(waiter[1], timeout=timeout)
+        finally:
+            with self._lock:
+                self._waiters.discard(waiter)
+
+    @staticmethod
+    def _wake(future):
+        """Function to let a waiting client know there was an update."""
+        if not future.done():
+            future.set_result(True)
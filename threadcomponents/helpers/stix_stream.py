@@ -0,0 +1,99 @@
+import codecs
+import json
+import re
+
+# How much of a STIX bundle to read at a time
+DEFAULT_CHUNK_SIZE = 1 << 16
+WHITESPACE = re.compile(r"\s*")
+
+
+class StixBundleReader:
+    """Reads the objects of a STIX bundle from a file one at a time, without loading the whole bundle.
+
+    Only the bundle's top-level keys and its current object are held in memory; an object split across reads is
+    decoded again once more of the file has been read."""
+
+    def __init__(self, file_obj, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.file_obj = file_obj
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer, self.pos, self.eof = "", 0, False
+        # For binary files: a character may be split across reads
+        self.utf8_decoder = codecs.getincrementaldecoder("utf-8")()
+
+    def __iter__(self):
+        """Yields each object in the bundle's `objects` list."""
+        self._expect("{")
+        if self._peek() == "}":
+            return
+
+        while True:
+            key = self._decode()
+            self._expect(":")
+            if key == "objects":
+                self._expect("[")
+                if self._peek() == "]":
+                    self.pos += 1
+                else:
+                    while True:
+                        yield self._decode()
+                        if self._expect(",]") == "]":
+                            break
+            else:
+                self._decode()  # other top-level values (e.g. the bundle's ID) are not needed
+
+            if self._expect(",}") == "}":
+                return
+
+    def _read(self):
+        """Function to add the next chunk of the file to the buffer (dropping what has been decoded already)."""
+        if self.eof:
+            return False
+        chunk = self.file_obj.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        if isinstance(chunk, bytes):
+            chunk = self.utf8_decoder.decode(chunk)
+        self.buffer = self.buffer[self.pos :] + chunk
+        self.pos = 0
+        return True
+
+    def _peek(self):
+        """Function to return the next non-whitespace character (or None at the end of the file)."""
+        while True:
+            self.pos = WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._read():
+                return None
+
+    def _expect(self, allowed):
+        """Function to consume and return the next non-whitespace character, checking it is allowed here."""
+        char = self._peek()
+        if (char is None) or (char not in allowed):
+            raise ValueError(f"Malformed STIX bundle: expected one of {allowed!r} at character {self.pos}.")
+        self.pos += 1
+        return char
+
+    def _decode(self):
+        """Function to decode and return the next JSON value."""
+        self._peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                # The value may continue in the next chunk
+                if self._read():
+                    continue
+                raise
+            # A number at the end of the buffer may also continue in the next chunk
+            if isinstance(value, (int, float)) and (end == len(self.buffer)) and self._read():
+                continue
+            self.pos = end
+            return value
+
+
+def iter_stix_bundle_objects(file_obj, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Function to yield each object of a STIX bundle read from a (text or binary) file."""
+    return iter(StixBundleReader(file_obj, chunk_size=chunk_size))
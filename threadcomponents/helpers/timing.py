@@ -0,0 +1,85 @@
+import sys
+import threading
+import time
+
+from contextlib import contextmanager
+
+# Dependencies which are slow to import so should only be loaded once needed
+HEAVY_MODULES = ["htmldate", "newspaper", "nltk", "numpy", "pandas", "sklearn"]
+
+
+class StageTimeout(Exception):
+    """Raised when a stage has taken longer (in total) than its deadline."""
+
+
+class StagesCancelled(Exception):
+    """Raised when a stage is started (or finishes) after the timed work was cancelled."""
+
+
+class StageTimer:
+    """Records how long named stages take (e.g. the steps of starting the app); does nothing if not enabled.
+
+    Stages can be given deadlines (in seconds) and the timed work can be cancelled (e.g. from another thread): these
+    are checked as each stage starts and finishes, so a stage is not interrupted but the work stops after it."""
+
+    def __init__(self, enabled=True, deadlines=None, on_stage=None):
+        self.enabled = enabled
+        self.stages = []
+        self.deadlines = deadlines or dict()
+        # A function called with each stage's name as the stage starts
+        self.on_stage = on_stage
+        self._cancelled = threading.Event()
+
+    @property
+    def cancelled(self):
+        """Whether the timed work has been cancelled."""
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        """Function to stop the timed work when it next starts or finishes a stage."""
+        self._cancelled.set()
+
+    def check(self, name=None):
+        """Function to raise an error if the timed work was cancelled or a stage has gone over its deadline."""
+        if self.cancelled:
+            raise StagesCancelled()
+        deadline = self.deadlines.get(name)
+        if (deadline is not None) and (self.totals().get(name, 0) > deadline):
+            raise StageTimeout(f"Stage `{name}` took longer than {deadline} seconds.")
+
+    @contextmanager
+    def stage(self, name):
+        """Function to time the code run within this context as the given stage."""
+        if not self.enabled:
+            yield
+            return
+        self.check(name)
+        if self.on_stage:
+            self.on_stage(name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+        self.check(name)
+
+    def add(self, name, seconds):
+        """Function to record a stage which was timed elsewhere."""
+        if self.enabled:
+            self.stages.append((name, seconds))
+
+    def totals(self):
+        """Function to return the total time recorded for each stage (a stage can be timed more than once)."""
+        totals = dict()
+        for name, seconds in self.stages:
+            totals[name] = totals.get(name, 0) + seconds
+        return totals
+
+    def report(self):
+        """Function to return the recorded stages and their times as a table."""
+        width = max([len(name) for name, _ in self.stages] + [len("total")])
+        lines = [f"{name:<{width}} {seconds * 1000:>10.1f} ms" for name, seconds in self.stages]
+        lines.append(f"{'total':<{width}} {sum(seconds for _, seconds in self.stages) * 1000:>10.1f} ms")
+        loaded = [module for module in HEAVY_MODULES if module in sys.modules]
+        lines.append(f"Heavy modules loaded: {', '.join(loaded) or 'none'}")
+        return "\n".join(lines)
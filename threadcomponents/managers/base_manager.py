@@ -83,6 +83,10 @@ class ReportEntityManager:
         # Checks have passed, return report for further use
         return report[0]
 
+    async def report_changed(self, report_id):
+        """Function to invalidate any cached data for a report after its data has been changed."""
+        await self.data_svc.report_cache.bump(report_id)
+
     async def check_report_status(self, report_id="", status=ReportStatus.IN_REVIEW.value, update_if_false=False):
         """Function to check a report is of the given status and updates it if not."""
         # No report ID, no result
@@ -112,6 +116,7 @@ class ReportEntityManager:
             # Update the report status in the db and the dictionary variable for future checks
             await self.dao.update("reports", where=dict(uid=report_id), data=dict(current_status=status))
             self.seen_report_status[report_id] = status
+            await self.report_changed(report_id)
             return True
         else:
             return False  # Report status does not match and we are not updating the db
@@ -57,6 +57,7 @@ class IoCManager(ReportEntityManager):
 
         if deleting:
             await self.dao.delete(table, db_query)
+            await self.report_changed(report_id)
             success.update(dict(info="The selected sentence is no longer flagged as an IoC.", alert_user=1))
             return success
 
@@ -78,9 +79,11 @@ class IoCManager(ReportEntityManager):
             if existing[0]["refanged_sentence_text"] == text:
                 return REST_IGNORED
             await self.dao.update(table, where=db_query, data=dict(refanged_sentence_text=text))
+            await self.report_changed(report_id)
             success.update(dict(info="This sentence-IoC text has been updated.", alert_user=1))
         else:
             await self.dao.insert_generate_uid(table, dict(**db_query, refanged_sentence_text=text))
+            await self.report_changed(report_id)
             success.update(dict(info="The selected sentence has been flagged as an IoC.", alert_user=1))
 
         return success
@@ -12,7 +12,7 @@ class MappingManager(ReportEntityManager):
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.mapping_repo = MappingRepository(self.dao)
+        self.mapping_repo = MappingRepository(self.dao, report_cache=self.data_svc.report_cache)
 
     async def reject_attack(self, request, criteria):
         """Function to reject a mapping on a sentence."""
@@ -38,7 +38,9 @@ class MappingManager(ReportEntityManager):
         sentence_to_insert = await self.web_svc.remove_html_markup_and_found(sentence_dict[0]["text"])
         sentence_to_insert = self.dao.truncate_str(sentence_to_insert, 800)
 
-        await self.mapping_repo.reject_attack(sen_id, sentence_to_insert, attack_id)
+        await self.mapping_repo.reject_attack(
+            sen_id, sentence_to_insert, attack_id, report_id=sentence_dict[0]["report_uid"]
+        )
 
         # As a technique has been rejected, ensure the report's status reflects analysis has started
         await self.check_report_status(report_id=sentence_dict[0]["report_uid"], update_if_false=True)
@@ -66,7 +68,7 @@ class MappingManager(ReportEntityManager):
         if checks is not None:
             return checks
 
-        await self.mapping_repo.ignore_attack(sen_id, attack_id)
+        await self.mapping_repo.ignore_attack(sen_id, attack_id, report_id=sentence_dict[0]["report_uid"])
 
         # As a technique has been rejected, ensure the report's status reflects analysis has started
         await self.check_report_status(report_id=sentence_dict[0]["report_uid"], update_if_false=True)
@@ -12,7 +12,7 @@ class ReportManager(ReportEntityManager):
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.report_repo = ReportRepository(self.dao)
+        self.report_repo = ReportRepository(self.dao, report_cache=self.data_svc.report_cache)
 
     def add_report_expiry(self, *args, **kwargs):
         """Function to generate an expiry date from today."""
@@ -63,6 +63,7 @@ class ReportManager(ReportEntityManager):
             await self.dao.update("reports", where=dict(uid=report_id), data=update_data)
 
             self.seen_report_status[report_id] = new_status
+            await self.report_changed(report_id)
             # Before finishing, do any post-complete tasks if necessary
             if not self.is_local:
                 report_data = await self.data_svc.export_report_data(report_id=report_id)
@@ -102,6 +103,7 @@ class ReportManager(ReportEntityManager):
                 data=dict(current_status=ReportStatus.NEEDS_REVIEW.value, error=self.dao.db_false_val),
             )
             self.seen_report_status[report_id] = ReportStatus.NEEDS_REVIEW.value
+            await self.report_changed(report_id)
             return REST_SUCCESS
         else:
             # If unsuccessful: log this, change report status back to what it was and add error flag
@@ -109,6 +111,7 @@ class ReportManager(ReportEntityManager):
             await self.dao.update(
                 "reports", where=dict(uid=report_id), data=dict(current_status=r_status, error=self.dao.db_true_val)
             )
+            await self.report_changed(report_id)
             return default_error
 
     async def delete_report(self, request, criteria=None):
@@ -132,6 +135,7 @@ class ReportManager(ReportEntityManager):
 
         # Proceed with delete
         await self.dao.delete("reports", dict(uid=report_id))
+        await self.report_changed(report_id)
         return REST_SUCCESS
 
     async def set_report_categories(self, request, criteria=None):
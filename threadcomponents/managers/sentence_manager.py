@@ -34,6 +34,7 @@ class SentenceManager(ReportEntityManager):
         await self.dao.delete("report_sentences", dict(uid=sen_id))
         # This could also be an image, so delete from original_html table too
         await self.dao.delete("original_html", dict(uid=sen_id))
+        await self.report_changed(report_id)
         # As a report has been edited, ensure the report's status reflects analysis has started
         await self.check_report_status(report_id=report_id, update_if_false=True)
         return REST_SUCCESS
@@ -0,0 +1,113 @@
+import threading
+
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# The default number of reports to keep cached data for
+DEFAULT_CACHE_SIZE = 50
+# The versions of reports being read in bulk (report ID -> data_version) whose data is only cached if it already was
+_bulk_read_versions = ContextVar("bulk_read_versions", default=None)
+
+
+class ReportCache:
+    """A cache of data assembled for reports (e.g. edit-page data and export inputs).
+
+    Each report has a version (its data_version in the db) which is bumped after every write to its data; cached data
+    is stored against the version it was read at, so data is only returned whilst the report is unchanged. As versions
+    are kept in the db, a change made by any process is seen by every process's cache at the cost of one single-row
+    read per request. Cached values are shared between callers so should be treated as read-only."""
+
+    def __init__(self, dao, max_reports=DEFAULT_CACHE_SIZE):
+        self.dao = dao
+        self.max_reports = max(0, max_reports or 0)
+        # Writes can happen in analysis threads as well as the event loop
+        self._lock = threading.Lock()
+        # report ID -> (version, dict of cached key -> value); ordered by least-recently used
+        self._entries = OrderedDict()
+        # How often cached data was found (or not) when requested
+        self.hits, self.misses = 0, 0
+
+    async def get_version(self, report_id):
+        """Function to return the current version of a report (None if it doesn't exist). Obtain this before reading
+        the report's data."""
+        versions = await self.dao.raw_select(
+            f"SELECT data_version FROM reports WHERE uid = {self.dao.db_qparam}",
+            parameters=(report_id,),
+            single_col=True,
+        )
+        return versions[0] if versions else None
+
+    async def bump(self, report_id):
+        """Function to mark a report's data as changed. Call this after the change has been committed."""
+        if not report_id:
+            return
+        await self.dao.increment("reports", "data_version", uid=report_id)
+        with self._lock:
+            self._entries.pop(report_id, None)
+
+    async def clear(self):
+        """Function to mark every report's data as changed."""
+        await self.dao.increment("reports", "data_version")
+        with self._lock:
+            self._entries.clear()
+
+    def get(self, report_id, key, version, touch=True):
+        """Function to return a cached value for a report (or None) if it was cached at the given version; touch
+        marks the report as recently used."""
+        with self._lock:
+            entry = self._entries.get(report_id)
+            if (entry is None) or (entry[0] != version) or (key not in entry[1]):
+                self.misses += 1
+                return None
+            self.hits += 1
+            if touch:
+                self._entries.move_to_end(report_id)
+            return entry[1][key]
+
+    @contextmanager
+    def bulk_read(self, reports):
+        """Context manager for reading many reports (with their data_version) which uses data already cached for them
+        but doesn't cache any more, so the reports being viewed aren't evicted."""
+        versions = {report["uid"]: report["data_version"] for report in reports}
+        token = _bulk_read_versions.set(versions)
+        try:
+            yield
+        finally:
+            _bulk_read_versions.reset(token)
+
+    def stats(self):
+        """Function to return the number of reports with data cached and how often cached data was found (or not)."""
+        with self._lock:
+            return dict(reports=len(self._entries), hits=self.hits, misses=self.misses)
+
+    def set(self, report_id, key, version, value):
+        """Function to cache a value for a report which was read at the given version."""
+        if not self.max_reports or version is None:
+            return
+        with self._lock:
+            entry = self._entries.get(report_id)
+            # Don't replace data read after a later change to the report
+            if (entry is not None) and (entry[0] > version):
+                return
+            if (entry is None) or (entry[0] != version):
+                entry = self._entries[report_id] = (version, dict())
+            entry[1][key] = value
+            self._entries.move_to_end(report_id)
+            while len(self._entries) > self.max_reports:
+                self._entries.popitem(last=False)
+
+    async def get_or_load(self, report_id, key, loader):
+        """Function to return a cached value for a report or await loader() to obtain (and cache) it."""
+        if not self.max_reports:
+            return await loader()
+        bulk_versions = _bulk_read_versions.get()
+        if (bulk_versions is not None) and (report_id in bulk_versions):
+            value = self.get(report_id, key, bulk_versions[report_id], touch=False)
+            return await loader() if value is None else value
+        version = await self.get_version(report_id)
+        value = self.get(report_id, key, version)
+        if value is None:
+            value = await loader()
+            self.set(report_id, key, version, value)
+        return value
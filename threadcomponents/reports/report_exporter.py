@@ -1,8 +1,10 @@
 import json
+import zipfile
 
 from aiohttp_jinja2 import web
 from threadcomponents.enums import ReportStatus
 from threadcomponents.constants import UID, URL, TITLE
+from threadcomponents.helpers.date import to_datetime_obj
 from threadcomponents.reports.afb_exporter import AFBExporter
 
 STATUS = "current_status"
@@ -10,6 +12,11 @@ DATE_WRITTEN = "date_written_str"
 START_DATE = "start_date_str"
 END_DATE = "end_date_str"
 MITRE_ATTACK_VERSION = 13.1
+# The formats and containers available for bulk exports
+BULK_FORMAT_NAV, BULK_FORMAT_AFB, BULK_FORMAT_PDF = "nav", "afb", "pdf"
+BULK_FORMATS = (BULK_FORMAT_NAV, BULK_FORMAT_AFB, BULK_FORMAT_PDF)
+BULK_ZIP, BULK_NDJSON = "zip", "ndjson"
+BULK_CONTAINERS = (BULK_ZIP, BULK_NDJSON)
 
 
 def sanitise_filename(filename=""):
@@ -20,6 +27,51 @@ def sanitise_filename(filename=""):
     return "".join([x if (x.isalnum() or x in "-'") else "_" for x in temp_fn])
 
 
+class BulkExportStream:
+    """Collects exported files as ZIP or NDJSON bytes which can be sent on as each file is added."""
+
+    def __init__(self, container):
+        self.container = container
+        self._chunks = []
+        self._filenames = set()
+        # An unseekable file-object makes ZipFile write each entry sequentially (with data descriptors)
+        self._zip = zipfile.ZipFile(self, mode="w", compression=zipfile.ZIP_DEFLATED) if container == BULK_ZIP else None
+
+    def write(self, data):
+        """Receives bytes from the ZipFile."""
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        """Returns (and forgets) the bytes collected since this was last called."""
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+    def add(self, export_format, title, filename, data):
+        """Adds an exported file."""
+        if self._zip is None:
+            line = dict(format=export_format, title=title, filename=filename, data=data)
+            self._chunks.append((json.dumps(line) + "\n").encode("utf-8"))
+            return
+
+        # Keep each format in its own folder; sanitised titles could clash so ensure file paths are unique
+        path, count = f"{export_format}/{filename}", 1
+        while path in self._filenames:
+            count += 1
+            path = f"{export_format}/{count}_{filename}"
+        self._filenames.add(path)
+        self._zip.writestr(path, json.dumps(data, indent=4))
+
+    def close(self):
+        """Finishes the stream (writing the ZIP's central directory if applicable)."""
+        if self._zip is not None:
+            self._zip.close()
+
+
 class ReportExporter:
     """A class to help with exporting reports."""
 
@@ -60,17 +112,53 @@ class ReportExporter:
     async def afb_export(self, request):
         """Exports a report in an AFB format."""
         report = await self.check_request_for_export(request, "afb-export")
+        filename, data = await self.get_afb_export(report)
+        return filename, json.dumps(data, indent=4)
+
+    async def nav_export(self, request):
+        """Exports a report in a navigator-friendly format."""
+        report = await self.check_request_for_export(request, "nav-export")
+        filename, data = await self.get_nav_export(report)
+        return filename, json.dumps(data, indent=4)
+
+    async def pdf_export(self, request):
+        report = await self.check_request_for_export(request, "pdf-export")
+        filename, dd = await self.get_pdf_export(report)
+        return dd
+
+    async def get_afb_export(self, report):
+        """Returns the filename and AFB data for a report; this is reused until the report changes."""
+        return await self.data_svc.report_cache.get_or_load(
+            report[UID], "afb_file", lambda: self.build_afb_export(report)
+        )
+
+    async def get_nav_export(self, report):
+        """Returns the filename and navigator layer for a report; this is reused until the report changes."""
+        # The report's fields are part of the key as the report may have been read before its last change
+        cache_key = ("nav_file", report[DATE_WRITTEN], report[START_DATE], report[END_DATE])
+        return await self.data_svc.report_cache.get_or_load(
+            report[UID], cache_key, lambda: self.build_nav_export(report)
+        )
+
+    async def get_pdf_export(self, report):
+        """Returns the filename and pdfmake data for a report; this is reused until the report changes."""
+        cache_key = ("pdf_file", report[STATUS], report[DATE_WRITTEN], report[START_DATE], report[END_DATE])
+        return await self.data_svc.report_cache.get_or_load(
+            report[UID], cache_key, lambda: self.build_pdf_export(report)
+        )
+
+    async def build_afb_export(self, report):
+        """Builds the AFB data for a report."""
         report_id = report[UID]
         report_title = report[TITLE]
         techniques = await self.data_svc.get_confirmed_techniques_for_afb_export(report_id)
 
         data = AFBExporter(report_title, techniques).export()
         filename = f"{sanitise_filename(report_title)}.afb"
-        return filename, json.dumps(data, indent=4)
+        return filename, data
 
-    async def nav_export(self, request):
-        """Exports a report in a navigator-friendly format."""
-        report = await self.check_request_for_export(request, "nav-export")
+    async def build_nav_export(self, report):
+        """Builds the navigator layer for a report."""
         report_id = report[UID]
         report_title = report[TITLE]
         date_of = report[DATE_WRITTEN]
@@ -111,12 +199,11 @@ class ReportExporter:
         for technique in techniques:
             enterprise_layer["techniques"].append(technique)
 
-        # Return as a filename, JSON string tuple
         filename = f"{sanitise_filename(report_title)}.json"
-        return filename, json.dumps(enterprise_layer, indent=4)
+        return filename, enterprise_layer
 
-    async def pdf_export(self, request):
-        report = await self.check_request_for_export(request, "pdf-export")
+    async def build_pdf_export(self, report):
+        """Builds the pdfmake data for a report."""
         report_id = report[UID]
         title = report[TITLE]
         report_url = report[URL]
@@ -142,7 +229,78 @@ class ReportExporter:
         self.pdfmake_add_keywords_table(dd, keywords, all_regions)
         self.pdfmake_add_sentences_attack_ioc_tables(dd, sentences, indicators_of_compromise, flatten_sentences)
         self.pdfmake_add_supporting_country_info(dd, all_regions)
-        return dd
+        filename = f"{sanitise_filename(title)}.pdfmake.json"
+        return filename, dd
+
+    async def bulk_export(self, request, token=None):
+        """Streams the exports of all reports matching the request's filters as a ZIP or NDJSON file."""
+        formats, container, filters = self.parse_bulk_export_query(request.query)
+        reports = await self.data_svc.get_reports_for_export(
+            token=token, add_expiry_bool=(not self.is_local), **filters
+        )
+
+        media_type = "zip" if container == BULK_ZIP else "x-ndjson"
+        response = web.StreamResponse(
+            headers={
+                "Content-Type": f"application/{media_type}",
+                "Content-Disposition": f"attachment; filename=thread-reports.{container}",
+            }
+        )
+        await response.prepare(request)
+        stream = BulkExportStream(container)
+
+        # Only one report's files are built and held here at a time, before being sent on to the client
+        # Use any cached files but don't cache more: these would evict the reports being viewed
+        with self.data_svc.report_cache.bulk_read(reports):
+            for report in reports:
+                try:
+                    await self.web_svc.action_allowed(request, "bulk-export", context=dict(report=report))
+                except web.HTTPException:
+                    continue
+
+                for export_format in formats:
+                    filename, data = await self.bulk_export_getters[export_format](report)
+                    stream.add(export_format, report[TITLE], filename, data)
+                    await response.write(stream.pop())
+
+        stream.close()
+        await response.write(stream.pop())
+        await response.write_eof()
+        return response
+
+    @property
+    def bulk_export_getters(self):
+        """The methods to retrieve each bulk-export format for a report."""
+        return {
+            BULK_FORMAT_NAV: self.get_nav_export,
+            BULK_FORMAT_AFB: self.get_afb_export,
+            BULK_FORMAT_PDF: self.get_pdf_export,
+        }
+
+    @staticmethod
+    def parse_bulk_export_query(query):
+        """Returns the formats, container and report filters requested for a bulk export."""
+        formats = [f for f in query.get("format", ",".join(BULK_FORMATS)).split(",") if f]
+        container = query.get("container", BULK_ZIP)
+        exportable = [ReportStatus.NEEDS_REVIEW.value, ReportStatus.IN_REVIEW.value, ReportStatus.COMPLETED.value]
+        statuses = [st for st in query.get("status", ",".join(exportable)).split(",") if st]
+
+        if (not formats) or any(f not in BULK_FORMATS for f in formats):
+            raise web.HTTPBadRequest(reason="Export formats should be from: " + ", ".join(BULK_FORMATS))
+        if container not in BULK_CONTAINERS:
+            raise web.HTTPBadRequest(reason="Export container should be one of: " + ", ".join(BULK_CONTAINERS))
+        if (not statuses) or any(st not in exportable for st in statuses):
+            raise web.HTTPBadRequest(reason="Report statuses should be from: " + ", ".join(exportable))
+
+        filters = dict(statuses=statuses, category=query.get("category") or None)
+        for date_key in ["start_date", "end_date"]:
+            try:
+                filters[date_key] = to_datetime_obj(query[date_key], raise_error=True) if query.get(date_key) else None
+            except ValueError:
+                raise web.HTTPBadRequest(reason=f"{date_key} should be in the format YYYY-MM-DD.")
+
+        # Remove duplicates whilst keeping the requested order
+        return list(dict.fromkeys(formats)), container, filters
 
     @staticmethod
     def pdfmake_create_initial_dd():
@@ -4,10 +4,16 @@ from threadcomponents.helpers.date import to_datetime_obj
 class MappingRepository:
     """Repository to save various mapping data to the database."""
 
-    def __init__(self, dao):
+    def __init__(self, dao, report_cache=None):
         self.dao = dao
+        self.report_cache = report_cache
 
-    async def reject_attack(self, sen_id, sentence_str, attack_id):
+    async def _report_changed(self, report_id):
+        """Function to invalidate any cached data for a report after its data has been changed."""
+        if self.report_cache is not None:
+            await self.report_cache.bump(report_id)
+
+    async def reject_attack(self, sen_id, sentence_str, attack_id, report_id=None):
         """Executes the database operations to reject a mapping on a sentence."""
         # The list of SQL commands to run in a single transaction
         sql_commands = [
@@ -66,8 +72,9 @@ class MappingRepository:
 
         # Run the updates, deletions and insertions for this method altogether
         await self.dao.run_sql_list(sql_list=sql_commands)
+        await self._report_changed(report_id)
 
-    async def ignore_attack(self, sen_id, attack_id):
+    async def ignore_attack(self, sen_id, attack_id, report_id=None):
         """Executes the database operations to ignore a mapping on a sentence."""
         # The list of SQL commands to run in a single transaction
         sql_commands = [
@@ -109,6 +116,7 @@ class MappingRepository:
 
         # Run the updates, deletions and insertions for this method altogether
         await self.dao.run_sql_list(sql_list=sql_commands)
+        await self._report_changed(report_id)
 
     async def add_attack(
         self,
@@ -206,6 +214,7 @@ class MappingRepository:
 
         # Run the updates, deletions and insertions for this method altogether
         await self.dao.run_sql_list(sql_list=sql_commands)
+        await self._report_changed(report_id)
 
     async def update_attack_time(
         self,
@@ -276,5 +285,6 @@ class MappingRepository:
                 )
 
             await self.dao.run_sql_list(sql_list=all_updates)
+            await self._report_changed(report_id)
 
         return len(mapping_updates), bool(report_updates)
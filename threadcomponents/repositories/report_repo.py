@@ -4,20 +4,31 @@ import logging
 class ReportRepository:
     """Repository to save / retrieve various report data to / from the database."""
 
-    def __init__(self, dao):
+    def __init__(self, dao, report_cache=None):
         self.dao = dao
-
-    async def save_reg_techniques(self, report_id, sentence, sentence_index, tech_start_date=None):
-        sentence_id = await self.dao.insert_with_backup(
+        self.report_cache = report_cache
+
+    async def _report_changed(self, report_id):
+        """Function to invalidate any cached data for a report after its data has been changed."""
+        if self.report_cache is not None:
+            await self.report_cache.bump(report_id)
+
+    async def save_reg_techniques(self, report_id, sentence, sentence_index, tech_start_date=None, sql_list=None):
+        # Add the statements to a given SQL list (to run with others in one transaction) else run them here
+        run_sql = sql_list is None
+        sql_list = [] if run_sql else sql_list
+        sentence_id, sentence_sql = await self.dao.insert_with_backup_sql(
             "report_sentences",
             dict(
                 report_uid=report_id,
                 text=sentence["text"],
                 html=sentence["html"],
                 sen_index=sentence_index,
+                elem_index=sentence.get("elem_index"),
                 found_status=self.dao.db_true_val,
             ),
         )
+        sql_list.extend(sentence_sql)
         for technique in sentence["reg_techniques_found"]:
             attack_uid = await self.dao.get("attack_uids", dict(name=technique))
             if not attack_uid:
@@ -37,19 +48,28 @@ class ReportRepository:
             )
             if tech_start_date:
                 data.update(dict(start_date=tech_start_date))
-            await self.dao.insert_with_backup("report_sentence_hits", data)
+            _, hit_sql = await self.dao.insert_with_backup_sql("report_sentence_hits", data)
+            sql_list.extend(hit_sql)
+
+        if run_sql:
+            await self.dao.run_sql_list(sql_list=sql_list)
 
-    async def save_ml_techniques(self, report_id, sentence, sentence_index, tech_start_date=None):
-        sentence_id = await self.dao.insert_with_backup(
+    async def save_ml_techniques(self, report_id, sentence, sentence_index, tech_start_date=None, sql_list=None):
+        # Add the statements to a given SQL list (to run with others in one transaction) else run them here
+        run_sql = sql_list is None
+        sql_list = [] if run_sql else sql_list
+        sentence_id, sentence_sql = await self.dao.insert_with_backup_sql(
             "report_sentences",
             dict(
                 report_uid=report_id,
                 text=sentence["text"],
                 html=sentence["html"],
                 sen_index=sentence_index,
+                elem_index=sentence.get("elem_index"),
                 found_status=self.dao.db_true_val,
             ),
         )
+        sql_list.extend(sentence_sql)
 
         saved_tids = set()
         for technique_tid, technique_name in sentence["ml_techniques_found"]:
@@ -104,9 +124,13 @@ class ReportRepository:
             if tech_start_date:
                 data.update(dict(start_date=tech_start_date))
 
-            await self.dao.insert_with_backup("report_sentence_hits", data)
+            _, hit_sql = await self.dao.insert_with_backup_sql("report_sentence_hits", data)
+            sql_list.extend(hit_sql)
             saved_tids.add(attack_tid)
 
+        if run_sql:
+            await self.dao.run_sql_list(sql_list=sql_list)
+
     async def set_report_categories(self, report_id, to_add, to_delete):
         """Executes the database operations to set the categories of a report."""
         sql_list = []
@@ -126,6 +150,7 @@ class ReportRepository:
             )
 
         await self.dao.run_sql_list(sql_list=sql_list)
+        await self._report_changed(report_id)
         return bool(sql_list)
 
     async def set_report_keywords(self, report_id, to_compare, to_process):
@@ -197,6 +222,7 @@ class ReportRepository:
                         sql_list.append(await self.dao.delete(table_name, temp, return_sql=True))
 
         await self.dao.run_sql_list(sql_list=sql_list)
+        await self._report_changed(report_id)
         return bool(sql_list)
 
     async def get_report_dates_out_of_range(self, report_id, start_date, end_date):
@@ -257,3 +283,4 @@ class ReportRepository:
                 )
 
         await self.dao.run_sql_list(sql_list=sql_list)
+        await self._report_changed(report_id)
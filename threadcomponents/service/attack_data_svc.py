@@ -1,21 +1,44 @@
+import hashlib
 import json
 import logging
 import os
+import pickle
 import re
 import requests
+import sys
+import tempfile
 
-from stix2 import Filter, MemoryStore
+from collections import defaultdict
+from datetime import datetime, timezone
+from threadcomponents.helpers.attack_stix_cache import AttackStixCache, compute_delta, index_stix_object
+from threadcomponents.helpers.stix_stream import iter_stix_bundle_objects
 
 NO_DESC = "No description provided"
-
-
-def fetch_attack_stix_data_json():
-    """Function to fetch the latest Att%ck data."""
-    url = (
-        "https://raw.githubusercontent.com/mitre-attack/attack-stix-data/master/enterprise-attack/"
-        "enterprise-attack.json"
-    )
-    return requests.get(url).json()
+ATTACK_STIX_DATA_URL = (
+    "https://raw.githubusercontent.com/mitre-attack/attack-stix-data/master/enterprise-attack/enterprise-attack.json"
+)
+# regex to get rid of att&ck reference (name)[link to site] (compiled once as compile can be expensive)
+LINK_PATTERN = re.compile(r"\[.*?\]\(.*?\)")
+CITATION_PATTERN = re.compile(r"\(Citation: .*?\)")
+# The suffix of the precompiled copy of an attack dictionary (kept alongside it)
+SNAPSHOT_SUFFIX = ".snapshot.p"
+# The suffix of the log of changes made to an attack dictionary (kept alongside it)
+CHANGELOG_SUFFIX = ".changelog.jsonl"
+# Changing how snapshots are made should change this version so older snapshots are not used
+SNAPSHOT_VERSION = 1
+
+
+def fetch_attack_stix_data_objects():
+    """Function to fetch the latest Att%ck data, yielding each STIX object as it is read."""
+    # Download to a temporary file rather than memory; the bundle is then read one object at a time
+    with tempfile.TemporaryFile() as stix_file:
+        with requests.get(ATTACK_STIX_DATA_URL, stream=True) as response:
+            response.raise_for_status()
+            for chunk in response.iter_content(chunk_size=1 << 16):
+                stix_file.write(chunk)
+
+        stix_file.seek(0)
+        yield from iter_stix_bundle_objects(stix_file)
 
 
 def attack_data_reject(attack_data):
@@ -43,206 +66,368 @@ def attack_data_get_tid(attack_data):
     return tid or data_id
 
 
+def clean_example_use(description):
+    """Function to tidy up the description of a relationship to be used as an example use."""
+    # remove unnecessary strings, fix unicode errors
+    example_use = (
+        description.replace("<code>", "")
+        .replace("</code>", "")
+        .replace('"', "")
+        .replace(",", "")
+        .replace("\t", "")
+        .replace("  ", " ")
+        .replace("\n", "")
+        .encode("ascii", "ignore")
+        .decode("ascii")
+    )
+    example_use = LINK_PATTERN.sub("", example_use)  # replace all instances of links with nothing
+    example_use = CITATION_PATTERN.sub("", example_use)  # replace all instances of links with nothing
+    if example_use[0:2] == "'s":  # remove any leading 's
+        example_use = example_use[3:]
+
+    return example_use.strip()  # strip any leading/trailing whitespace
+
+
+def flatten_software(software):
+    """Function to flatten a single malware or tool."""
+    return {
+        "tid": attack_data_get_tid(software),
+        "name": software["name"],
+        "description": software.get("description", NO_DESC),
+        "examples": [],
+        "example_uses": [],
+        "similar_words": [software["name"]],
+    }
+
+
+def merge_unique(current, new_items):
+    """Function to append the items not already in a list to it; returns the appended items."""
+    seen = set(current)
+    added = []
+    for item in new_items:
+        if item not in seen:
+            seen.add(item)
+            added.append(item)
+    current.extend(added)
+    return added
+
+
+def intern_attack_dict(attack_dict):
+    """Function to intern the repeated strings of an attack dictionary (so they are stored and loaded once)."""
+    for attack_uid, entry in list(attack_dict.items()):
+        for key in ["id", "name"]:
+            if isinstance(entry.get(key), str):
+                entry[key] = sys.intern(entry[key])
+        entry["similar_words"] = [sys.intern(word) for word in entry.get("similar_words", [])]
+        attack_dict[sys.intern(attack_uid)] = attack_dict.pop(attack_uid)
+    return attack_dict
+
+
 class AttackDataService:
     def __init__(self, dir_prefix="", attack_file_settings=None):
-        self.json_tech = {}
-        self.list_of_legacy = []
-        self.list_of_techs = []
+        # The attack data is loaded on first use (see the json_tech property)
+        self._json_tech = None
+        self._list_of_legacy = []
+        self._list_of_techs = []
 
         attack_file_settings = attack_file_settings or dict()
         default_attack_filepath = os.path.join(dir_prefix, "threadcomponents", "models", "attack_dict.json")
         self.attack_dict_loc = attack_file_settings.get("filepath", default_attack_filepath)
         self.update_attack_file = attack_file_settings.get("update", False)  # Are we updating this file periodically?
         self.attack_file_indent = attack_file_settings.get("indent", 2)
-        self.set_internal_attack_data()
+        # Where to keep the last-applied STIX bundle so only changes are applied (no directory = always apply all data)
+        stix_cache_dir = attack_file_settings.get("stix_cache_dir")
+        self.stix_cache = AttackStixCache(stix_cache_dir) if stix_cache_dir else None
+
+    @property
+    def json_tech(self):
+        """The attack dictionary (loaded on first access)."""
+        if self._json_tech is None:
+            self.set_internal_attack_data()
+        return self._json_tech
+
+    @json_tech.setter
+    def json_tech(self, value):
+        self._json_tech = value
+
+    @property
+    def list_of_legacy(self):
+        """The IDs of attacks with too few examples for a model (loaded on first access)."""
+        if self._json_tech is None:
+            self.set_internal_attack_data()
+        return self._list_of_legacy
+
+    @property
+    def list_of_techs(self):
+        """The (ID, name) of attacks with a model (loaded on first access)."""
+        if self._json_tech is None:
+            self.set_internal_attack_data()
+        return self._list_of_techs
+
+    @list_of_techs.setter
+    def list_of_techs(self, value):
+        self._list_of_techs = value
+
+    @property
+    def snapshot_loc(self):
+        """The location of the precompiled copy of the attack dictionary."""
+        return self.attack_dict_loc + SNAPSHOT_SUFFIX
 
     def set_internal_attack_data(self, load_attack_dict=True):
         """Function to set the class variables holding attack data."""
         if load_attack_dict:
-            with open(self.attack_dict_loc, "r", encoding="utf_8") as attack_dict_f:
-                self.json_tech = json.load(attack_dict_f)
-
-        self.list_of_legacy, self.list_of_techs = self.ml_and_reg_split(self.json_tech)
+            with open(self.attack_dict_loc, "rb") as attack_dict_f:
+                attack_dict_bytes = attack_dict_f.read()
+            checksum = hashlib.sha256(attack_dict_bytes).hexdigest()
+            snapshot = self.load_snapshot(checksum)
+            if snapshot:
+                self._json_tech, self._list_of_legacy, self._list_of_techs = snapshot
+                return
+
+            self._json_tech = intern_attack_dict(json.loads(attack_dict_bytes.decode("utf_8")))
+            self._list_of_legacy, self._list_of_techs = self.ml_and_reg_split(self._json_tech)
+            self.save_snapshot(checksum)
+            return
+
+        self._list_of_legacy, self._list_of_techs = self.ml_and_reg_split(self._json_tech)
+
+    def load_snapshot(self, checksum):
+        """Function to return the attack data from the snapshot if it was made from the current attack dictionary."""
+        try:
+            with open(self.snapshot_loc, "rb") as snapshot_file:
+                version, snapshot_checksum, snapshot = pickle.load(snapshot_file)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logging.warning(f"Could not load attack dictionary snapshot: {e}")
+            return None
+        if (version, snapshot_checksum) != (SNAPSHOT_VERSION, checksum):
+            return None
+        return snapshot
+
+    def save_snapshot(self, checksum):
+        """Function to save the current attack data as the snapshot of the attack dictionary with the given checksum."""
+        snapshot = (self._json_tech, self._list_of_legacy, self._list_of_techs)
+        temp_loc = self.snapshot_loc + ".tmp"
+        try:
+            with open(temp_loc, "wb") as snapshot_file:
+                pickle.dump((SNAPSHOT_VERSION, checksum, snapshot), snapshot_file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_loc, self.snapshot_loc)
+        except OSError as e:
+            logging.warning(f"Could not save attack dictionary snapshot: {e}")
 
     def fetch_flattened_attack_data(self):
         """
         Function to retrieve ATT&CK data and insert it into the DB.
         Further reading on approach: https://github.com/arachne-threat-intel/thread/pull/27#issuecomment-1047456689
         """
-        stix_memory_store = self.fetch_attack_stix_data()
-        return self.flatten_attack_stix_data(stix_memory_store)
+        logging.info("Downloading ATT&CK data from GitHub repo `mitre-attack/attack-stix-data`")
+        return self.flatten_attack_stix_data(fetch_attack_stix_data_objects())
 
-    @staticmethod
-    def fetch_attack_stix_data():
+    def fetch_attack_data_delta(self, full_update=False):
         """
-        Function to retrieve ATT&CK data and load it into a Stix memory store
+        Function to retrieve ATT&CK data, comparing it with the last-applied data (if a cache directory was configured).
+        :param full_update: Whether all attack data should be returned regardless of what has changed
+        :return: the flattened attack data to apply and the delta (None if there is nothing to compare with)
         """
-        logging.info("Downloading ATT&CK data from GitHub repo `mitre-attack/attack-stix-data`")
-        stix_json = fetch_attack_stix_data_json()
-        return MemoryStore(stix_data=stix_json["objects"])
+        if not self.stix_cache:
+            return self.fetch_flattened_attack_data(), None
+
+        logging.info("Checking for ATT&CK data changes from GitHub repo `mitre-attack/attack-stix-data`")
+        manifest = self.stix_cache.load_manifest()
+        sha256, etag = self.stix_cache.fetch(ATTACK_STIX_DATA_URL, manifest)
+        full_update = full_update or not manifest["objects"]
+        if (sha256 == manifest["sha256"]) and not full_update:
+            logging.info("ATT&CK data is unchanged since it was last applied")
+            delta = compute_delta(dict(), dict())
+            delta.update(full=False, inactive=set(), sha256=sha256, etag=etag, objects=manifest["objects"])
+            return dict(), delta
+
+        # Record each object's modified-timestamp whilst flattening (so the bundle is only read once)
+        objects = dict()
+
+        def index_objects(stix_objects):
+            for stix_object in stix_objects:
+                entry = index_stix_object(stix_object, attack_data_reject)
+                if entry:
+                    objects[stix_object["id"]] = entry
+                yield stix_object
+
+        attack_data = self.flatten_attack_stix_data(index_objects(self.stix_cache.iter_objects(sha256)))
+        delta = compute_delta(manifest["objects"], objects)
+        delta.update(full=full_update, inactive=set(), sha256=sha256, etag=etag, objects=objects)
+        logging.info(
+            f"ATT&CK data: {len(delta['added'])} added, {len(delta['changed'])} changed, "
+            f"{len(delta['revoked'])} revoked and {len(delta['removed'])} removed objects"
+        )
+        if full_update:
+            return attack_data, delta
+
+        # Only apply the attacks affected by the changes; affected attacks no longer in our data are now inactive
+        delta["inactive"] = {uid for uid in delta["affected"] if uid not in attack_data}
+        return {uid: item for uid, item in attack_data.items() if uid in delta["affected"]}, delta
+
+    def save_attack_data_delta(self, delta):
+        """Function to record the data of a delta as applied, so the next update is compared with it."""
+        if self.stix_cache and delta:
+            self.stix_cache.save_manifest(delta["sha256"], delta["etag"], delta["objects"])
 
     @staticmethod
-    def flatten_attack_stix_data(stix_memory_store):
+    def flatten_attack_stix_data(stix_objects):
         """
-        Function that takes a Stix Memory store and flattens the data into something that we work with
+        Function that takes an iterable of Stix objects and flattens the data into something that we work with
         """
         logging.info("Flattening stix data into attack data")
-        attack_data = {}
-
-        # Techniques / attack-patterns #
-        # add all the patterns and dictionary keys/values for each technique and software
-        techniques = stix_memory_store.query(Filter("type", "=", "attack-pattern"))
-        for technique in techniques:
-            if attack_data_reject(technique):
-                continue
-
-            attack_data[technique["id"]] = {
-                "name": technique["name"],
-                "tid": attack_data_get_tid(technique),
-                "example_uses": [],
-                "description": technique.get("description", NO_DESC)
-                .replace("<code>", "")
-                .replace("</code>", "")
-                .replace("\n", "")
-                .encode("ascii", "ignore")
-                .decode("ascii"),
-                "similar_words": [technique["name"]],
-            }
-
-        # Relationships #
-        relationships = stix_memory_store.query(Filter("type", "=", "relationship"))
-        # regex to get rid of att&ck reference (name)[link to site] (done once outside loop as compile can be expensive)
-        link_pattern = re.compile(r"\[.*?\]\(.*?\)")
-        citation_pattern = re.compile(r"\(Citation: .*?\)")
-        for relationship in relationships:
-            if attack_data_reject(relationship):
-                continue
-
-            if relationship["relationship_type"] != "uses":
-                continue
-
-            # Continue if it isn't a attack-pattern relationship OR the target ref isn't in our attack_data
-            target_ref = relationship["target_ref"]
-            if ("attack-pattern" not in target_ref) or (target_ref not in attack_data):
-                continue
-
-            # remove unnecessary strings, fix unicode errors
-            example_use = (
-                relationship.get("description", NO_DESC)
-                .replace("<code>", "")
-                .replace("</code>", "")
-                .replace('"', "")
-                .replace(",", "")
-                .replace("\t", "")
-                .replace("  ", " ")
-                .replace("\n", "")
-                .encode("ascii", "ignore")
-                .decode("ascii")
-            )
-            example_use = link_pattern.sub("", example_use)  # replace all instances of links with nothing
-            example_use = citation_pattern.sub("", example_use)  # replace all instances of links with nothing
-            if example_use[0:2] == "'s":  # remove any leading 's
-                example_use = example_use[3:]
-
-            example_use = example_use.strip()  # strip any leading/trailing whitespace
-
-            if len(example_use) > 0:  # if the example_use is not empty, add it to the attack_data
-                attack_data[target_ref]["example_uses"].append(example_use)
-
-        # Malware #
-        all_malware = stix_memory_store.query(Filter("type", "=", "malware"))
-        for malware in all_malware:
-            # TODO check if we should be skipping those without a description?
-            # some software do not have description, example: darkmoon https://attack.mitre.org/software/S0209
-            if ("description" not in malware) or attack_data_reject(malware):
-                continue
-
-            attack_data[malware["id"]] = {
-                "tid": attack_data_get_tid(malware),
-                "name": malware["name"],
-                "description": malware.get("description", NO_DESC),
-                "examples": [],
-                "example_uses": [],
-                "similar_words": [malware["name"]],
-            }
-
-        # Tools #
-        tools = stix_memory_store.query(Filter("type", "=", "tool"))
-        for tool in tools:
-            if attack_data_reject(tool):
-                continue
-
-            attack_data[tool["id"]] = {
-                "tid": attack_data_get_tid(tool),
-                "name": tool["name"],
-                "description": tool.get("description", NO_DESC),
-                "examples": [],
-                "example_uses": [],
-                "similar_words": [tool["name"]],
-            }
-
+        # The objects are only iterated over once so keep each type of data separately until the end
+        techniques, all_malware, tools = dict(), dict(), dict()
+        # Example uses of attack-patterns (a relationship can appear before the attack-pattern it targets)
+        example_uses = defaultdict(list)
+
+        for stix_object in stix_objects:
+            object_type = stix_object.get("type")
+
+            # Techniques / attack-patterns #
+            # add all the patterns and dictionary keys/values for each technique and software
+            if object_type == "attack-pattern":
+                if attack_data_reject(stix_object):
+                    continue
+
+                techniques[stix_object["id"]] = {
+                    "name": stix_object["name"],
+                    "tid": attack_data_get_tid(stix_object),
+                    "example_uses": [],
+                    "description": stix_object.get("description", NO_DESC)
+                    .replace("<code>", "")
+                    .replace("</code>", "")
+                    .replace("\n", "")
+                    .encode("ascii", "ignore")
+                    .decode("ascii"),
+                    "similar_words": [stix_object["name"]],
+                }
+
+            # Relationships #
+            elif object_type == "relationship":
+                if attack_data_reject(stix_object) or (stix_object["relationship_type"] != "uses"):
+                    continue
+
+                # Continue if it isn't a attack-pattern relationship
+                target_ref = stix_object["target_ref"]
+                if "attack-pattern" not in target_ref:
+                    continue
+
+                example_use = clean_example_use(stix_object.get("description", NO_DESC))
+                if len(example_use) > 0:  # if the example_use is not empty, keep it for its attack-pattern
+                    example_uses[target_ref].append(example_use)
+
+            # Malware #
+            elif object_type == "malware":
+                # TODO check if we should be skipping those without a description?
+                # some software do not have description, example: darkmoon https://attack.mitre.org/software/S0209
+                if ("description" not in stix_object) or attack_data_reject(stix_object):
+                    continue
+
+                all_malware[stix_object["id"]] = flatten_software(stix_object)
+
+            # Tools #
+            elif object_type == "tool":
+                if attack_data_reject(stix_object):
+                    continue
+
+                tools[stix_object["id"]] = flatten_software(stix_object)
+
+        # Add the example uses to their attack-patterns (if the attack-pattern is in our attack data)
+        for target_ref, uses in example_uses.items():
+            if target_ref in techniques:
+                techniques[target_ref]["example_uses"].extend(uses)
+
+        attack_data = techniques
+        attack_data.update(all_malware)
+        attack_data.update(tools)
         return attack_data
 
     def update_json_tech_with_flattened_attack_data(self, attack_data):
         """Function to update the attack dictionary file."""
         # Loop the attack data and check if any attacks have been added or renamed or changed in anyway
-        added_count, updated_count = 0, 0
+        changes = []
         for attack_uid, attack_item in attack_data.items():
             # If the attack is not in the json-tech dictionary, add it
             if attack_uid not in self.json_tech:
-                added_count += 1
                 self.json_tech[attack_uid] = attack_item
                 self.json_tech[attack_uid]["id"] = self.json_tech[attack_uid].pop("tid")
+                changes.append(dict(uid=attack_uid, change="added", name=attack_item["name"]))
 
                 logging.info(
                     f"New attack found, consider adding example uses for {attack_uid} to {self.attack_dict_loc} and make sure you update the attack JSON file."
                 )
             else:
-                # print('We have an existing attack: %s' % attack_uid)
-                updated = False
                 current_entry = self.json_tech.get(attack_uid)
                 if current_entry["id"] != attack_item["tid"]:
                     print("ID MISMATCH: This should not happen, skipping", attack_uid)
 
-                # Check description change
-                if current_entry["description"] != attack_item["description"]:
-                    updated = True
-                    current_entry["description"] = attack_item["description"]
-
-                # Check for new example uses
-                for example_use in attack_item["example_uses"]:
-                    if example_use not in current_entry["example_uses"]:
-                        updated = True
-                        current_entry["example_uses"].append(example_use)
-
-                # Check similar words
-                for similar_word in attack_item["similar_words"]:
-                    if similar_word not in current_entry["similar_words"]:
-                        updated = True
-                        current_entry["similar_words"].append(similar_word)
-
-                # Check for name change
-                if current_entry["name"] != attack_item["name"]:
-                    updated = True
-                    for name in [current_entry["name"], attack_item["name"]]:
-                        if name not in current_entry["similar_words"]:
-                            current_entry["similar_words"].append(name)
-
-                    current_entry["name"] = attack_item["name"]
-
-                if updated:
-                    updated_count += 1
+                change = self.merge_attack_entry(current_entry, attack_item)
+                if change:
+                    changes.append(dict(uid=attack_uid, change="updated", **change))
 
+        added_count = sum(1 for change in changes if change["change"] == "added")
         logging.info(
-            f"Added {added_count} new attacks and updated {updated_count} existing attacks to in memory attack dictionary"
+            f"Added {added_count} new attacks and updated {len(changes) - added_count} existing attacks to in memory "
+            "attack dictionary"
         )
 
         self.set_internal_attack_data(load_attack_dict=False)
 
-        if self.update_attack_file:
+        if self.update_attack_file and changes:
             logging.info(f"Writing updated attack dictionary to {self.attack_dict_loc}")
-            with open(self.attack_dict_loc, "w", encoding="utf-8") as json_file_opened:
-                json.dump(self.json_tech, json_file_opened, ensure_ascii=False, indent=self.attack_file_indent)
+            attack_dict_json = json.dumps(self.json_tech, ensure_ascii=False, indent=self.attack_file_indent)
+            # Write to a temporary file first so the attack dictionary is never left half-written
+            temp_loc = self.attack_dict_loc + ".tmp"
+            with open(temp_loc, "w", encoding="utf-8") as json_file_opened:
+                json_file_opened.write(attack_dict_json)
+            os.replace(temp_loc, self.attack_dict_loc)
+            self.append_to_changelog(changes)
+            # Keep the snapshot in step with the file so the next startup doesn't need to parse it
+            self.save_snapshot(hashlib.sha256(attack_dict_json.encode("utf-8")).hexdigest())
+
+    @staticmethod
+    def merge_attack_entry(current_entry, attack_item):
+        """Function to merge retrieved attack data into an attack-dictionary entry; returns what changed."""
+        change = dict()
+        # Check description change
+        if current_entry["description"] != attack_item["description"]:
+            current_entry["description"] = attack_item["description"]
+            change["description"] = True
+
+        # Check for new example uses and similar words (looking up what the entry has in sets, not its lists)
+        example_uses = merge_unique(current_entry["example_uses"], attack_item["example_uses"])
+        if example_uses:
+            change["example_uses"] = example_uses
+        new_words = list(attack_item["similar_words"])
+
+        # Check for name change
+        if current_entry["name"] != attack_item["name"]:
+            change["name"] = [current_entry["name"], attack_item["name"]]
+            new_words.extend(change["name"])
+            current_entry["name"] = attack_item["name"]
+
+        similar_words = merge_unique(current_entry["similar_words"], new_words)
+        if similar_words:
+            change["similar_words"] = similar_words
+        return change
+
+    @property
+    def changelog_loc(self):
+        """The location of the log of changes made to the attack dictionary file."""
+        return self.attack_dict_loc + CHANGELOG_SUFFIX
+
+    def append_to_changelog(self, changes):
+        """Function to append changes made to the attack dictionary file to its changelog (one JSON line each)."""
+        timestamp = datetime.now(timezone.utc).isoformat(timespec="seconds")
+        try:
+            with open(self.changelog_loc, "a", encoding="utf-8") as changelog:
+                for change in changes:
+                    changelog.write(json.dumps(dict(time=timestamp, **change), ensure_ascii=False) + "\n")
+        except OSError as e:
+            logging.warning(f"Could not update attack dictionary changelog: {e}")
 
     @staticmethod
     def ml_and_reg_split(techniques):
@@ -2,21 +2,40 @@
 # This file has been moved into a different directory
 # To see its full history, please use `git log --follow <filename>` to view previous commits and additional contributors
 
+import hashlib
 import os
 import re
 import json
 import logging
+import uuid
 
+from collections import defaultdict
 from contextlib import suppress
 from copy import deepcopy
-from datetime import datetime
+from datetime import datetime, timedelta
 from threadcomponents.constants import TTP, IOC
+from threadcomponents.database.thread_db import EXECUTE_MANY
+from threadcomponents.enums import ReportStatus
+from threadcomponents.reports.report_cache import DEFAULT_CACHE_SIZE, ReportCache
 from urllib.parse import quote
 
 # Text to set on attack descriptions where this originally was not set
 NO_DESC = "No description provided"
 # A name for a temporary table representing the output of SQL_PAR_ATTACK
 FULL_ATTACK_INFO = "full_attack_info"
+# The thread_metadata keys for the fingerprints of what the database was built from
+SCHEMA_FINGERPRINT = "schema_fingerprint"
+ATTACK_JSON_FINGERPRINT = "attack_json_fingerprint"
+CATEGORIES_FINGERPRINT = "categories_fingerprint"
+KEYWORDS_FINGERPRINT = "keywords_fingerprint"
+# The attack data saved alongside a new attack: (key in the attack data, db table, db column)
+RELATED_ATTACK_DATA = [
+    ("regex_patterns", "regex_patterns", "regex_pattern"),
+    ("similar_words", "similar_words", "similar_word"),
+    ("false_negatives", "false_negatives", "false_negative"),
+    ("false_positives", "false_positives", "false_positive"),
+    ("example_uses", "true_positives", "true_positive"),
+]
 
 
 def defang_text(text):
@@ -30,11 +49,21 @@ def defang_text(text):
     return text
 
 
+def get_fingerprint(*data):
+    """Function to return a checksum of some data (str or bytes values) to detect if it changes."""
+    checksum = hashlib.sha256()
+    for value in data:
+        checksum.update(value.encode("utf-8") if isinstance(value, str) else value)
+    return checksum.hexdigest()
+
+
 class DataService:
-    def __init__(self, dao, web_svc, dir_prefix=""):
+    def __init__(self, dao, web_svc, dir_prefix="", report_cache_size=DEFAULT_CACHE_SIZE):
         self.dao = dao
         self.web_svc = web_svc
         self.dir_prefix = dir_prefix
+        # Cached report data: anything writing to a report's data should bump its version in this cache
+        self.report_cache = ReportCache(dao, max_reports=report_cache_size)
         self.region_dict = {}
         self.country_dict = {}
         self.country_region_dict = {}
@@ -79,111 +108,151 @@ class DataService:
         self.SQL_PAR_ATTACK_INC_INACTIVE = sql_par_attack_base.format(inactive_AND="", inactive_WHERE="")
         self.SQL_WITH_PAR_ATTACK_INC_INACTIVE = with_par_attack % self.SQL_PAR_ATTACK_INC_INACTIVE
 
-    async def reload_database(self, schema_file=os.path.join("threadcomponents", "conf", "schema.sql")):
+    async def reload_database(self, schema_file=os.path.join("threadcomponents", "conf", "schema.sql"), force=False):
         """
         Function to reinitialize the database with the packaged schema
         :param schema_file: SQL schema file to build database from
-        :return: nil
+        :param force: Whether to build the database even if the schema is unchanged since the last build
+        :return: whether the database was built
         """
         # Begin by obtaining the text from the schema file
         schema_file = os.path.join(self.dir_prefix, schema_file)  # prefix directory path if there is one
         with open(schema_file) as schema_opened:
             schema = schema_opened.read()
+        fingerprint = get_fingerprint(schema)
+        if (not force) and (await self.get_metadata(SCHEMA_FINGERPRINT) == fingerprint):
+            logging.info("Database schema unchanged since last build: skipping database build")
+            return False
         # Given the schema, generate a new schema for tables that need to have a copied structure
         copied_tables_schema = self.dao.generate_copied_tables(schema=schema)
-        # Proceed to build both schemas
+        # Proceed to build both schemas (which adds new tables and columns; existing data is not changed)
         await self.dao.build(schema)
         await self.dao.build(copied_tables_schema, is_partial=True)
+        await self.set_metadata(SCHEMA_FINGERPRINT, fingerprint)
+        return True
+
+    async def get_metadata(self, keyname):
+        """Function to return a value from the metadata table (None if not set or the table doesn't exist yet)."""
+        try:
+            stored = await self.dao.get("thread_metadata", dict(keyname=keyname))
+        except Exception:
+            return None
+        return stored[0]["value"] if stored else None
+
+    async def set_metadata(self, keyname, value):
+        """Function to set a value in the metadata table."""
+        sql_list = [
+            await self.dao.delete("thread_metadata", dict(keyname=keyname), return_sql=True),
+            await self.dao.insert("thread_metadata", dict(keyname=keyname, value=value), return_sql=True),
+        ]
+        await self.dao.run_sql_list(sql_list=sql_list)
+
+    async def get_changed_fingerprint(self, keyname, *data):
+        """Function to return the fingerprint of some data if it differs from the stored one (else None)."""
+        fingerprint = get_fingerprint(*data)
+        if await self.get_metadata(keyname) == fingerprint:
+            return None
+        return fingerprint
+
+    async def has_attack_data(self):
+        """Function to return whether any attacks have been saved to the database."""
+        return bool(await self.dao.raw_select("SELECT uid FROM attack_uids LIMIT 1"))
 
-    async def update_db_with_flattened_attack_data(self, attack_data):
+    async def update_db_with_flattened_attack_data(self, attack_data, inactive_uids=None):
         """
         Function to take attack_data and update the database
+        :param inactive_uids: If attack_data is not all attack data, the attacks which are now inactive
         """
         logging.info("Saving attack data to database")
 
         cur_attacks = await self.dao.get_dict_value_as_key("uid", table="attack_uids", columns=["name", "inactive"])
         cur_uids = set(cur_attacks.keys())
         retrieved_uids = set(attack_data.keys())
-        name_changes = []
 
+        # Work out all changes before applying them together
+        new_attacks, related_rows = [], defaultdict(list)
+        name_changes, reactivated = [], []
         for attack_uid, attack_item in attack_data.items():
-            # If this loop takes long, the below logging-statement will help track progress
-            # logging.info(f'Processing attack {list(attack_data.keys()).index(k) + 1} of {len(attack_data)}.')
             if attack_uid not in cur_uids:
-                await self.dao.insert(
-                    "attack_uids", dict(uid=attack_uid, tid=attack_item["tid"], name=attack_item["name"])
-                )
-                await self.add_related_attack_data(attack_uid, attack_item, "regex_patterns", "regex_pattern")
-                await self.add_related_attack_data(attack_uid, attack_item, "similar_words", "similar_word")
-                await self.add_related_attack_data(attack_uid, attack_item, "false_negatives", "false_negative")
-                await self.add_related_attack_data(attack_uid, attack_item, "false_positives", "false_positive")
-                await self.add_related_attack_data(attack_uid, attack_item, "false_positives", "true_positive")
-                await self.add_related_attack_data(
-                    attack_uid, attack_item, "example_uses", "true_positive", "true_positives"
-                )
+                new_attacks.append((attack_uid, attack_item["tid"], attack_item["name"]))
+                for related_data_type, db_table_name, db_column_name in RELATED_ATTACK_DATA:
+                    for value in attack_item.get(related_data_type, []):
+                        related_rows[(db_table_name, db_column_name)].append(
+                            (str(uuid.uuid4()), attack_uid, defang_text(value))
+                        )
             else:
                 # If the attack is already in the DB, check the name hasn't changed; update if so
-                retrieved_name = (attack_data.get(attack_uid, dict())).get("name")
+                retrieved_name = attack_item.get("name")
                 current_attack_data = cur_attacks.get(attack_uid, dict())
                 current_name = current_attack_data.get("name")
-
                 if retrieved_name and (retrieved_name != current_name):
-                    await self.dao.update("attack_uids", where=dict(uid=attack_uid), data=dict(name=retrieved_name))
-                    await self.dao.update(
-                        "report_sentence_hits",
-                        where=dict(attack_uid=attack_uid),
-                        data=dict(attack_technique_name=retrieved_name),
-                    )
-                    await self.web_svc.on_attack_name_change(attack_uid, retrieved_name)
                     name_changes.append((attack_uid, retrieved_name, current_name))
 
-                    # Update the similar-words table if we're updating the attack-entry
-                    for name in [retrieved_name, current_name]:
-                        if name:  # proceed if there is a value
-                            # Check an attack doesn't already have a similar-word with this name
-                            db_criteria = dict(attack_uid=attack_uid, similar_word=name)
-                            stored = await self.dao.get("similar_words", equal=db_criteria)
-                            # If not, update the attack's similar-words to include this name
-                            if not stored:
-                                await self.dao.insert_generate_uid("similar_words", db_criteria)
-
                 # Confirm this attack is considered active
                 if current_attack_data.get("inactive"):
-                    await self.dao.update(
-                        "attack_uids", where=dict(uid=attack_uid), data=dict(inactive=self.dao.db_false_val)
-                    )
+                    reactivated.append(attack_uid)
 
         # Inactive attack IDs have been calculated by using what is in the database currently
         # Update the database entries to be inactive if not already flagged as such
-        already_inactive = await self.dao.raw_select(
-            f"SELECT uid FROM attack_uids WHERE inactive = {self.dao.db_true_val}", single_col=True
+        if inactive_uids is None:
+            inactive_uids = cur_uids - retrieved_uids
+        inactive_attacks = {uid for uid in inactive_uids if uid in cur_uids and not cur_attacks[uid].get("inactive")}
+
+        sql_list = [self.dao.insert_many_sql("attack_uids", ["uid", "tid", "name"], new_attacks)]
+        for (db_table_name, db_column_name), rows in related_rows.items():
+            sql_list.append(self.dao.insert_many_sql(db_table_name, ["uid", "attack_uid", db_column_name], rows))
+        if name_changes:
+            renamed = [(new_name, attack_uid) for attack_uid, new_name, _ in name_changes]
+            qparam = self.dao.db_qparam
+            sql_list.append((f"UPDATE attack_uids SET name = {qparam} WHERE uid = {qparam}", renamed, EXECUTE_MANY))
+            sql_list.append(
+                (
+                    f"UPDATE report_sentence_hits SET attack_technique_name = {qparam} WHERE attack_uid = {qparam}",
+                    renamed,
+                    EXECUTE_MANY,
+                )
+            )
+            similar_words = await self._get_similar_words_for_name_changes(name_changes)
+            sql_list.append(
+                self.dao.insert_many_sql("similar_words", ["uid", "attack_uid", "similar_word"], similar_words)
+            )
+        sql_list.extend(self.dao.update_in_sql("attack_uids", dict(inactive=self.dao.db_false_val), "uid", reactivated))
+        sql_list.extend(
+            self.dao.update_in_sql("attack_uids", dict(inactive=self.dao.db_true_val), "uid", inactive_attacks)
+        )
+        if not await self.dao.run_sql_list(sql_list=sql_list):
+            raise RuntimeError("Attack data could not be saved to the database.")
+        logging.info(
+            f"Added {len(new_attacks)} attacks; renamed {len(name_changes)}; reactivated {len(reactivated)}; "
+            f"marked {len(inactive_attacks)} as inactive"
         )
 
-        inactive_attacks = (cur_uids - retrieved_uids) - set(already_inactive)
-        # TODO: Could just do a mass update like `UPDATE attack_uids SET inactive = true WHERE uid IN (blah, blah, blah, blah)`
-        for inactive_id in inactive_attacks:
-            await self.dao.update("attack_uids", where=dict(uid=inactive_id), data=dict(inactive=self.dao.db_true_val))
+        for attack_uid, retrieved_name, _ in name_changes:
+            await self.web_svc.on_attack_name_change(attack_uid, retrieved_name)
+        # Attack names and statuses are part of cached report data
+        if name_changes or inactive_attacks:
+            await self.report_cache.clear()
 
         db_items = await self.dao.get("attack_uids")
         db_item_count = len(db_items)
         logging.info(f"[!] DB Item Count: {db_item_count}")
 
-    async def add_related_attack_data(
-        self, attack_uid, attack_item, related_data_type, db_column_name, db_table_name=None
-    ):
-        """
-        Function to add related data to an attack_uid
-        :param db_table_name: The name of the table to insert the data into, if it isn't provided, it will be the same as the related_data_type
-        """
-        if related_data_type not in attack_item:
-            return
-
-        if db_table_name is None:
-            db_table_name = related_data_type
-
-        for x in attack_item[related_data_type]:
-            data = {"attack_uid": attack_uid, db_column_name: defang_text(x)}
-            await self.dao.insert_generate_uid(db_table_name, data)
+    async def _get_similar_words_for_name_changes(self, name_changes):
+        """Function to return the similar-words rows to add for renamed attacks."""
+        # An attack's similar words should include its current and previous names
+        existing = await self.dao.raw_select(
+            "SELECT attack_uid, similar_word FROM similar_words WHERE attack_uid IN (%s)"
+            % ", ".join([self.dao.db_qparam] * len(name_changes)),
+            parameters=tuple(attack_uid for attack_uid, _, _ in name_changes),
+        )
+        existing = {(row["attack_uid"], row["similar_word"]) for row in existing}
+        rows = []
+        for attack_uid, retrieved_name, current_name in name_changes:
+            for name in [retrieved_name, current_name]:
+                if name and ((attack_uid, name) not in existing):
+                    existing.add((attack_uid, name))
+                    rows.append((str(uuid.uuid4()), attack_uid, name))
+        return rows
 
     async def insert_attack_json_data(self, buildfile):
         """
@@ -191,9 +260,15 @@ class DataService:
         :param buildfile: Enterprise attack json file to build from
         :return: nil
         """
-        cur_uids = await self.dao.get_column_as_list(table="attack_uids", column="uid")
-        logging.info("[#] {} Existing items in the DB".format(len(cur_uids)))
-        with open(buildfile, "r") as infile:
+        with open(buildfile, "rb") as infile:
+            # Nothing to do if this file was loaded into the database already
+            fingerprint = await self.get_changed_fingerprint(ATTACK_JSON_FINGERPRINT, infile.read())
+            if not fingerprint:
+                logging.info("Attack data file unchanged since it was last loaded: skipping")
+                return
+            infile.seek(0)
+            cur_uids = await self.dao.get_column_as_list(table="attack_uids", column="uid")
+            logging.info("[#] {} Existing items in the DB".format(len(cur_uids)))
             attack_dict = json.load(infile)
             loaded_items = {}
             # Extract all TIDs
@@ -245,15 +320,17 @@ class DataService:
         # Deduplicate input data from existing items in the DB
         to_add = {x: y for x, y in loaded_items.items() if x not in cur_uids}
         logging.info("[#] {} Techniques found that are not in the existing database".format(len(to_add)))
+        attack_rows, true_positive_rows = [], []
         for k, v in to_add.items():
-            await self.dao.insert("attack_uids", dict(uid=k, tid=v["id"], name=v["name"]))
-            if "example_uses" in v:
-                [
-                    await self.dao.insert_generate_uid(
-                        "true_positives", dict(attack_uid=k, true_positive=self.dao.truncate_str(defang_text(x), 800))
-                    )
-                    for x in v["example_uses"]
-                ]
+            attack_rows.append((k, v["id"], v["name"]))
+            for x in v.get("example_uses", []):
+                true_positive_rows.append((str(uuid.uuid4()), k, self.dao.truncate_str(defang_text(x), 800)))
+        sql_list = [
+            self.dao.insert_many_sql("attack_uids", ["uid", "tid", "name"], attack_rows),
+            self.dao.insert_many_sql("true_positives", ["uid", "attack_uid", "true_positive"], true_positive_rows),
+        ]
+        await self.dao.run_sql_list(sql_list=sql_list)
+        await self.set_metadata(ATTACK_JSON_FINGERPRINT, fingerprint)
 
     async def set_regions_data(self, buildfile=os.path.join("threadcomponents", "conf", "country-regions.json")):
         """Function to read in the regions json file."""
@@ -288,11 +365,16 @@ class DataService:
     ):
         """Function to read in the categories json file and insert data into the database."""
         buildfile = os.path.join(self.dir_prefix, buildfile)  # prefix directory path if there is one
+        # Load the JSON file
+        with open(buildfile, "rb") as infile:
+            categories_bytes = infile.read()
+        categories_dict = self.web_svc.categories_dict = json.loads(categories_bytes)
+        # The database only needs updating if this file has changed since it was last loaded
+        fingerprint = await self.get_changed_fingerprint(CATEGORIES_FINGERPRINT, categories_bytes)
+        if not fingerprint:
+            return
         # The current categories saved in the db
         cur_categories = await self.dao.get_column_as_list(table="categories", column="keyname")
-        # Load the JSON file
-        with open(buildfile, "r") as infile:
-            categories_dict = self.web_svc.categories_dict = json.load(infile)
         # Dictionaries to hold the display names and parent-category names for categories
         parent_cat_names, display_names = {}, {}
         # Loop through category list once to map all sub-categories to their parent categories
@@ -330,15 +412,20 @@ class DataService:
             await self.dao.insert_generate_uid(
                 "categories", dict(keyname=keyname, name=entry["name"], display_name=display_names[keyname])
             )
+        await self.set_metadata(CATEGORIES_FINGERPRINT, fingerprint)
 
     async def insert_keyword_json_data(self, buildfile=os.path.join("spindle", "cta_names_mappings.json")):
         """Function to read in the keywords json file and insert data into the database."""
         buildfile = os.path.join(self.dir_prefix, buildfile)  # prefix directory path if there is one
+        # Load the JSON file; the database only needs updating if this file has changed since it was last loaded
+        with open(buildfile, "rb") as infile:
+            keywords_bytes = infile.read()
+        fingerprint = await self.get_changed_fingerprint(KEYWORDS_FINGERPRINT, keywords_bytes)
+        if not fingerprint:
+            return set()
+        keywords_dict = json.loads(keywords_bytes)
         # The current keywords saved in the db
         cur_keywords = await self.dao.get_column_as_list(table="keywords", column="name")
-        # Load the JSON file
-        with open(buildfile, "r") as infile:
-            keywords_dict = json.load(infile)
         # Obtain all the unique keywords and aliases into a set
         to_add = set()
         for keyword, entry in keywords_dict.items():
@@ -347,8 +434,9 @@ class DataService:
                 to_add.update(entry.get(list_key, []))
         # Check which ones are not in the database and add them if so
         to_add = to_add - set(cur_keywords)
-        for adding_keyword in to_add:
-            await self.dao.insert_generate_uid("keywords", dict(name=adding_keyword))
+        sql_list = [self.dao.insert_many_sql("keywords", ["uid", "name"], [(str(uuid.uuid4()), k) for k in to_add])]
+        await self.dao.run_sql_list(sql_list=sql_list)
+        await self.set_metadata(KEYWORDS_FINGERPRINT, fingerprint)
         return to_add
 
     async def status_grouper(self, status, criteria=None):
@@ -639,6 +727,12 @@ class DataService:
         return unconfirmed_by_sentence if return_detail else count
 
     async def get_confirmed_techniques_for_afb_export(self, report_id):
+        """Function to retrieve the confirmed techniques and IoCs of a report for an AFB export."""
+        return await self.report_cache.get_or_load(
+            report_id, "afb_export", lambda: self._get_confirmed_techniques_for_afb_export(report_id)
+        )
+
+    async def _get_confirmed_techniques_for_afb_export(self, report_id):
         # The SQL select union query to retrieve the confirmed techniques and IoCs for the afb export
         distinct_clause = "DISTINCT ON (tid) " if self.dao.db.IS_POSTGRESQL else ""
         select_query = (
@@ -658,6 +752,12 @@ class DataService:
         return await self.dao.raw_select(select_query, parameters=tuple([TTP, report_id, IOC, report_id]))
 
     async def get_confirmed_techniques_for_nav_export(self, report_id):
+        """Function to retrieve the confirmed techniques of a report for a navigator export."""
+        return await self.report_cache.get_or_load(
+            report_id, "nav_export", lambda: self._get_confirmed_techniques_for_nav_export(report_id)
+        )
+
+    async def _get_confirmed_techniques_for_nav_export(self, report_id):
         # Ensure date fields are converted into strings
         start_date = self.dao.db.sql_date_field_to_str(
             "report_sentence_hits.start_date", field_name_as="tech_start_date"
@@ -730,6 +830,72 @@ class DataService:
         count_query_result = await self.dao.raw_select(count_query, parameters=tuple([report_id]))
         return count_query_result[0]["count"]
 
+    async def get_analysis_metrics(self, report_id=None, limit=100):
+        """Function to return the most-recent analysis metrics, optionally for a given report."""
+        query, parameters = "SELECT * FROM report_analysis_metrics", []
+        if report_id:
+            query += f" WHERE report_uid = {self.dao.db_qparam}"
+            parameters.append(report_id)
+        query += f" ORDER BY date_analysed DESC LIMIT {self.dao.db_qparam}"
+        parameters.append(limit)
+        metrics = await self.dao.raw_select(query, parameters=tuple(parameters))
+        # Timestamps may be datetime objects (depending on the DB engine); return these in a JSON-friendly format
+        for metric in metrics:
+            if metric.get("date_analysed") is not None:
+                metric["date_analysed"] = str(metric["date_analysed"])
+        return metrics
+
+    async def get_analysis_jobs(self, claimable_at=None):
+        """
+        Function to return the queued analysis jobs (with their reports).
+
+        :param claimable_at: Optional, a time to only return jobs which are claimable then
+        :return: list of jobs, each joined with its report
+        """
+        query, parameters = (
+            "SELECT reports.*, analysis_jobs.uid AS job_uid, analysis_jobs.lane, analysis_jobs.techniques_threshold, "
+            "analysis_jobs.attempts FROM analysis_jobs JOIN reports ON reports.uid = analysis_jobs.report_uid",
+            [],
+        )
+        if claimable_at is not None:
+            query += f" WHERE analysis_jobs.worker IS NULL OR analysis_jobs.lease_expires < {self.dao.db_qparam}"
+            parameters.append(claimable_at)
+        query += " ORDER BY analysis_jobs.queued_at"
+        return await self.dao.raw_select(query, parameters=tuple(parameters))
+
+    async def get_queued_progress(self, token=None, all_tokens=False):
+        """Function to return the queued reports (submitted with a token unless all are requested) with the process
+        analysing each (if any) and how many of their sentences have been analysed."""
+        query = (
+            "SELECT reports.uid, reports.title, reports.token, analysis_jobs.worker, analysis_jobs.lease_expires, "
+            "progress.sentences_done, progress.sentence_count FROM ((analysis_jobs "
+            "JOIN reports ON reports.uid = analysis_jobs.report_uid) "
+            "LEFT JOIN report_sentence_queue_progress progress ON progress.report_uid = reports.uid)"
+        )
+        parameters = []
+        if not all_tokens:
+            query += f" WHERE reports.token = {self.dao.db_qparam}" if token else " WHERE reports.token IS NULL"
+            parameters += [token] if token else []
+        query += " ORDER BY analysis_jobs.queued_at"
+        return await self.dao.raw_select(query, parameters=tuple(parameters))
+
+    async def get_analysis_checkpoint(self, report_id):
+        """Function to return the saved progress (if any) of analysing a report, with its fetched article."""
+        query = (
+            "SELECT * FROM report_sentence_queue_progress "
+            f"WHERE report_uid = {self.dao.db_qparam} AND article IS NOT NULL"
+        )
+        checkpoints = await self.dao.raw_select(query, parameters=tuple([report_id]))
+        return checkpoints[0] if checkpoints else None
+
+    async def get_queued_reports_without_jobs(self):
+        """Function to return the queued reports which have no analysis job (e.g. from before jobs were kept)."""
+        query = (
+            f"SELECT * FROM reports WHERE current_status = {self.dao.db_qparam} AND error = {self.dao.db_false_val} "
+            "AND uid NOT IN (SELECT report_uid FROM analysis_jobs)"
+        )
+        return await self.dao.raw_select(query, parameters=tuple([ReportStatus.QUEUE.value]))
+
     async def remove_expired_reports(self):
         """Function to delete expired reports."""
         # The query below uses a timestamp function which differs across DB engines; obtain the correct one
@@ -747,11 +913,14 @@ class DataService:
 
         delete_query = "DELETE" + query
         await self.dao.run_sql_list(sql_list=[(delete_query,)])
+        if expired_urls:
+            await self.report_cache.clear()
         logging.info("DELETE EXPIRED REPORTS: END")
 
     async def remove_report_by_id(self, report_id=""):
         """Function to delete a report by its ID."""
         await self.dao.delete("reports", dict(uid=report_id))
+        await self.report_cache.bump(report_id)
 
     async def get_report_by_id_or_title(self, by_id=False, by_title=False, report="", add_expiry_bool=True):
         """Given a report ID or title, returns matching report records."""
@@ -783,6 +952,42 @@ class DataService:
         """Given a report ID, returns matching report records."""
         return await self.get_report_by_id_or_title(by_id=True, report=report_id, add_expiry_bool=add_expiry_bool)
 
+    async def get_reports_for_export(
+        self, statuses, token=None, start_date=None, end_date=None, category=None, add_expiry_bool=True
+    ):
+        """Function to retrieve the reports (and their date fields) matching the given export filters."""
+        date_written = self.dao.db.sql_date_field_to_str("date_written", str_suffix=True)
+        start_date_field = self.dao.db.sql_date_field_to_str("start_date", str_suffix=True)
+        end_date_field = self.dao.db.sql_date_field_to_str("end_date", str_suffix=True)
+        fields = [date_written, start_date_field, end_date_field]
+        if add_expiry_bool:
+            time_now = self.dao.db_func(self.dao.db.FUNC_TIME_NOW) + "()"
+            fields.append(f"expires_on < {time_now} AS is_expired")
+
+        # Build the WHERE clause and its parameters from the given filters
+        status_params = ", ".join([self.dao.db_qparam] * len(statuses))
+        conditions, params = [f"current_status IN ({status_params})"], list(statuses)
+        if token:
+            conditions.append(f"token = {self.dao.db_qparam}")
+            params.append(token)
+        else:
+            conditions.append("token IS NULL")
+        # Filter on the article publication date; the end date is inclusive
+        if start_date:
+            conditions.append(f"date_written >= {self.dao.db_qparam}")
+            params.append(start_date.strftime("%Y-%m-%d"))
+        if end_date:
+            conditions.append(f"date_written < {self.dao.db_qparam}")
+            params.append((end_date + timedelta(days=1)).strftime("%Y-%m-%d"))
+        if category:
+            conditions.append(
+                f"uid IN (SELECT report_uid FROM report_categories WHERE category_keyname = {self.dao.db_qparam})"
+            )
+            params.append(category)
+
+        query = f"SELECT *, {', '.join(fields)} FROM reports WHERE {' AND '.join(conditions)} ORDER BY title"
+        return await self.dao.raw_select(query, parameters=tuple(params))
+
     async def rollback_report(self, report_id=""):
         """Function to rollback a report to its initial state."""
         # The list of SQL statements to run for this operation
@@ -810,7 +1015,9 @@ class DataService:
             sql_list.append(tuple([sql, parameters]))
 
         # Run the deletions and insertions for this method altogether; return if it was successful
-        return await self.dao.run_sql_list(sql_list=sql_list)
+        success = await self.dao.run_sql_list(sql_list=sql_list)
+        await self.report_cache.bump(report_id)
+        return success
 
     async def export_report_data(self, report=None, report_id="", report_title="", flatten_sentences=True):
         """Function to retrieve all the data for a report."""
@@ -827,6 +1034,17 @@ class DataService:
             # Be wary, this can raise KeyError
             report_id = report["uid"]
         # Retrieve and return the rest of the report data
+        cached_data = await self.report_cache.get_or_load(
+            report_id,
+            ("export_report_data", flatten_sentences),
+            lambda: self._get_export_report_data(report_id, flatten_sentences),
+        )
+        all_data = dict(report=report)
+        all_data.update(cached_data)
+        return all_data
+
+    async def _get_export_report_data(self, report_id, flatten_sentences):
+        """Function to retrieve the sentences, IoCs, aggressors and victims of a report."""
         sentences = await self.get_report_sentences_with_attacks(
             report_id=report_id, group_by_attack=(not flatten_sentences)
         )
@@ -837,7 +1055,7 @@ class DataService:
         keywords["victims"].pop("groups")
         keywords["victims"]["categories"] = [row.get("display_name", cat_code) for cat_code, row in categories.items()]
         keywords["victims"]["category_codes"] = list(categories.keys())
-        all_data = dict(report=report, sentences=sentences, indicators_of_compromise=indicators_of_compromise)
+        all_data = dict(sentences=sentences, indicators_of_compromise=indicators_of_compromise)
         all_data.update(keywords)
         return all_data
 
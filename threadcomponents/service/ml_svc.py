@@ -6,14 +6,9 @@ import asyncio
 import logging
 import os
 
-import numpy as np
 import pickle
 import random
 
-from sklearn.feature_extraction.text import CountVectorizer
-from sklearn.linear_model import LogisticRegression
-from sklearn.model_selection import train_test_split
-
 
 class MLService:
     # Service to perform the machine learning against the pickle file
@@ -22,9 +17,16 @@ class MLService:
         self.dir_prefix = dir_prefix
         # Specify the location of the models file
         self.dict_loc = os.path.join(self.dir_prefix, "threadcomponents", "models", "model_dict.p")
+        # The models currently in use and the modified-time of the pickle file they were loaded from
+        self.model_dict, self.model_dict_mtime = None, None
 
     async def build_models(self, tech_id, techniques):
         """Function to build Logistic Regression Classification models based off of the examples provided."""
+        # Import here so numpy and sklearn are only loaded once models are needed
+        import numpy as np
+        from sklearn.feature_extraction.text import CountVectorizer
+        from sklearn.linear_model import LogisticRegression
+        from sklearn.model_selection import train_test_split
 
         tech_name = None
         lst1, lst2, false_candidates, false_labels = [], [], [], []
@@ -91,6 +93,8 @@ class MLService:
         return (cv, logreg)
 
     async def analyze_document(self, cv, logreg, sentences):
+        import numpy as np
+
         cleaned_sentences = [await self.token_svc.tokenize(i["text"]) for i in sentences]
 
         Xnew = cv.transform(np.array(cleaned_sentences)).toarray()
@@ -104,7 +108,7 @@ class MLService:
         rebuilt = False
         # If we are not forcing the models to be rebuilt, obtain the previously used models
         if not force:
-            model_dict = self.get_pre_saved_models()
+            model_dict = self.get_current_models()
             # If the models were obtained successfully, return them
             if model_dict:
                 return rebuilt, model_dict
@@ -128,6 +132,7 @@ class MLService:
         with open(self.dict_loc, "wb") as saved_dict:
             pickle.dump(model_dict, saved_dict)
 
+        self.model_dict, self.model_dict_mtime = model_dict, os.path.getmtime(self.dict_loc)
         logging.info("[#] Finished saving models.")
         return rebuilt, model_dict
 
@@ -149,6 +154,18 @@ class MLService:
 
         with open(self.dict_loc, "wb") as saved_dict:
             pickle.dump(current_dict, saved_dict)
+        self.model_dict_mtime = os.path.getmtime(self.dict_loc)
+
+    def get_current_models(self):
+        """Function to return the models in use; only loading them from the pickle file if it has changed."""
+        try:
+            mtime = os.path.getmtime(self.dict_loc)
+        except OSError:
+            mtime = None
+        # Models which were loaded already are reused unless their file has since been replaced (or removed)
+        if (self.model_dict is None) or (mtime != self.model_dict_mtime):
+            self.model_dict, self.model_dict_mtime = self.get_pre_saved_models(), mtime
+        return self.model_dict
 
     def get_pre_saved_models(self, dictionary_location=None):
         """Function to retrieve previously-saved models via pickle."""
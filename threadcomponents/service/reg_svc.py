@@ -4,6 +4,14 @@
 
 import re
 
+from functools import lru_cache
+
+
+@lru_cache(maxsize=None)
+def compile_pattern(pattern):
+    """Function to return a regex pattern compiled (once) for case-insensitive matching."""
+    return re.compile(pattern, re.IGNORECASE)
+
 
 class RegService:
     # Service to analyze the text file against the attack-dict to find matches
@@ -13,12 +21,18 @@ class RegService:
     @staticmethod
     def analyze_document(regex_pattern, sentence):
         cleaned_sentence = sentence["text"]
-        if re.findall(regex_pattern["regex_pattern"], cleaned_sentence, re.IGNORECASE):
+        if compile_pattern(regex_pattern["regex_pattern"]).search(cleaned_sentence):
             print("Found {} in {}".format(regex_pattern, cleaned_sentence))
             return True
         else:
             return False
 
+    @staticmethod
+    def compile_patterns(regex_patterns):
+        """Function to compile the given regex patterns ahead of them being matched against sentences."""
+        for regex_pattern in regex_patterns:
+            compile_pattern(regex_pattern["regex_pattern"])
+
     def analyze_html(self, regex_patterns, html_sentences):
         for regex_pattern in regex_patterns:
             count = 0
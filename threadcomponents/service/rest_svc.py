@@ -3,19 +3,30 @@
 # To see its full history, please use `git log --follow <filename>` to view previous commits and additional contributors
 
 import asyncio
+import copy
+import importlib
+import json
 import logging
-import pandas as pd
+import os
 import re
+import socket
+import time
 
 from contextlib import suppress
+from datetime import datetime
 from functools import partial
-from htmldate import find_date
 from io import StringIO
 from requests.exceptions import RequestException
+from uuid import uuid4
 
 from threadcomponents.constants import REST_SUCCESS, UID, URL, TITLE
+from threadcomponents.database.thread_db import query_scope, REQUIRE_ROWS
 from threadcomponents.enums import ReportStatus
 from threadcomponents.helpers.date import check_input_date
+from threadcomponents.helpers.fair_queue import FairQueue
+from threadcomponents.helpers.profiling import AnalysisProfiler
+from threadcomponents.helpers.progress import AnalysisProgress, FINISHED_STAGES
+from threadcomponents.helpers.timing import HEAVY_MODULES, StagesCancelled, StageTimeout, StageTimer
 
 from threadcomponents.managers.ioc_manager import IoCManager
 from threadcomponents.managers.mapping_manager import MappingManager
@@ -26,6 +37,43 @@ PUBLIC = "public"
 
 # The minimum amount of tecniques for a report to not be discarded
 REPORT_TECHNIQUES_MINIMUM = 5
+# The timed stages and counts recorded when analysing a report; and the most of these records to return at a time
+ANALYSIS_STAGES = ["download", "parse", "tokenize", "ml", "regex", "persist", "cleanup"]
+ANALYSIS_COUNTS = ["sentence_count", "element_count", "ml_hit_count", "reg_hit_count", "db_query_count"]
+ANALYSIS_METRICS_LIMIT = 100
+# The stages of analysis which can be given deadlines (the rest happens once the report has left the queue)
+ANALYSIS_DEADLINE_STAGES = ["download", "parse", "tokenize", "ml", "regex", "persist"]
+# The number of sentences analysed and saved at a time; an interrupted analysis resumes after the last saved batch
+ANALYSIS_BATCH_SIZE = 50
+# The number of sentences sampled from an automatically-generated report to estimate how many techniques it has (only
+# for reports with more than twice this many sentences, else analysing the sample would save little)
+PRESCAN_SAMPLE_SIZE = 100
+# The fraction of the techniques threshold a prescanned report's estimate needs to reach for the report to be analysed
+PRESCAN_THRESHOLD_FRACTION = 0.5
+# The tables which analysing a report saves to (before the report leaves the queue)
+ANALYSIS_PROGRESS_TABLES = [
+    "report_sentences",
+    "report_sentence_queue_progress",
+    "report_sentence_hits",
+    "original_html",
+]
+# The kinds of queue-lane: each user (and the public) has a lane for reports submitted one at a time and one for CSV
+# submissions; automatically-generated reports share a lane. The weight of a lane is how many reports it has analysed
+# each turn, relative to the other lanes with reports queued
+INTERACTIVE_LANE, BULK_LANE, AUTOMATIC_LANE = "interactive", "bulk", "automatic"
+DEFAULT_QUEUE_WEIGHTS = {INTERACTIVE_LANE: 4, BULK_LANE: 1, AUTOMATIC_LANE: 1}
+# Queued reports are kept as jobs in the db so any Thread process using the db can analyse them. A process claims a job
+# with a lease which it renews whilst analysing the report; if the process stops, the job can be claimed again once the
+# lease expires (until it has been claimed too many times, when the report is marked as errored)
+JOBS_TABLE = "analysis_jobs"
+DEFAULT_JOB_LEASE_SECONDS = 300
+DEFAULT_JOB_POLL_SECONDS = 10
+MAX_JOB_ATTEMPTS = 3
+# A synthetic report used to warm up analysis before the app starts
+WARM_UP_TEXT = (
+    "The actor used PowerShell to download a payload from 192.168.0[.]1 and created a scheduled task for persistence."
+    "<br>It then exfiltrated the collected files over HTTPS."
+)
 
 
 class RestService:
@@ -41,6 +89,10 @@ class RestService:
         queue_limit=None,
         max_tasks=1,
         sentence_limit=None,
+        analysis_profiler=None,
+        queue_weights=None,
+        job_lease_seconds=DEFAULT_JOB_LEASE_SECONDS,
+        analysis_deadlines=None,
     ):
         self.MAX_TASKS = max_tasks
         self.QUEUE_LIMIT = queue_limit
@@ -52,18 +104,39 @@ class RestService:
         self.attack_data_svc = attack_data_svc
         self.ml_svc = ml_svc
         self.reg_svc = reg_svc
+        # Profiles the analysis of sampled reports (none are sampled by default)
+        self.analysis_profiler = analysis_profiler or AnalysisProfiler()
         self.is_local = self.web_svc.is_local
         self.queue_map = dict()  # map each user to their own queue
 
-        try:
-            self.queue = asyncio.Queue()  # task queue
-        except RuntimeError as e:  # a RuntimeError may occur if there is no event loop
-            logging.error("Encountered error %s; attempting to resolve by setting new event loop" % str(e))
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            self.queue = asyncio.Queue()
+        self.queue_weights = dict(DEFAULT_QUEUE_WEIGHTS, **(queue_weights or dict()))
+        if set(self.queue_weights) != set(DEFAULT_QUEUE_WEIGHTS):
+            raise ValueError("Queue weights can only be set for lanes: " + ", ".join(DEFAULT_QUEUE_WEIGHTS))
+        if not all(isinstance(weight, (int, float)) and weight > 0 for weight in self.queue_weights.values()):
+            raise ValueError("Queue weights must be numbers greater than 0.")
+        # Task queue: users' reports are analysed in turn so one user's CSV doesn't hold up everyone else's reports
+        self.queue = FairQueue(self.get_queue_lane, weight_func=lambda lane: self.queue_weights[lane[0]])
+        # This process's name when claiming analysis jobs; and the jobs (by ID) in its queue
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid4().hex[:8]}"[-100:]
+        self.job_lease_seconds = job_lease_seconds
+        self.queued_job_uids = set()
+
+        # The most time (in seconds) stages of analysing a report can take; if each stage has one, stop waiting on an
+        # analysis (freeing its slot) after twice their total, in case it is stuck partway through a stage
+        self.analysis_deadlines = {stage: limit for stage, limit in (analysis_deadlines or dict()).items() if limit}
+        if not set(self.analysis_deadlines).issubset(ANALYSIS_DEADLINE_STAGES):
+            raise ValueError("Analysis deadlines can only be set for stages: " + ", ".join(ANALYSIS_DEADLINE_STAGES))
+        if not all(isinstance(limit, (int, float)) and limit > 0 for limit in self.analysis_deadlines.values()):
+            raise ValueError("Analysis deadlines must be numbers of seconds.")
+        self.analysis_timeout = None
+        if set(self.analysis_deadlines) == set(ANALYSIS_DEADLINE_STAGES):
+            self.analysis_timeout = 2 * sum(self.analysis_deadlines.values())
 
         self.current_tasks = []  # tasks that are currently being executed
+        # The analyses (by report ID) running in this process; each can be stopped through its StageTimer
+        self.running_analyses = dict()
+        # The stage each report in this process's queue is at, for clients waiting on their reports
+        self.analysis_progress = AnalysisProgress()
         # A dictionary to keep track of report statuses we have seen
         self.seen_report_status = dict()
 
@@ -79,13 +152,34 @@ class RestService:
         self.mapping_manager = MappingManager(*manager_args)
         self.ioc_manager = IoCManager(*manager_args)
 
-    async def fetch_and_update_attack_data(self):
-        """Function to fetch and update the attack data."""
+    async def fetch_and_update_attack_data(self, full_update=False):
+        """
+        Function to fetch and update the attack data.
+        :param full_update: Whether to apply all attack data rather than only what has changed since the last update
+        """
         # The output of the attack-data-updates from data_svc
-        attack_data = self.attack_data_svc.fetch_flattened_attack_data()
-        await self.data_svc.update_db_with_flattened_attack_data(attack_data=attack_data)
+        attack_data, delta = self.attack_data_svc.fetch_attack_data_delta(full_update=full_update)
+        partial_update = bool(delta) and not delta["full"]
+        if partial_update and not (attack_data or delta["inactive"]):
+            self.attack_data_svc.save_attack_data_delta(delta)
+            return
+
+        # Note the changed techniques before the attack data is added to json_tech
+        changed_tids = [attack_item["tid"] for attack_item in attack_data.values()]
+        inactive_uids = delta["inactive"] if partial_update else None
+        await self.data_svc.update_db_with_flattened_attack_data(attack_data=attack_data, inactive_uids=inactive_uids)
         self.attack_data_svc.update_json_tech_with_flattened_attack_data(attack_data=attack_data)
 
+        # Rebuild the existing models of changed techniques (a full update leaves this to the next model build)
+        if partial_update and os.path.isfile(self.ml_svc.dict_loc):
+            model_tids = {tech_id for tech_id, _ in self.attack_data_svc.list_of_techs}
+            techs_to_rebuild = [tid for tid in changed_tids if tid in model_tids]
+            if techs_to_rebuild:
+                await self.ml_svc.update_pickle_file(
+                    techs_to_rebuild, self.attack_data_svc.list_of_techs, self.attack_data_svc.json_tech
+                )
+        self.attack_data_svc.save_attack_data_delta(delta)
+
     def get_queue_for_user(self, token=None):
         """Function to retrieve queue (as list) for a given user token."""
         # No token = queue for public-use
@@ -95,10 +189,19 @@ class RestService:
             self.queue_map[token] = []
         return self.queue_map[token]
 
+    @staticmethod
+    def get_queue_lane(report):
+        """Function to return the queue-lane of a report as (kind of lane, user token)."""
+        if report.get("automatically_generated"):
+            return AUTOMATIC_LANE, None
+        return (BULK_LANE if report.get("bulk") else INTERACTIVE_LANE), (report.get("token") or PUBLIC)
+
     def remove_report_from_queue_map(self, report):
         """Function to remove given report from internal queue-map."""
         queue = self.get_queue_for_user(token=report.get("token"))
-        queue.remove(report[URL])
+        # The report may have been analysed by another process (so was not added back to this map)
+        with suppress(ValueError):
+            queue.remove(report[URL])
 
     def clean_current_tasks(self):
         """Function to remove finished tasks from the current_tasks list."""
@@ -109,23 +212,119 @@ class RestService:
         self.current_tasks = temp_current_tasks
 
     async def prepare_queue(self):
-        """Function to add to the queue any reports left from a previous session."""
-        reports = await self.dao.get(
-            "reports", dict(error=self.dao.db_false_val, current_status=ReportStatus.QUEUE.value)
+        """Function to add to the queue any reports left from a previous session (or queued by other processes)."""
+        # Reports queued before their jobs were kept in the db need a job; count this as an attempt as the report's
+        # analysis may have stopped partway
+        for report in await self.data_svc.get_queued_reports_without_jobs():
+            try:
+                await self._insert_job(report, attempts=1)
+            except Exception as e:
+                # Another process starting at the same time may have added the job
+                logging.warning(f"Could not add an analysis job for report {report[UID]}: {e}")
+        await self.refresh_queue()
+
+    async def _insert_job(self, report, attempts=0):
+        """Function to save an analysis job for a queued report; returns the job's ID."""
+        lane, _ = self.get_queue_lane(report)
+        threshold = report.get("techniques_threshold")
+        job = dict(
+            report_uid=report[UID],
+            lane=lane,
+            owner=report.get("token") or PUBLIC,
+            techniques_threshold=threshold if isinstance(threshold, int) else None,
+            queued_at=time.time(),
+            attempts=attempts,
         )
-        for report in reports:
-            # Sentences from this report may have previously populated other db tables
-            # Being selected from the queue will begin analysis again so delete previous progress
-            report_id = report[UID]
-            await self.dao.delete("report_sentences", dict(report_uid=report_id))
-            await self.dao.delete("report_sentence_queue_progress", dict(report_uid=report_id))
-            await self.dao.delete("report_sentence_hits", dict(report_uid=report_id))
-            await self.dao.delete("original_html", dict(report_uid=report_id))
-            # Get the relevant queue for this user
-            queue = self.get_queue_for_user(token=report.get("token"))
-            # Add to the queue
-            await self.queue.put(report)
-            queue.append(report[URL])
+        return await self.dao.insert_generate_uid(JOBS_TABLE, job)
+
+    async def queue_job(self, report):
+        """Function to save a report's analysis job (so any Thread process can analyse it) and add it to the queue."""
+        report.update(job_uid=await self._insert_job(report), attempts=0)
+        self.queued_job_uids.add(report["job_uid"])
+        self.analysis_progress.notify()
+        await self.queue.put(report)
+
+    async def refresh_queue(self):
+        """Function to add to the queue any claimable jobs not already in it; returns how many were added."""
+        added = 0
+        for job in await self.data_svc.get_analysis_jobs(claimable_at=time.time()):
+            if job["job_uid"] in self.queued_job_uids:
+                continue
+            if job["current_status"] != ReportStatus.QUEUE.value:
+                # The report left the queue but its job was not deleted (e.g. the process stopped before doing so)
+                await self.dao.delete(JOBS_TABLE, dict(uid=job["job_uid"]))
+                continue
+            job["bulk"] = job["lane"] == BULK_LANE
+            self.queued_job_uids.add(job["job_uid"])
+            self.get_queue_for_user(token=job.get("token")).append(job[URL])
+            self.analysis_progress.notify()
+            await self.queue.put(job)
+            added += 1
+        return added
+
+    async def poll_jobs(self):
+        """Function to start analysing any jobs queued by other processes (or left by stopped ones) when idle."""
+        if self.queue.empty() and await self.refresh_queue():
+            asyncio.create_task(self.check_queue())
+
+    async def get_analysis_progress(self, token=None, all_tokens=False):
+        """Function to return the progress of the reports queued by any process and of those this process finished."""
+        local_progress = self.analysis_progress.get(token=token, all_tokens=all_tokens)
+        reports, now = [], time.time()
+        for job in await self.data_svc.get_queued_progress(token=token, all_tokens=all_tokens):
+            entry = local_progress.pop(job[UID], None)
+            # Only the process analysing a report knows its stage: others know whether it is being analysed
+            if (entry is None) or (job["worker"] != self.worker_id and entry["stage"] not in FINISHED_STAGES):
+                analysing = job["worker"] and (job["lease_expires"] or 0) >= now
+                entry = dict(
+                    title=job[TITLE],
+                    stage="analysing" if analysing else "queued",
+                    sentences_done=job["sentences_done"] or 0,
+                    sentence_count=job["sentence_count"] or 0,
+                )
+            reports.append(entry)
+        # Add the reports this process has finished (or is analysing without a job)
+        reports.extend(local_progress.values())
+        for entry in reports:
+            entry.pop("token", None)  # Prevent tokens reaching request-response
+        return reports
+
+    async def claim_job(self, report):
+        """Function to claim a queued report's job for this process; returns whether to analyse the report."""
+        job_uid = report.get("job_uid")
+        self.queued_job_uids.discard(job_uid)
+        # Reports queued without a job are only in this process's queue
+        if job_uid is None:
+            return True
+        now = time.time()
+        if not await self.dao.claim_job(JOBS_TABLE, job_uid, self.worker_id, now + self.job_lease_seconds, now):
+            # Another process has claimed the job (or already analysed the report): its progress is kept by that process
+            self.remove_report_from_queue_map(report)
+            self.analysis_progress.remove(report[UID])
+            return False
+        attempts = report.get("attempts") or 0
+        if attempts >= MAX_JOB_ATTEMPTS:
+            logging.error(f"Skipping report; analysis did not finish after {attempts} attempts for {report[UID]}")
+            await self.error_report(report)
+            await self.dao.delete(JOBS_TABLE, dict(uid=job_uid))
+            return False
+        return True
+
+    async def keep_job_leased(self, report, stage_timer):
+        """Function to keep renewing this process's lease on a report's job (until cancelled)."""
+        while True:
+            await asyncio.sleep(self.job_lease_seconds / 3)
+            lease_expires = time.time() + self.job_lease_seconds
+            if not await self.dao.renew_job_lease(JOBS_TABLE, report["job_uid"], self.worker_id, lease_expires):
+                # The report was cancelled or another process has taken over its analysis
+                logging.warning(f"Lost the lease on the analysis job for report {report[UID]}")
+                stage_timer.cancel()
+                return
+
+    async def finish_job(self, report):
+        """Function to delete this process's job for a report once its analysis has finished (or failed)."""
+        if report.get("job_uid"):
+            await self.dao.delete(JOBS_TABLE, dict(uid=report["job_uid"], worker=self.worker_id))
 
     async def set_status(self, *args, **kwargs):
         return await self.report_manager.set_status(*args, **kwargs)
@@ -188,7 +387,7 @@ class RestService:
         except (TypeError, ValueError) as e:  # Any errors occurring from the csv-checks
             return dict(error=str(e), alert_user=1)
 
-        return await self._insert_batch_reports(request, df, df.shape[0], token=criteria.get("token"))
+        return await self._insert_batch_reports(request, df, df.shape[0], token=criteria.get("token"), bulk=True)
 
     async def pre_insert_add_token(self, request, request_data=None, key=None):
         """Function to check sent request data before inserting reports and return an error if there was an issue."""
@@ -224,7 +423,7 @@ class RestService:
         else:
             request_data.update(token=None)
 
-    async def _insert_batch_reports(self, request, batch, row_count, token=None):
+    async def _insert_batch_reports(self, request, batch, row_count, token=None, bulk=False):
         # Possible responses to the request
         default_error, success = dict(error="Error inserting report(s)."), REST_SUCCESS.copy()
         # Different counts for different reasons why reports are not queued
@@ -311,8 +510,9 @@ class RestService:
                 # Insert report into db and update temp_dict with inserted ID from db
                 temp_dict[UID] = await self.dao.insert_generate_uid("reports", temp_dict)
                 temp_dict["techniques_threshold"] = batch.get("techniques_threshold")
+                temp_dict["bulk"] = bulk
                 # Finally, update queue and check queue when batch is finished
-                await self.queue.put(temp_dict)
+                await self.queue_job(temp_dict)
                 queue.append(url)
 
         if limit_exceeded or duplicate_urls or malformed_urls or long_titles or long_urls:
@@ -334,6 +534,9 @@ class RestService:
     @staticmethod
     def verify_csv(file_param):
         """Function to return a dataframe from csv-like text."""
+        # Import here so pandas is only loaded when a CSV is submitted
+        import pandas as pd
+
         # Check if the text can be converted into a file and then converted into a dataframe (df)
         try:
             file = StringIO(file_param)
@@ -387,7 +590,8 @@ class RestService:
         logging.info("CHECKING QUEUE")
         self.clean_current_tasks()
 
-        while self.queue.qsize() > 0:  # while there are still tasks to do...
+        # While there are still tasks to do (including jobs in the db which other processes have not claimed)...
+        while self.queue.qsize() > 0 or await self.refresh_queue():
             logging.info("QUEUE SIZE: " + str(self.queue.qsize()))
             await asyncio.sleep(1)  # allow other tasks to run while waiting
 
@@ -396,25 +600,47 @@ class RestService:
                 await asyncio.sleep(1)  # allow other tasks to run while waiting
 
             criteria = await self.queue.get()  # get next task off queue and run it
+            if not await self.claim_job(criteria):
+                continue
             # Use run_in_executor (due to event loop potentially blocked otherwise) to start analysis
             loop = asyncio.get_running_loop()
+            stage_timer = self.new_stage_timer(criteria)
+            heartbeat = None
+            if criteria.get("job_uid"):
+                heartbeat = asyncio.create_task(self.keep_job_leased(criteria, stage_timer))
 
             try:
-                task = loop.run_in_executor(None, partial(self.run_start_analysis, criteria=criteria))
+                task = loop.run_in_executor(
+                    None, partial(self.run_start_analysis, criteria=criteria, stage_timer=stage_timer)
+                )
                 self.current_tasks.append(task)
-                await task
+                # The analysis can't be interrupted mid-stage: if it is stuck, stop it once the stage ends and move on
+                await asyncio.wait_for(asyncio.shield(task), timeout=self.analysis_timeout)
+
+            except asyncio.TimeoutError:
+                stage_timer.cancel()
+                with suppress(ValueError):
+                    self.current_tasks.remove(task)
+                error = StageTimeout(f"Analysis took longer than {self.analysis_timeout} seconds.")
+                logging.error(f"Report analysis failed: {error}")
+                await self.error_report(criteria, log_error=error)
 
             except Exception as e:
                 logging.error(f"Report analysis failed: {e}")
                 await self.error_report(criteria, log_error=e)
                 continue
 
-    def run_start_analysis(self, criteria=None):
+            finally:
+                if heartbeat:
+                    heartbeat.cancel()
+                await self.finish_job(criteria)
+
+    def run_start_analysis(self, criteria=None, stage_timer=None):
         """Function to run start_analysis() for given criteria."""
         # Create a new loop to execute the async method as per https://stackoverflow.com/a/46075571
         loop = asyncio.new_event_loop()
         try:
-            coroutine = self.start_analysis(criteria)
+            coroutine = self.start_analysis(criteria, stage_timer=stage_timer)
             asyncio.set_event_loop(loop)
             return loop.run_until_complete(coroutine)
         finally:
@@ -424,18 +650,222 @@ class RestService:
         """Function to error a given report."""
         report_id = report[UID]
         await self.dao.update("reports", where=dict(uid=report_id), data=dict(error=self.dao.db_true_val))
+        await self.data_svc.report_cache.bump(report_id)
         self.remove_report_from_queue_map(report)
+        self.analysis_progress.update(report, stage="error")
         await self.remove_report_if_automatically_generated(report_id)
 
         if log_error:
             await self.web_svc.on_report_error(None, log_error)
 
-    async def start_analysis(self, criteria=None):
+    async def warm_up(self):
+        """
+        Function to load what report analysis needs and run a sentence through it.
+
+        This is so the first report to be analysed isn't slower than the rest.
+        """
+        # Import here (rather than on the first report) the dependencies analysis needs
+        for module in HEAVY_MODULES:
+            importlib.import_module(module)
+
+        sentences = self.token_svc.tokenize_sentence(WARM_UP_TEXT)
+        # Only load existing models: building them is done when the first report is analysed
+        if os.path.isfile(self.ml_svc.dict_loc):
+            rebuilt, model_dict = await self.ml_svc.build_pickle_file(
+                self.attack_data_svc.list_of_techs, self.attack_data_svc.json_tech
+            )
+            # Predicting with one model is enough to have the models' code paths loaded
+            await self.ml_svc.analyze_html(self.attack_data_svc.list_of_techs[:1], model_dict, sentences)
+        else:
+            logging.info("No models to load for warm-up; these will be built on analysing the first report")
+
+        regex_patterns = await self.dao.get("regex_patterns")
+        self.reg_svc.compile_patterns(regex_patterns)
+        self.reg_svc.analyze_html(regex_patterns, sentences)
+
+    async def start_analysis(self, criteria=None, stage_timer=None):
         report_id = criteria[UID]
         logging.info("Beginning analysis for " + report_id)
+        # Record how long each stage of analysis takes (and how much was analysed) for this report
+        stage_timer, counts = stage_timer or self.new_stage_timer(criteria), dict()
+        self.running_analyses[report_id] = stage_timer
+        db_calls = None
+        try:
+            with self.analysis_profiler.profile(report_id):
+                with query_scope(f"analysis of report {report_id}") as db_calls:
+                    await self._analyse_report(criteria, stage_timer, counts)
+        except StagesCancelled:
+            logging.info("Stopped analysis for " + report_id)
+            await self._delete_partial_analysis(report_id)
+        except StageTimeout:
+            await self._delete_partial_analysis(report_id)
+            raise
+        finally:
+            self.running_analyses.pop(report_id, None)
+            counts.update(db_query_count=db_calls.count if db_calls else 0)
+            # These are diagnostics: failing to save them should not affect the report
+            try:
+                await self.save_analysis_metrics(criteria, stage_timer, counts)
+            except Exception as e:
+                logging.warning(f"Could not save analysis metrics for report {report_id}: {e}")
+
+    def new_stage_timer(self, criteria):
+        """Function to return a StageTimer for analysing a report, keeping the report's progress up to date."""
+        return StageTimer(
+            deadlines=self.analysis_deadlines, on_stage=lambda name: self.analysis_progress.update(criteria, stage=name)
+        )
+
+    async def _delete_partial_analysis(self, report_id):
+        """Function to delete what a stopped analysis saved, unless another process has taken over the report."""
+        jobs = await self.dao.get(JOBS_TABLE, dict(report_uid=report_id))
+        if jobs and jobs[0]["worker"] != self.worker_id:
+            return
+        if await self.dao.get("reports", dict(uid=report_id, current_status=ReportStatus.QUEUE.value)):
+            for table in ANALYSIS_PROGRESS_TABLES:
+                await self.dao.delete(table, dict(report_uid=report_id))
+
+    async def cancel_report(self, request, criteria=None):
+        """Function to stop a queued report from being analysed (stopping its analysis if started), erroring it."""
+        default_error = dict(error="Error cancelling report.")
+        # Do initial report checks
+        report, error = await self.report_manager.check_report_request_data_valid(
+            request, criteria, "cancel-report", [UID, URL, "current_status", "error"], None
+        )
+        if error or report["error"] or (report["current_status"] != ReportStatus.QUEUE.value):
+            return default_error
+
+        report_id = report[UID]
+        # A process analysing the report stops once it can't renew its lease on the deleted job
+        await self.dao.delete(JOBS_TABLE, dict(report_uid=report_id))
+        await self.error_report(report)
+        stage_timer = self.running_analyses.get(report_id)
+        if stage_timer:
+            # The analysis deletes what it saved once it stops
+            stage_timer.cancel()
+        else:
+            await self._delete_partial_analysis(report_id)
+        return REST_SUCCESS
+
+    async def _analyse_report(self, criteria, stage_timer, counts):
+        """Function to analyse a report, timing each stage with the given StageTimer and updating the counts."""
+        report_id = criteria[UID]
+        prescanned = dict()
+        checkpoint = await self.data_svc.get_analysis_checkpoint(report_id)
+        if checkpoint:
+            # A previous attempt fetched the article and saved some of its sentences: carry on from there
+            article = json.loads(checkpoint["article"])
+            html_sentences, article_date = article["sentences"], article["date"]
+            element_count, sentences_done = article["element_count"], checkpoint["sentences_done"]
+            logging.info(f"Resuming analysis for {report_id} from sentence {sentences_done}")
+        else:
+            if criteria.get("attempts"):
+                # A previous attempt may have saved some progress without a checkpoint: begin analysis again
+                for table in ANALYSIS_PROGRESS_TABLES:
+                    await self.dao.delete(table, dict(report_uid=report_id))
+            fetched = await self._fetch_report(criteria, stage_timer)
+            if fetched is None:
+                return
+            html_sentences, original_html, article_date = fetched
+            element_count, sentences_done = len(original_html), 0
+        counts.update(sentence_count=len(html_sentences), element_count=element_count, ml_hit_count=0, reg_hit_count=0)
+        progress = dict(sentences_done=sentences_done, sentence_count=len(html_sentences))
+        self.analysis_progress.update(criteria, **progress)
+
+        with stage_timer.stage("ml"):
+            rebuilt, model_dict = await self.ml_svc.build_pickle_file(
+                self.attack_data_svc.list_of_techs, self.attack_data_svc.json_tech
+            )
+        with stage_timer.stage("regex"):
+            regex_patterns = await self.dao.get("regex_patterns")
+
+        if not checkpoint:
+            if criteria.get("automatically_generated") and len(html_sentences) > 2 * PRESCAN_SAMPLE_SIZE:
+                # Check a sample of the report first, before analysing (and saving) all of it
+                prescanned = await self._prescan_report(
+                    criteria, html_sentences, model_dict, regex_patterns, stage_timer
+                )
+                if prescanned is None:
+                    return
+            with stage_timer.stage("persist"):
+                await self._save_fetched_article(report_id, html_sentences, original_html, article_date)
+
+        for start in range(sentences_done, len(html_sentences), ANALYSIS_BATCH_SIZE):
+            batch = html_sentences[start : start + ANALYSIS_BATCH_SIZE]
+            # Sentences analysed when prescanning the report don't need analysing again
+            pending = [sentence for index, sentence in enumerate(batch, start) if index not in prescanned]
+            ml_analyzed_html, reg_analyzed_html = [], []
+            if pending:
+                with stage_timer.stage("ml"):
+                    ml_analyzed_html = await self.ml_svc.analyze_html(
+                        self.attack_data_svc.list_of_techs, model_dict, pending
+                    )
+                with stage_timer.stage("regex"):
+                    reg_analyzed_html = self.reg_svc.analyze_html(regex_patterns, pending)
+
+            # Merge ML and Reg hits
+            analyzed_pending = iter(self.combine_ml_and_reg(ml_analyzed_html, reg_analyzed_html))
+            analyzed_html = [
+                prescanned.get(index) or next(analyzed_pending) for index in range(start, start + len(batch))
+            ]
+            counts["ml_hit_count"] += sum(len(sentence["ml_techniques_found"]) for sentence in analyzed_html)
+            counts["reg_hit_count"] += sum(len(sentence["reg_techniques_found"]) for sentence in analyzed_html)
+            with stage_timer.stage("persist"):
+                await self._save_analysed_sentences(criteria, analyzed_html, start, article_date)
+            self.analysis_progress.update(criteria, sentences_done=start + len(batch))
+
+        with stage_timer.stage("persist"):
+            await self._save_analysed_report(report_id, article_date)
+        # Update the relevant queue for this user
+        self.remove_report_from_queue_map(criteria)
+        logging.info("Finished analysing report " + report_id)
+
+        # DB tidy-up including removing report if low quality
+        with stage_timer.stage("cleanup"):
+            min_report_techniques = criteria.get("techniques_threshold")
+            await self.remove_report_if_low_quality(report_id, min_report_techniques=min_report_techniques)
+        self.analysis_progress.update(criteria, stage="done")
+
+    async def _prescan_report(self, criteria, html_sentences, model_dict, regex_patterns, stage_timer):
+        """Function to analyse a sample of a report's sentences and remove the report if it is unlikely to have enough
+        techniques; returns the analysed sample by sentence index (None if the report was removed)."""
+        step = len(html_sentences) / PRESCAN_SAMPLE_SIZE
+        indexes = [int(count * step) for count in range(PRESCAN_SAMPLE_SIZE)]
+        # Analyse copies so the sentences' hits aren't added again when the whole report is analysed
+        sample = [copy.deepcopy(html_sentences[index]) for index in indexes]
+        with stage_timer.stage("ml"):
+            ml_analyzed_html = await self.ml_svc.analyze_html(self.attack_data_svc.list_of_techs, model_dict, sample)
+        with stage_timer.stage("regex"):
+            reg_analyzed_html = self.reg_svc.analyze_html(regex_patterns, sample)
+        analyzed_sample = self.combine_ml_and_reg(ml_analyzed_html, reg_analyzed_html)
+
+        # A technique found by both ML and regex may be counted twice: this only errs on the side of keeping reports
+        techniques = set()
+        for sentence in analyzed_sample:
+            techniques.update(technique_tid for technique_tid, _ in sentence["ml_techniques_found"])
+            techniques.update(sentence["reg_techniques_found"])
+        # Scaling up the sample is only a rough estimate (a sample can miss techniques mentioned in a few sentences), so
+        # only remove reports whose estimate falls well short of the threshold
+        estimate = len(techniques) * len(html_sentences) / len(analyzed_sample)
+        report_techs_threshold = self.get_techniques_threshold(criteria.get("techniques_threshold"))
+        if estimate >= report_techs_threshold * PRESCAN_THRESHOLD_FRACTION:
+            return dict(zip(indexes, analyzed_sample))
+
+        await self.data_svc.remove_report_by_id(report_id=criteria[UID])
+        self.remove_report_from_queue_map(criteria)
+        self.analysis_progress.update(criteria, stage="done")
+        logging.info(f"Deleted report with {len(techniques)} technique(s) found in a sample: {criteria[URL]}")
+
+    async def _fetch_report(self, criteria, stage_timer):
+        """
+        Function to download and tokenize a report.
+
+        :return: the report's sentences, html elements and date; None if the report could not be downloaded
+        """
+        # Import here so htmldate is only loaded when a report is analysed
+        from htmldate import find_date
 
         original_html, newspaper_article = await self.web_svc.map_all_html(
-            criteria[URL], sentence_limit=self.SENTENCE_LIMIT
+            criteria[URL], sentence_limit=self.SENTENCE_LIMIT, stage_timer=stage_timer
         )
         if original_html is None and newspaper_article is None:
             logging.error("Skipping report; could not download url " + criteria[URL])
@@ -444,68 +874,101 @@ class RestService:
 
         html_data = newspaper_article.text.replace("\n", "<br>")
         article = dict(title=criteria[TITLE], html_text=html_data)
-        # Obtain the article date if possible
+        # Obtain the article date if possible (this downloads the article again)
         article_date = None
-        with suppress(ValueError):
+        with stage_timer.stage("download"), suppress(ValueError):
             article_date = find_date(criteria[URL])
         # Check any obtained date is a sensible value to store in the database
         with suppress(TypeError, ValueError):
             check_input_date(article_date)
 
         # Here we build the sentence dictionary
-        html_sentences = self.token_svc.tokenize_sentence(article["html_text"], sentence_limit=self.SENTENCE_LIMIT)
+        with stage_timer.stage("tokenize"):
+            html_sentences = self.token_svc.tokenize_sentence(article["html_text"], sentence_limit=self.SENTENCE_LIMIT)
         if not html_sentences:
             logging.error("Skipping report; could not retrieve sentences from url " + criteria[URL])
             await self.error_report(criteria)
             return
 
         html_sentences = html_sentences[: self.SENTENCE_LIMIT]
-        await self.dao.insert_generate_uid(
-            "report_sentence_queue_progress", dict(report_uid=report_id, sentence_count=len(html_sentences))
-        )
-
-        rebuilt, model_dict = await self.ml_svc.build_pickle_file(
-            self.attack_data_svc.list_of_techs, self.attack_data_svc.json_tech
-        )
-
-        ml_analyzed_html = await self.ml_svc.analyze_html(
-            self.attack_data_svc.list_of_techs, model_dict, html_sentences
+        # Save the html element each sentence is in (-1 if none) so they aren't searched for when viewing the report
+        elements = [dict(element, text=self.dao.truncate_str(element["text"], 800)) for element in original_html]
+        sentences = [dict(html=self.dao.truncate_str(sentence["html"], 900)) for sentence in html_sentences]
+        with stage_timer.stage("tokenize"):
+            found_positions = self.web_svc.find_sentences_in_html(elements, sentences)
+        for sentence, found_idx in zip(html_sentences, found_positions):
+            sentence["elem_index"] = -1 if found_idx is None else found_idx
+        return html_sentences, original_html, article_date
+
+    async def _save_fetched_article(self, report_id, html_sentences, original_html, article_date):
+        """Function to save a report's html elements with a checkpoint of its fetched article (in one transaction)."""
+        article = dict(sentences=html_sentences, date=article_date, element_count=len(original_html))
+        progress = dict(
+            report_uid=report_id,
+            sentence_count=len(html_sentences),
+            sentences_done=0,
+            article=json.dumps(article),
         )
-        regex_patterns = await self.dao.get("regex_patterns")
-        reg_analyzed_html = self.reg_svc.analyze_html(regex_patterns, html_sentences)
-
-        # Merge ML and Reg hits
-        analyzed_html = self.combine_ml_and_reg(ml_analyzed_html, reg_analyzed_html)
+        sql_list = [await self.dao.insert_generate_uid("report_sentence_queue_progress", progress, return_sql=True)]
+        for e_idx, element in enumerate(original_html):
+            element["text"] = self.dao.truncate_str(element["text"], 800)
+            html_element = dict(
+                report_uid=report_id,
+                text=element["text"],
+                tag=element["tag"],
+                elem_index=e_idx,
+                found_status=self.dao.db_false_val,
+            )
+            _, element_sql = await self.dao.insert_with_backup_sql("original_html", html_element)
+            sql_list.extend(element_sql)
+        if not await self.dao.run_sql_list(sql_list=sql_list):
+            raise RuntimeError(f"Fetched article could not be saved for report {report_id}.")
 
-        for s_idx, sentence in enumerate(analyzed_html):
+    async def _save_analysed_sentences(self, criteria, analyzed_html, start_index, article_date):
+        """Function to save a batch of a report's analysed sentences with the progress made (in one transaction)."""
+        report_id = criteria[UID]
+        sql_list = []
+        for s_idx, sentence in enumerate(analyzed_html, start=start_index):
             sentence["text"] = self.dao.truncate_str(sentence["text"], 800)
             sentence["html"] = self.dao.truncate_str(sentence["html"], 900)
+            save_args = (report_id, sentence, s_idx)
+            save_kwargs = dict(tech_start_date=article_date, sql_list=sql_list)
             if sentence["ml_techniques_found"]:
-                await self.report_manager.save_ml_techniques(report_id, sentence, s_idx, tech_start_date=article_date)
+                await self.report_manager.save_ml_techniques(*save_args, **save_kwargs)
             elif sentence["reg_techniques_found"]:
-                await self.report_manager.save_reg_techniques(report_id, sentence, s_idx, tech_start_date=article_date)
+                await self.report_manager.save_reg_techniques(*save_args, **save_kwargs)
             else:
                 data = dict(
                     report_uid=report_id,
                     text=sentence["text"],
                     html=sentence["html"],
                     sen_index=s_idx,
+                    elem_index=sentence.get("elem_index"),
                     found_status=self.dao.db_false_val,
                 )
-                await self.dao.insert_with_backup("report_sentences", data)
-
-        for e_idx, element in enumerate(original_html):
-            element["text"] = self.dao.truncate_str(element["text"], 800)
-            html_element = dict(
-                report_uid=report_id,
-                text=element["text"],
-                tag=element["tag"],
-                elem_index=e_idx,
-                found_status=self.dao.db_false_val,
-            )
-            await self.dao.insert_with_backup("original_html", html_element)
-
-        # The report is about to be moved out of the queue
+                _, sentence_sql = await self.dao.insert_with_backup_sql("report_sentences", data)
+                sql_list.extend(sentence_sql)
+        # Only save the batch if the checkpoint is where it started (and this process still has the report's job)
+        qparam = self.dao.db_qparam
+        progress_sql = (
+            f"UPDATE report_sentence_queue_progress SET sentences_done = {qparam} "
+            f"WHERE report_uid = {qparam} AND sentences_done = {qparam}"
+        )
+        progress_params = [start_index + len(analyzed_html), report_id, start_index]
+        if criteria.get("job_uid"):
+            progress_sql += f" AND EXISTS (SELECT 1 FROM {JOBS_TABLE} WHERE uid = {qparam} AND worker = {qparam})"
+            progress_params += [criteria["job_uid"], self.worker_id]
+        sql_list.append((progress_sql, progress_params, REQUIRE_ROWS))
+        if not await self.dao.run_sql_list(sql_list=sql_list):
+            job = dict(uid=criteria.get("job_uid"), worker=self.worker_id)
+            if criteria.get("job_uid") and not await self.dao.get(JOBS_TABLE, job):
+                # Another process has taken over the report (or it was cancelled): stop without erroring it
+                logging.warning(f"Stopped saving analysis for report {report_id}; its job is no longer held")
+                raise StagesCancelled()
+            raise RuntimeError(f"Analysed sentences could not be saved for report {report_id}.")
+
+    async def _save_analysed_report(self, report_id, article_date):
+        """Function to move a report (whose sentences have been saved) out of the queue."""
         update_data = dict(current_status=ReportStatus.NEEDS_REVIEW.value)
         # Save the article-date if we have one
         if article_date:
@@ -514,17 +977,57 @@ class RestService:
         # Add expiry date (now + 1 month)
         self.report_manager.add_report_expiry(data=update_data, months=1)
 
-        # Update card to reflect the end of queue
-        await self.dao.update("reports", where=dict(uid=report_id), data=update_data)
-        # Update the relevant queue for this user
-        self.remove_report_from_queue_map(criteria)
-        logging.info("Finished analysing report " + report_id)
+        # Update card to reflect the end of queue; its progress is no longer needed
+        sql_list = [
+            await self.dao.update("reports", where=dict(uid=report_id), data=update_data, return_sql=True),
+            await self.dao.delete("report_sentence_queue_progress", dict(report_uid=report_id), return_sql=True),
+        ]
+        if not await self.dao.run_sql_list(sql_list=sql_list):
+            raise RuntimeError(f"Report {report_id} could not be moved out of the queue.")
+        await self.data_svc.report_cache.bump(report_id)
+
+    async def save_analysis_metrics(self, criteria, stage_timer, counts):
+        """Function to save how long each stage of analysing a report took."""
+        stage_times = stage_timer.totals()
+        data = dict(
+            report_uid=criteria[UID],
+            url=self.dao.truncate_str(criteria.get(URL) or "", 500),
+            date_analysed=datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            total_time=sum(stage_times.values()),
+            **{f"{stage}_time": stage_times.get(stage, 0) for stage in ANALYSIS_STAGES},
+            **{count: counts.get(count, 0) for count in ANALYSIS_COUNTS},
+        )
+        await self.dao.insert_generate_uid("report_analysis_metrics", data)
 
-        # DB tidy-up including removing report if low quality
-        await self.dao.delete("report_sentence_queue_progress", dict(report_uid=report_id))
+    async def analysis_metrics(self, request, criteria=None):
+        """Function to return the stage-timings of the most-recently analysed reports (or a given report)."""
+        await self.web_svc.action_allowed(request, "view-analysis-metrics")
+        criteria = criteria or dict()
+        try:
+            limit = max(1, min(int(criteria.get("limit", ANALYSIS_METRICS_LIMIT)), ANALYSIS_METRICS_LIMIT))
+        except (TypeError, ValueError):
+            return dict(error="Limit must be a number.", alert_user=1)
+        return await self.data_svc.get_analysis_metrics(report_id=criteria.get(UID), limit=limit)
+
+    async def analysis_profiles(self, request, criteria=None):
+        """Function to return the fraction of reports being profiled and the reports with a profile to download."""
+        await self.web_svc.action_allowed(request, "view-analysis-profiles")
+        return dict(
+            sample_rate=self.analysis_profiler.sample_rate,
+            enabled=bool(self.analysis_profiler.directory),
+            reports=self.analysis_profiler.list_profiles(),
+        )
 
-        min_report_techniques = criteria.get("techniques_threshold")
-        await self.remove_report_if_low_quality(report_id, min_report_techniques=min_report_techniques)
+    async def set_analysis_profiling(self, request, criteria=None):
+        """Function to set the fraction of reports to profile whilst they are analysed."""
+        await self.web_svc.action_allowed(request, "set-analysis-profiling")
+        if not self.analysis_profiler.directory:
+            return dict(error="Profiling is not set up: no directory to save profiles in.", alert_user=1)
+        try:
+            self.analysis_profiler.set_sample_rate(criteria["sample_rate"])
+        except (KeyError, TypeError, ValueError):
+            return dict(error="Sample rate must be a number between 0 and 1.", alert_user=1)
+        return REST_SUCCESS
 
     @staticmethod
     def combine_ml_and_reg(ml_analyzed_html, reg_analyzed_html):
@@ -536,6 +1039,11 @@ class RestService:
             index += 1
         return analyzed_html
 
+    @staticmethod
+    def get_techniques_threshold(min_report_techniques=None):
+        """Function to return how many techniques an automatically-generated report needs to be kept."""
+        return max(min_report_techniques or 0, REPORT_TECHNIQUES_MINIMUM)
+
     async def remove_report_if_low_quality(self, report_id, min_report_techniques=None):
         """Function that removes report if its quality is low."""
         reports_found = await self.data_svc.get_report_by_id_or_title(by_id=True, report=report_id)
@@ -549,7 +1057,7 @@ class RestService:
         unique_techniques_count = await self.data_svc.get_report_unique_techniques_count(report_id=report_id)
 
         # Remove report if amount of unique techniques found doesn't reach the minimum
-        report_techs_threshold = max(min_report_techniques or 0, REPORT_TECHNIQUES_MINIMUM)
+        report_techs_threshold = self.get_techniques_threshold(min_report_techniques)
 
         if unique_techniques_count < report_techs_threshold:
             await self.data_svc.remove_report_by_id(report_id=report_id)
@@ -1,11 +1,9 @@
 import logging
-import nltk
 import re
 
+from functools import lru_cache
+
 from html2text import html2text
-from nltk.corpus import stopwords
-from nltk.stem import SnowballStemmer
-from nltk.tokenize import PunktTokenizer
 
 # Abbreviated words for sentence-splitting
 ABBREVIATIONS = {"dr", "vs", "mr", "mrs", "ms", "prof", "inc", "fig", "e.g", "i.e", "u.s"}
@@ -34,13 +32,58 @@ IPV4_REGEX = re.compile(
 IPV6_REGEX = re.compile(r"\b((?:[a-f0-9]{1,4}:|:){2,7}(?:[a-f0-9]{1,4}|:))\b", re.IGNORECASE | re.VERBOSE)
 
 
+@lru_cache(maxsize=None)
+def check_packs():
+    """Function to check (once) the nltk packs needed for tokenizing are present, downloading any which are not."""
+    # Import here so nltk is only loaded when sentences are to be tokenized
+    import nltk
+
+    try:
+        nltk.data.find("tokenizers/punkt_tab/english/")
+        logging.info("[*] Found punkt_tab")
+    except LookupError:
+        logging.warning("Could not find the punkt_tab pack, downloading now")
+        nltk.download("punkt_tab")
+
+    try:
+        nltk.data.find("corpora/stopwords")
+        logging.info("[*] Found stopwords")
+    except LookupError:
+        logging.warning("Could not find the stopwords pack, downloading now")
+        nltk.download("stopwords")
+
+
+@lru_cache(maxsize=None)
+def get_stopwords_and_stemmer():
+    """Function to return the English stopwords (as a set) and stemmer; loaded once as needed for each sentence."""
+    check_packs()
+    from nltk.corpus import stopwords
+    from nltk.stem import SnowballStemmer
+
+    return frozenset(stopwords.words("english")), SnowballStemmer("english")
+
+
 class TokenService:
     """
     Service to tokenize the sentences of an article.
     """
 
     def __init__(self):
-        self.tokenizer_sen = None
+        self._tokenizer_sen = None
+
+    @property
+    def tokenizer_sen(self):
+        """The sentence tokenizer; created (loading nltk) when first used rather than before the app launches."""
+        if self._tokenizer_sen is None:
+            check_packs()
+            from nltk.tokenize import PunktTokenizer
+
+            self._tokenizer_sen = PunktTokenizer()
+            try:
+                self._tokenizer_sen._params.abbrev_types.update(ABBREVIATIONS)
+            except AttributeError:
+                pass
+        return self._tokenizer_sen
 
     def __rejoin_defanged(self, sentences):
         """
@@ -143,35 +186,16 @@ class TokenService:
     @staticmethod
     async def tokenize(s):
         """Function to remove stopwords from a sentence and return a list of words to match"""
+        english_stopwords, stemmer = get_stopwords_and_stemmer()
+
         word_list = re.findall(r"\w+", s.lower())
-        filtered_words = [word for word in word_list if word not in stopwords.words("english")]
+        filtered_words = [word for word in word_list if word not in english_stopwords]
         """Perform NLP Lemmatization and Stemming methods"""
         lemmed = []
-        stemmer = SnowballStemmer("english")
         for i in filtered_words:
             lemmed.append(stemmer.stem(str(i)))
         return " ".join(lemmed)
 
     async def init(self):
-        await self.check_packs()
-
-        self.tokenizer_sen = PunktTokenizer()
-        try:
-            self.tokenizer_sen._params.abbrev_types.update(ABBREVIATIONS)
-        except AttributeError:
-            pass
-
-    async def check_packs(self):
-        try:
-            nltk.data.find("tokenizers/punkt_tab/english/")
-            logging.info("[*] Found punkt_tab")
-        except LookupError:
-            logging.warning("Could not find the punkt_tab pack, downloading now")
-            nltk.download("punkt_tab")
-
-        try:
-            nltk.data.find("corpora/stopwords")
-            logging.info("[*] Found stopwords")
-        except LookupError:
-            logging.warning("Could not find the stopwords pack, downloading now")
-            nltk.download("stopwords")
+        """Function to load nltk and the sentence tokenizer now, rather than when the first sentence is tokenized."""
+        return self.tokenizer_sen
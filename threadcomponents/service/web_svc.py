@@ -3,26 +3,29 @@
 # To see its full history, please use `git log --follow <filename>` to view previous commits and additional contributors
 
 import logging
-import newspaper
 import requests
 
 from aiohttp import web
-from bs4 import BeautifulSoup
+from bisect import bisect_left, bisect_right
 from contextlib import suppress
 from ipaddress import ip_address
 from lxml import etree, html
-from newspaper.article import ArticleDownloadState
 from urllib.parse import urlparse
 
+from threadcomponents.helpers.timing import StageTimer
+
 # Blocked image types
 BLOCKED_IMG_TYPES = {"gif", "apng", "webp", "avif", "mng", "flif"}
+# Separator used when joining html texts to search them together (this does not appear in html text)
+HTML_TEXT_SEPARATOR = "\x00"
 
 
 class WebService:
     # Static class variables for the keys in app_routes
     HOME_KEY, COOKIE_KEY, EDIT_KEY, ABOUT_KEY, REST_KEY = "home", "cookies", "edit", "about", "rest"
     EXPORT_PDF_KEY, EXPORT_NAV_KEY, EXPORT_AFB_KEY, STATIC_KEY = "export_pdf", "export_nav", "export_afb", "static"
-    HOW_IT_WORKS_KEY, WHAT_TO_SUBMIT_KEY = "how_it_works", "what_to_submit"
+    EXPORT_BULK_KEY, METRICS_KEY, ANALYSIS_PROFILE_KEY = "export_bulk", "metrics", "analysis_profile"
+    HOW_IT_WORKS_KEY, WHAT_TO_SUBMIT_KEY, ANALYSIS_PROGRESS_KEY = "how_it_works", "what_to_submit", "analysis_progress"
     REPORT_PARAM = "file"
     # Variations of punctuation we want to note
     HYPHENS = [
@@ -89,7 +92,11 @@ class WebService:
             self.EXPORT_PDF_KEY: route_prefix + "/export/pdf/{%s}" % self.REPORT_PARAM,
             self.EXPORT_NAV_KEY: route_prefix + "/export/nav/{%s}" % self.REPORT_PARAM,
             self.EXPORT_AFB_KEY: route_prefix + "/export/afb/{%s}" % self.REPORT_PARAM,
+            self.EXPORT_BULK_KEY: route_prefix + "/export/bulk",
             self.HOW_IT_WORKS_KEY: route_prefix + "/how-thread-works",
+            self.METRICS_KEY: route_prefix + "/metrics",
+            self.ANALYSIS_PROFILE_KEY: route_prefix + "/analysis-profile/{%s}" % self.REPORT_PARAM,
+            self.ANALYSIS_PROGRESS_KEY: route_prefix + "/analysis-progress",
             self.STATIC_KEY: route_prefix + "/theme/",
         }
         if not self.is_local:
@@ -213,107 +220,177 @@ class WebService:
             return_val_on_error=False,
         )
 
-    async def map_all_html(self, url_input, sentence_limit=None):
+    async def map_all_html(self, url_input, sentence_limit=None, stage_timer=None):
+        # Import here so newspaper is only loaded when an article is retrieved
+        import newspaper
+        from newspaper.article import ArticleDownloadState
+
+        stage_timer = stage_timer or StageTimer(enabled=False)
         a = newspaper.Article(url_input, keep_article_html=True)
         a.config.MAX_TEXT = None
-        a.download()
+        # Don't wait on a slow site for longer than downloading is allowed to take
+        if stage_timer.deadlines.get("download"):
+            a.config.request_timeout = min(a.config.request_timeout, stage_timer.deadlines["download"])
+        with stage_timer.stage("download"):
+            a.download()
         if a.download_state != ArticleDownloadState.SUCCESS:
             return None, None
-        a.parse()
-        if not a.text:  # HTML may have been retrieved but if there is no text, ignore this url
-            return None, None
-        results, plaintext, images, seen_images = [], [], [], []
-        images = await self._collect_all_images(a.images)
-        plaintext = await self._extract_text_as_list(a.text)
-        html_elements, htmltags, htmltext = self._extract_html_as_list(a.article_html)
-        text_count = 0
+        with stage_timer.stage("parse"):
+            a.parse()
+            if not a.text:  # HTML may have been retrieved but if there is no text, ignore this url
+                return None, None
+            images = await self._collect_all_images(a.images)
+            plaintext = await self._extract_text_as_list(a.text)
+            results = self.align_plaintext_with_html(a.article_html, plaintext, images, sentence_limit=sentence_limit)
+        return results, a
 
+    def align_plaintext_with_html(self, html_doc, plaintext, images, sentence_limit=None):
+        """Function to match each plaintext line with its html element (and any images before it) in a single pass.
+        :param html_doc: the article's html string; this is parsed once.
+        :param plaintext: the article's non-empty plaintext lines in order.
+        :param images: the image URLs the article was found to have.
+        :param sentence_limit: optional maximum number of plaintext lines to process.
+        :return: The list of text and image dictionaries in the order of the article.
+        """
+        html_tags, html_text, img_positions, img_sources = self._index_html_elements(html_doc)
+        # Map each element's text to the (ascending) positions it appears in
+        text_positions = dict()
+        for position, text in enumerate(html_text):
+            text_positions.setdefault(text, []).append(position)
+        # Images which don't have any unseen sources left can be skipped on later scans; skip_to[i] points to the next
+        # image-element (by its index in img_positions) that may still have an unseen source
+        skip_to = list(range(len(img_positions) + 1))
+        results, seen_images, image_map = [], set(), dict()
+        last_seen_image = None
+        text_count = 0
         # Loop through pt one by one, matching its line with a forward-advancing pointer on the html
         counter = 0
         for pt in plaintext:
-            text_match_found = False
+            # The html texts are stripped so only the stripped line can match; find its next position from counter
+            temp = pt.strip()
+            positions = text_positions.get(temp, [])
+            match_idx = bisect_left(positions, counter)
+            text_match_found = match_idx < len(positions)
+            # Images up to and including the matched element are considered (or up to the end if there is no match)
+            last_position = positions[match_idx] if text_match_found else len(html_text) - 1
             image_found = False
-            # Loop through the html elements to process images and text (if we didn't find the plaintext)
-            for forward_advancer in range(counter, len(html_elements)):
-                if "src=" in html_elements[forward_advancer] and image_found is False:
-                    # Found an image, put it in data but don't advance in case there's text.
-                    soup = BeautifulSoup(html_elements[forward_advancer], "html.parser")
-                    current_images = soup.findAll("img")
-                    for cur_img in current_images:
-                        try:
-                            source = cur_img["src"]
-                        # All img tags should have a src attribute. In case this one doesn't, there is no image to save
-                        except KeyError:
-                            continue
-                        # If no source was obtained or this image is a blocked filetype: continue
-                        if not source or any(source.lower().endswith(img_type) for img_type in BLOCKED_IMG_TYPES):
-                            continue
-                        img_dict = await self._match_and_construct_img(images, source)
-                        if source not in seen_images:
-                            results.append(img_dict)
-                            seen_images.append(source)
-                            image_found = True
-                for temp in [pt, pt.strip()]:
-                    if temp == htmltext[forward_advancer]:
-                        # Found the matching word, put the text into the data.
-                        results.append(self._construct_text_dict(temp, htmltags[forward_advancer]))
-                        counter = forward_advancer + 1
-                        text_match_found = True
-                        break
-                if text_match_found:
+            img_idx = self._next_unskipped(skip_to, bisect_left(img_positions, counter))
+            while (img_idx < len(img_positions)) and (img_positions[img_idx] <= last_position):
+                # Found an image, put it in data but don't advance in case there's text.
+                for source in img_sources[img_idx]:
+                    if source not in seen_images:
+                        results.append(self._match_and_construct_img(images, source, image_map=image_map))
+                        seen_images.add(source)
+                        last_seen_image = source
+                        image_found = True
+                if image_found:
                     break
+                # Every source of this element has been seen: don't check this element again
+                skip_to[img_idx] = img_idx + 1
+                img_idx = self._next_unskipped(skip_to, img_idx + 1)
             # Tidy up depending on if images or text were found
-            if not text_match_found:
-                if image_found:
-                    # Didn't find matching text, but found an image. Image is misplaced.
-                    seen_images = seen_images[:-1]
-                    results = results[:-1]
-                else:
-                    # Add this missing text with default <p> tag
-                    results.append(self._construct_text_dict(pt, "p"))
-                    text_match_found = True
+            if text_match_found:
+                # Found the matching text, put the text into the data.
+                results.append(self._construct_text_dict(temp, html_tags[positions[match_idx]]))
+                counter = positions[match_idx] + 1
+            elif image_found:
+                # Didn't find matching text, but found an image. Image is misplaced.
+                seen_images.discard(last_seen_image)
+                results.pop()
+            else:
+                # Add this missing text with default <p> tag
+                results.append(self._construct_text_dict(pt, "p"))
+                text_match_found = True
+            # If all of the image's sources were added, it doesn't need to be checked again
+            if image_found and all(source in seen_images for source in img_sources[img_idx]):
+                skip_to[img_idx] = img_idx + 1
             if text_match_found:
                 text_count += 1
             if sentence_limit and (text_count >= sentence_limit):
                 break
-        return results, a
+        return results
+
+    @staticmethod
+    def find_sentences_in_html(original_html, sentences):
+        """Function to return the position in the html-list of the element each sentence is in (None if not found),
+        searching on from the last sentence found: html and sentences should be in order of elem_index and sen_index
+        respectively. Unfound sentences search the rest of the html so this is done once, when a report is analysed."""
+        # Index the html-list: the positions of its text elements joined into one searchable string
+        text_positions, text_offsets, texts = [], [], []
+        offset = 0
+        for e_idx, element in enumerate(original_html):
+            if element["tag"] != "img":
+                text = element["text"] or ""
+                text_positions.append(e_idx)
+                text_offsets.append(offset)
+                texts.append(text)
+                offset += len(text) + len(HTML_TEXT_SEPARATOR)
+        joined_text = HTML_TEXT_SEPARATOR.join(texts)
+        # The index we are up to for iterating the html list
+        latest_html_idx = 0
+        # Previous searches for a sentence's html: the position searched from and the position found (or None)
+        searched = dict()
+        found_positions = []
+        for sentence_data in sentences:
+            sentence_html = sentence_data["html"]
+            found_idx, previous = None, searched.get(sentence_html)
+            # A previous search is still valid if it started before our position and found nothing or a later element
+            if previous and previous[0] <= latest_html_idx and (previous[1] is None or previous[1] >= latest_html_idx):
+                found_idx = previous[1]
+            else:
+                # Search the text from the first text element at or after our position
+                text_idx = bisect_left(text_positions, latest_html_idx)
+                if text_idx < len(text_positions) and HTML_TEXT_SEPARATOR not in sentence_html:
+                    match_offset = joined_text.find(sentence_html, text_offsets[text_idx])
+                    if match_offset != -1:
+                        found_idx = text_positions[bisect_right(text_offsets, match_offset) - 1]
+                elif text_idx < len(text_positions):
+                    # The separator can't be used for this sentence so check each element
+                    found_idx = next(
+                        (text_positions[t] for t in range(text_idx, len(texts)) if sentence_html in texts[t]), None
+                    )
+                searched[sentence_html] = (latest_html_idx, found_idx)
+            found_positions.append(found_idx)
+            if found_idx is not None:
+                latest_html_idx = found_idx
+        return found_positions
 
     async def build_final_html(self, original_html, sentences):
         """Function to merge and return html and sentence data for outputting a report: html and sentences should be
         in order of elem_index and sen_index respectively."""
         final_html = []
+        img_positions = [e_idx for e_idx, element in enumerate(original_html) if element["tag"] == "img"]
+        if all(sentence.get("elem_index") is not None for sentence in sentences):
+            # Use the elements the sentences were found in when the report was analysed (-1 if not found)
+            positions = {element.get("elem_index", e_idx): e_idx for e_idx, element in enumerate(original_html)}
+            found_positions = [positions.get(sentence["elem_index"]) for sentence in sentences]
+        else:
+            # Reports analysed before this was saved need their sentences searching for
+            found_positions = self.find_sentences_in_html(original_html, sentences)
         # The index we are up to for iterating the html list
         latest_html_idx = 0
         # The images added to the final-merged-html
         added_image_ids = set()
         # Looping through each sentence...
-        for sentence_data in sentences:
-            found_sentence = False  # flag to track if found in html-list
-            final_html_subset = []  # temp-list that may be added to final_html
-            temp_added_image_ids = set()  # temp-set of images potentially added to final_html
-            # Loop through html-list from last-matching position
-            for e_idx, element in enumerate(original_html[latest_html_idx:]):
-                # If there is an image, add it to temp-lists to potentially be added
-                if element["tag"] == "img" and element["uid"] not in added_image_ids:
-                    final_html_subset.append(self._build_final_image_dict(element))
-                    temp_added_image_ids.add(element["uid"])
-                # If we found the sentence, complete the temp-list with this sentence and break from this loop
-                elif sentence_data["html"] in element["text"]:
-                    final_html_subset.append(self._build_final_html_text(sentence_data, element["tag"]))
-                    latest_html_idx = latest_html_idx + e_idx
-                    found_sentence = True
-                    break
-            # If the sentence was found, the temp list can be added to the final list; update added_image_ids too
-            if found_sentence:
-                final_html += final_html_subset
-                added_image_ids.update(temp_added_image_ids)
+        for sentence_data, found_idx in zip(sentences, found_positions):
+            # If the sentence was found, add any images before it (from the last-matching position) and the sentence
+            if found_idx is not None:
+                img_start, img_end = bisect_left(img_positions, latest_html_idx), bisect_left(img_positions, found_idx)
+                for img_idx in img_positions[img_start:img_end]:
+                    element = original_html[img_idx]
+                    if element["uid"] not in added_image_ids:
+                        final_html.append(self._build_final_image_dict(element))
+                        added_image_ids.add(element["uid"])
+                final_html.append(self._build_final_html_text(sentence_data, original_html[found_idx]["tag"]))
+                latest_html_idx = found_idx
             # If the sentence was not found, add it as a <p> to final list to preserve order of the sentences
-            # Disregard any images (in final_html_subset) as this may be out of order
+            # Disregard any images as these may be out of order
             else:
                 final_html.append(self._build_final_html_text(sentence_data, "p"))
         # Just in case we missed any images, add them at the end
-        for element in original_html:
-            if element["tag"] == "img" and element["uid"] not in added_image_ids:
+        for img_idx in img_positions:
+            element = original_html[img_idx]
+            if element["uid"] not in added_image_ids:
                 final_html.append(self._build_final_image_dict(element))
                 added_image_ids.add(element["uid"])
         return final_html
@@ -339,6 +416,8 @@ class WebService:
     async def get_url(self, url, returned_format=None):
         if returned_format == "html":
             logging.info("[!] HTML support is being refactored. Currently data is being returned plaintext")
+        import newspaper
+
         r = self.get_response_from_url(url)
         # Use the response text to get contents for this url
         b = newspaper.fulltext(r.text)
@@ -455,36 +534,90 @@ class WebService:
                 3. the list of texts for each html element.
                 Each list will be the same length.
         """
-        # Get the html element object based on the provided string
-        html_parsed = html.fromstring(html_doc)
-        # Keep all elements that have child nodes, have text or are images
-        filtered = [element for element in html_parsed if element.text or len(element) or element.tag == "img"]
         # Set up the three lists for the elements, tags and text
         html_elements, html_tags_list, html_text_list = [], [], []
         # Iterate through each element and populate the three lists
-        for element in filtered:
+        for element in WebService._get_html_elements(html_doc):
             # element as string including the tags
             element_as_text = etree.tostring(element, method="html").decode()
             html_elements.append(element_as_text)
             # element's text content (without tags)
             html_text_list.append(str(element.text_content()).strip())
             # Thread currently supports these types of tags, populate the tag list with one of these
-            if "<h" in element_as_text:
-                html_tags_list.append("header")
-            elif "<li" in element_as_text:
-                html_tags_list.append("li")
-            else:
-                html_tags_list.append("p")
+            html_tags_list.append(WebService._get_element_tag_type(element_as_text))
         # Return the three lists
         return html_elements, html_tags_list, html_text_list
 
     @staticmethod
-    async def _match_and_construct_img(images, source):
-        for i in range(0, len(images)):
-            if source in images[i]:
-                source = images[i]
+    def _index_html_elements(html_doc):
+        """Get the html data needed to align an article given a html string; the string is only parsed once.
+        :param html_doc: the html string.
+        :return: Four lists: 1. the tag of each html element.
+                2. the list of texts for each html element.
+                3. the (ascending) positions of the elements which have images to add.
+                4. the image sources to add for each position in the third list.
+        """
+        html_tags_list, html_text_list, img_positions, img_sources = [], [], [], []
+        for position, element in enumerate(WebService._get_html_elements(html_doc)):
+            element_as_text = etree.tostring(element, method="html").decode()
+            html_text_list.append(str(element.text_content()).strip())
+            html_tags_list.append(WebService._get_element_tag_type(element_as_text))
+            if "src=" not in element_as_text:
+                continue
+            # Collect this element's images (including itself if it is one) from the already-parsed tree
+            sources = []
+            for cur_img in element.iter("img"):
+                source = cur_img.get("src")
+                # If no source was obtained or this image is a blocked filetype: continue
+                if not source or any(source.lower().endswith(img_type) for img_type in BLOCKED_IMG_TYPES):
+                    continue
+                sources.append(source)
+            if sources:
+                img_positions.append(position)
+                img_sources.append(sources)
+        return html_tags_list, html_text_list, img_positions, img_sources
+
+    @staticmethod
+    def _next_unskipped(skip_to, idx):
+        """Function to follow (and shorten) the skip-pointers from an index to the next index not being skipped."""
+        root = idx
+        while skip_to[root] != root:
+            root = skip_to[root]
+        while skip_to[idx] != root:
+            skip_to[idx], idx = root, skip_to[idx]
+        return root
+
+    @staticmethod
+    def _get_html_elements(html_doc):
+        """Function to parse a html string and return its top-level elements that we want to keep."""
+        # Get the html element object based on the provided string
+        html_parsed = html.fromstring(html_doc)
+        # Keep all elements that have child nodes, have text or are images
+        return [element for element in html_parsed if element.text or len(element) or element.tag == "img"]
+
+    @staticmethod
+    def _get_element_tag_type(element_as_text):
+        """Function to return which of Thread's supported tags a html element (as a string) should be displayed as."""
+        if "<h" in element_as_text:
+            return "header"
+        elif "<li" in element_as_text:
+            return "li"
+        return "p"
+
+    @staticmethod
+    def _match_and_construct_img(images, source, image_map=None):
+        # Use an already-matched source if we have seen it before
+        if image_map is not None and source in image_map:
+            matched_source = image_map[source]
+        else:
+            matched_source = source
+            for i in range(0, len(images)):
+                if matched_source in images[i]:
+                    matched_source = images[i]
+            if image_map is not None:
+                image_map[source] = matched_source
         img_dict = dict()
-        img_dict["text"] = source
+        img_dict["text"] = matched_source
         img_dict["tag"] = "img"
         img_dict["ml_techniques_found"] = []
         img_dict["reg_techniques_found"] = []
@@ -21,6 +21,8 @@ const iocUpdateBtnSelector = "#iocUpdateBtn";
 var senTTPForm = "#ttpDatesForm";
 // The URL for the rest requests
 var restUrl = $("script#basicsScript").data("rest-url");
+// The URL for the progress of analysing queued reports
+var progressUrl = $("script#basicsScript").data("progress-url");
 // If this script is being run locally
 var isLocal = $("script#basicsScript").data("run-local");
 // Is this report completed?
@@ -68,6 +70,47 @@ function page_refresh() {
   window.location.reload(true);
 }
 
+function watchAnalysisProgress(etag=null) {
+  // Only watch when there are queued reports on the page
+  var progressElems = $(".analysis-progress");
+  if (!progressElems.length) {
+    return;
+  }
+  // The server replies once the progress differs from what we have (by ETag) or after waiting a while
+  $.ajax({
+    url: progressUrl,
+    type: "GET",
+    data: {"wait": 25},
+    headers: etag ? {"If-None-Match": etag} : {},
+    success: function(data, textStatus, xhr) {
+      var finished = false;
+      (data?.reports || []).forEach(function(report) {
+        var elem = progressElems.filter(function() {
+          return $(this).attr("data-report-title") === report.title;
+        });
+        if (!elem.length) {
+          return;
+        }
+        finished = finished || ["done", "error"].includes(report.stage);
+        var text = "Stage: " + report.stage;
+        if (report.sentence_count) {
+          text += " (" + report.sentences_done + "/" + report.sentence_count + " sentences)";
+        }
+        elem.text(text);
+      });
+      // Refresh the page once a report has left the queue
+      if (finished) {
+        page_refresh();
+      } else {
+        watchAnalysisProgress(xhr.getResponseHeader("ETag") || etag);
+      }
+    },
+    error: function() {
+      setTimeout(watchAnalysisProgress, 10000);
+    }
+  });
+}
+
 function prefixHttp(urlInput) {
   // Obtain the current url for this input box
   var initialInput = urlInput.value;
@@ -203,6 +246,12 @@ function deleteReport(reportTitle) {
   }
 }
 
+function cancelReport(reportTitle) {
+  if (confirm("Are you sure you want to cancel the analysis of this report?")) {
+    restRequest("POST", {"index": "cancel_report", "report_title": reportTitle}, page_refresh);
+  }
+}
+
 function rollbackReport(reportTitle) {
   if (confirm("Are you sure you want to rollback this report to NEEDS REVIEW?")) {
     restRequest("POST", {"index": "rollback_report", "report_title": reportTitle}, page_refresh);
@@ -833,5 +882,6 @@ $(document).ready(function() {
   // addDeleteListener(); inputs are now interacted with when a sentence is selected
   isCompleted = $("script#reportDetails").data("completed");
   importFont();
+  watchAnalysisProgress();
   // initialiseCountrySelects();
 });